@@ -0,0 +1,85 @@
+import datetime
+import statistics
+import sys
+import time
+
+import db
+import sharing
+from async_events import AsyncDayLoader
+from events import load_day
+from synthetic import FESTIVAL_START, seed_database
+from testdb import config_for_tests, reset_database
+
+# Wipes and reseeds the test database (see testdb.py), then compares loading a
+# share-hydrated day synchronously with loading it concurrently, as the number
+# of people sharing with the user grows.
+
+DATE = FESTIVAL_START + datetime.timedelta(days=7)
+
+
+def share_with(config, user_id, sharer_ids):
+    with db.cursor(config) as cur:
+        cur.execute("SELECT email FROM users WHERE id = %s", (user_id,))
+        email = cur.fetchone()[0]
+        cur.execute("DELETE FROM shares WHERE shared_with_email = %s", (email,))
+        for sharer_id in sharer_ids:
+            cur.execute(
+                "INSERT INTO shares (shared_by, shared_with_email) VALUES (%s, %s)",
+                (sharer_id, email),
+            )
+    sharing.invalidate()
+
+
+def time_load(load, iterations):
+    load()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        load()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def describe(timings):
+    timings = sorted(timings)
+    return "p50 {:7.2f}ms p99 {:7.2f}ms".format(
+        1000 * statistics.median(timings),
+        1000 * timings[int(len(timings) * 0.99) - 1],
+    )
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    sharer_counts = (0, 1, 2, 4, 8, 16, 32)
+
+    config = config_for_tests()
+    reset_database(config)
+    with db.cursor(config) as cur:
+        user_ids = seed_database(cur, users=max(sharer_counts) + 1, shares_per_user=0)
+    user_id, sharer_ids = user_ids[0], user_ids[1:]
+
+    # Both paths get a pool of connections, as they would in a server worker.
+    db.open_pool(config, maxconn=1)
+    loader = AsyncDayLoader(config, max_connections=max(sharer_counts) + 1)
+    print("{} iterations per measurement".format(iterations))
+    try:
+        for sharer_count in sharer_counts:
+            share_with(config, user_id, sharer_ids[:sharer_count])
+            synchronous = time_load(
+                lambda: load_day(config, user_id, DATE, True), iterations
+            )
+            concurrent = time_load(
+                lambda: loader.load_day(user_id, DATE, True), iterations
+            )
+            print(
+                "{:>3} sharers   synchronous {}   concurrent {}".format(
+                    sharer_count, describe(synchronous), describe(concurrent)
+                )
+            )
+    finally:
+        loader.close()
+        db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import asyncio
+import threading
+from collections import defaultdict
+from typing import List, Optional
+
+import asyncpg
+
+import db
+import query_budget
+import sharing
+from events import (
+    DAY_QUERY,
+    SHARED_DAY_QUERY,
+    Day,
+    Event,
+    Filter,
+    day_bounds,
+    day_from_rows,
+    filter_events,
+    shared_interests_from_rows,
+)
+from travel import TravelTimes
+
+# Read-only counterparts of the loaders in events.py, which run their queries
+# concurrently rather than one after another.
+
+
+async def create_pool(config, max_connections=10):
+    return await asyncpg.create_pool(
+        database=config.database_name,
+        min_size=1,
+        max_size=max_connections,
+        server_settings={"application_name": db.application_name()},
+    )
+
+
+async def get_shared_by_user_ids_and_emails_async(pool, user_id):
+    graph, generation = sharing.cached_share_graph()
+    if graph is None:
+        async with pool.acquire() as conn:
+            graph = sharing.share_graph_from_rows(
+                await _fetch(conn, sharing.SHARES_QUERY)
+            )
+        sharing.store_share_graph(graph, generation)
+    return list(graph.shared_by.get(user_id, ()))
+
+
+async def load_events_async(
+    pool,
+    user_id,
+    date,
+    filter: Filter,
+    hydrate_shares,
+    email=None,
+    travel_times: Optional[TravelTimes] = None,
+) -> List[Event]:
+    return filter_events(
+        await load_day_async(pool, user_id, date, hydrate_shares, email=email),
+        filter,
+        travel_times,
+    )
+
+
+async def load_day_async(pool, user_id, date, hydrate_shares, email=None) -> Day:
+    if hydrate_shares:
+        rows, shared_interests = await asyncio.gather(
+            _fetch_day_rows(pool, user_id, date),
+            _load_shared_interests(pool, user_id, date),
+        )
+    else:
+        rows = await _fetch_day_rows(pool, user_id, date)
+        shared_interests = defaultdict(set)
+    return day_from_rows(rows, user_id, date, shared_interests, email)
+
+
+async def _fetch_day_rows(pool, user_id, date):
+    start_of_day, end_of_day = day_bounds(date)
+    async with pool.acquire() as conn:
+        return await _fetch(
+            conn,
+            DAY_QUERY.format(user_id="$1", start="$2", end="$3"),
+            user_id,
+            start_of_day,
+            end_of_day,
+        )
+
+
+async def _load_shared_interests(pool, user_id, date):
+    sharers = await get_shared_by_user_ids_and_emails_async(pool, user_id)
+    if not sharers:
+        return defaultdict(set)
+    start_of_day, end_of_day = day_bounds(date)
+    async with pool.acquire() as conn:
+        rows = await _fetch(
+            conn,
+            SHARED_DAY_QUERY.format(user_ids="$1", start="$2", end="$3"),
+            [shared_by_user_id for shared_by_user_id, _ in sharers],
+            start_of_day,
+            end_of_day,
+        )
+    return shared_interests_from_rows(rows, date)
+
+
+async def _fetch(conn, query, *args):
+    rows = await conn.fetch(query, *args)
+    query_budget.record(query, len(rows))
+    return rows
+
+
+class AsyncDayLoader:
+    # Lets synchronous request handlers use the async loaders, by running an
+    # event loop and connection pool on a thread of its own. Both are created
+    # on first use, so a loader can be created before a server forks.
+
+    def __init__(self, config, max_connections=10):
+        self.config = config
+        self.max_connections = max_connections
+        self._loop = None
+        self._thread = None
+        self._pool = None
+        self._starting = threading.Lock()
+
+    def load_day(self, user_id, date, hydrate_shares, email=None) -> Day:
+        return self._run(
+            lambda pool: load_day_async(
+                pool, user_id, date, hydrate_shares, email=email
+            )
+        )
+
+    def load_events(
+        self,
+        user_id,
+        date,
+        filter: Filter,
+        hydrate_shares,
+        email=None,
+        travel_times: Optional[TravelTimes] = None,
+    ) -> List[Event]:
+        return self._run(
+            lambda pool: load_events_async(
+                pool,
+                user_id,
+                date,
+                filter,
+                hydrate_shares,
+                email=email,
+                travel_times=travel_times,
+            )
+        )
+
+    def close(self):
+        with self._starting:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._pool.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+            self._pool = None
+
+    def _run(self, make_coroutine):
+        loop, pool = self._start()
+        return asyncio.run_coroutine_threadsafe(make_coroutine(pool), loop).result()
+
+    def _start(self):
+        with self._starting:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=loop.run_forever, name="async-day-loader", daemon=True
+                )
+                self._thread.start()
+                self._pool = asyncio.run_coroutine_threadsafe(
+                    create_pool(self.config, self.max_connections), loop
+                ).result()
+                self._loop = loop
+            return self._loop, self._pool
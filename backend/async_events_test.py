@@ -0,0 +1,71 @@
+import dataclasses
+import datetime
+import unittest
+
+import events
+from async_events import AsyncDayLoader
+from db import cursor
+from synthetic import FESTIVAL_START, seed_database
+from testdb import config_for_tests, reset_database
+
+DATE = FESTIVAL_START + datetime.timedelta(days=7)
+
+
+class TestAsyncDayLoader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.config = config_for_tests()
+        reset_database(cls.config)
+        with cursor(cls.config) as cur:
+            cls.user_ids = seed_database(
+                cur, venues=20, shows=200, users=20, interests_per_user=50
+            )
+        cls.loader = AsyncDayLoader(cls.config)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loader.close()
+
+    def test_matches_synchronous_load_day(self):
+        for user_id in self.user_ids:
+            for hydrate_shares in (False, True):
+                with self.subTest(user_id=user_id, hydrate_shares=hydrate_shares):
+                    self.assertEqual(
+                        events.load_day(self.config, user_id, DATE, hydrate_shares),
+                        self.loader.load_day(user_id, DATE, hydrate_shares),
+                    )
+
+    def test_shared_interests_are_loaded(self):
+        shared_by = set()
+        for user_id in self.user_ids:
+            day = self.loader.load_day(user_id, DATE, True)
+            shared_by |= {
+                (user_id, shared.user_id)
+                for event in day.events
+                for shared in event.shared_interests
+            }
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT users.id, shares.shared_by FROM shares "
+                + "INNER JOIN users ON users.email = shares.shared_with_email"
+            )
+            shares = set(cur.fetchall())
+        self.assertTrue(shared_by)
+        self.assertLessEqual(shared_by, shares)
+
+    def test_load_events_matches_synchronous_load_events(self):
+        display_filter = dataclasses.replace(events.Filter.show_all(), show_like=False)
+        self.assertEqual(
+            events.load_events(
+                self.config, self.user_ids[1], DATE, display_filter, True
+            ),
+            self.loader.load_events(self.user_ids[1], DATE, display_filter, True),
+        )
+
+    def test_unknown_user(self):
+        day = self.loader.load_day(self.user_ids[-1] + 1000, DATE, True)
+        self.assertEqual((), day.events)
+
+
+if __name__ == "__main__":
+    unittest.main()
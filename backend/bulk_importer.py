@@ -0,0 +1,235 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, NamedTuple, Optional
+
+import psycopg2
+import requests
+
+import catalog
+import db
+from config import Config
+from db import cursor
+from importer import import_rows, lookup_venue_ids, parse_source, write_shows
+
+# Imports many users' edfringe exports at once. Files are parsed in a pool of
+# processes, the shows they list are written once between them, and then each
+# user's interests are written in a transaction of their own, several users at
+# a time.
+
+
+class ManifestEntry(NamedTuple):
+    email: str
+    path_or_url: str
+
+
+@dataclass
+class FileReport:
+    email: str
+    path_or_url: str
+    rows: int = 0
+    parse_seconds: float = 0.0
+    write_seconds: float = 0.0
+    error: Optional[str] = None
+
+
+@dataclass
+class BulkReport:
+    files: List[FileReport]
+    shows: int
+    shows_seconds: float
+    total_seconds: float
+
+    @property
+    def failed(self):
+        return [report for report in self.files if report.error is not None]
+
+
+def read_manifest(path) -> List[ManifestEntry]:
+    # One tab-separated email and path or URL per line. Relative paths are
+    # relative to the manifest, and blank lines and lines starting with # are
+    # skipped.
+    directory = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, encoding="utf-8", newline="") as f:
+        for line_number, row in enumerate(csv.reader(f, delimiter="\t"), 1):
+            if not row or not "".join(row).strip() or row[0].startswith("#"):
+                continue
+            if len(row) != 2:
+                raise ValueError(
+                    "Line {} of {}: want email and path or URL, got {}".format(
+                        line_number, path, row
+                    )
+                )
+            email, path_or_url = (value.strip() for value in row)
+            if not path_or_url.startswith("http"):
+                path_or_url = os.path.join(directory, path_or_url)
+            entries.append(ManifestEntry(email, path_or_url))
+    return entries
+
+
+def _parse(path_or_url):
+    # Runs in a worker process, so returns errors rather than raising them.
+    start = time.perf_counter()
+    try:
+        rows = parse_source(path_or_url)
+        error = None
+    except (OSError, ValueError, csv.Error, requests.RequestException) as e:
+        rows = None
+        error = "Couldn't read export: {}".format(e)
+    return rows, time.perf_counter() - start, error
+
+
+def bulk_import(
+    config: Config, entries: List[ManifestEntry], processes=None, threads=8
+) -> BulkReport:
+    start = time.perf_counter()
+    reports = [FileReport(entry.email, entry.path_or_url) for entry in entries]
+
+    # Each file is only parsed once, however many users it's listed for.
+    sources = list(OrderedDict.fromkeys(entry.path_or_url for entry in entries))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        parsed = dict(zip(sources, executor.map(_parse, sources)))
+    rows_by_report = {}
+    for index, report in enumerate(reports):
+        rows, report.parse_seconds, report.error = parsed[report.path_or_url]
+        if rows is not None:
+            report.rows = len(rows)
+            rows_by_report[index] = rows
+
+    with cursor(config) as cur:
+        cur.execute(
+            "SELECT email, id FROM users WHERE email = ANY(%s)",
+            (sorted({entry.email for entry in entries}),),
+        )
+        user_ids = dict(cur.fetchall())
+        venue_ids = lookup_venue_ids(
+            cur,
+            {row.venue_name for rows in rows_by_report.values() for row in rows},
+        )
+        for index, rows in list(rows_by_report.items()):
+            report = reports[index]
+            if report.email not in user_ids:
+                report.error = "Email address not found"
+            else:
+                report.error = next(
+                    (
+                        "Didn't find venue with name {}".format(row.venue_name)
+                        for row in rows
+                        if row.venue_name not in venue_ids
+                    ),
+                    None,
+                )
+            if report.error is not None:
+                del rows_by_report[index]
+
+    # Shows which several files list are written, and their performances
+    # fetched, once.
+    shows_start = time.perf_counter()
+    with cursor(config) as cur:
+        show_ids = write_shows(
+            cur,
+            (row for rows in rows_by_report.values() for row in rows),
+            venue_ids,
+        )
+    shows_seconds = time.perf_counter() - shows_start
+
+    # Files for the same user are written one after another, in manifest order.
+    indices_by_user = OrderedDict()
+    for index in rows_by_report:
+        indices_by_user.setdefault(user_ids[reports[index].email], []).append(index)
+
+    def write_user(user_id, indices):
+        for index in indices:
+            report = reports[index]
+            write_start = time.perf_counter()
+            try:
+                with cursor(config) as cur:
+                    import_rows(cur, user_id, rows_by_report[index], show_ids)
+            except psycopg2.Error as e:
+                report.error = "Couldn't write interests: {}".format(e)
+            report.write_seconds = time.perf_counter() - write_start
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [
+            executor.submit(write_user, user_id, indices)
+            for user_id, indices in indices_by_user.items()
+        ]:
+            future.result()
+
+    return BulkReport(
+        files=reports,
+        shows=len(show_ids),
+        shows_seconds=shows_seconds,
+        total_seconds=time.perf_counter() - start,
+    )
+
+
+def print_report(report: BulkReport, out=sys.stdout):
+    for file_report in report.files:
+        print(
+            "{}\t{}\t{} rows\tparse {:.0f}ms\twrite {:.0f}ms\t{}".format(
+                file_report.email,
+                file_report.path_or_url,
+                file_report.rows,
+                1000 * file_report.parse_seconds,
+                1000 * file_report.write_seconds,
+                file_report.error or "OK",
+            ),
+            file=out,
+        )
+    print(
+        "{} files, {} failed; {} shows written in {:.0f}ms; {:.0f}ms in total".format(
+            len(report.files),
+            len(report.failed),
+            report.shows,
+            1000 * report.shows_seconds,
+            1000 * report.total_seconds,
+        ),
+        file=out,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Imports the edfringe exports listed in a manifest for many users."
+    )
+    parser.add_argument(
+        "manifest", help="File of tab-separated email and path or URL pairs"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Processes to parse files with (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=8,
+        help="Users whose interests are written at once",
+    )
+    args = parser.parse_args()
+
+    config = Config.from_env()
+    entries = read_manifest(args.manifest)
+    db.open_pool(config, maxconn=args.threads)
+    try:
+        report = bulk_import(
+            config, entries, processes=args.processes, threads=args.threads
+        )
+        catalog.refresh_snapshot(config)
+    finally:
+        db.close_pool()
+    print_report(report)
+    if report.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
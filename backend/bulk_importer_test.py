@@ -0,0 +1,153 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import importer
+from bulk_importer import ManifestEntry, bulk_import, read_manifest
+from db import cursor
+from synthetic import seed_database
+from testdb import config_for_tests, reset_database
+
+HEADINGS = "Title\tCategory\tVenue\tDuration\tTimes\tDates\tBook Tickets\tGroup Name"
+
+
+def export(*rows):
+    return "\n".join((HEADINGS,) + rows) + "\n"
+
+
+def new_show(name, venue="Venue 1"):
+    return "{}\tMusic\t{}\t1 hour\t21:00\t11 Aug, 12 Aug\t/whats-on/{}\t".format(
+        name, venue, name
+    )
+
+
+def existing_show(i):
+    return "Synthetic show {}\tComedy\tVenue 1\t1 hour\t21:00\t11 Aug\t/whats-on/synthetic-{}\t".format(
+        i, i
+    )
+
+
+class TestReadManifest(unittest.TestCase):
+    def test_read_manifest(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "manifest.tsv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(
+                    "# Onboarding\n"
+                    "a@example.com\texports/a.csv\n"
+                    "\n"
+                    "b@example.com\thttps://example.com/b.csv\n"
+                )
+            self.assertEqual(
+                [
+                    ManifestEntry(
+                        "a@example.com", os.path.join(directory, "exports/a.csv")
+                    ),
+                    ManifestEntry("b@example.com", "https://example.com/b.csv"),
+                ],
+                read_manifest(path),
+            )
+
+    def test_wrong_number_of_columns(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "manifest.tsv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("a@example.com\n")
+            with self.assertRaises(ValueError):
+                read_manifest(path)
+
+
+class TestBulkImport(unittest.TestCase):
+    def setUp(self):
+        self.config = config_for_tests()
+        reset_database(self.config)
+        with cursor(self.config) as cur:
+            self.user_ids = seed_database(
+                cur,
+                venues=3,
+                shows=10,
+                users=3,
+                interests_per_user=0,
+                shares_per_user=0,
+            )
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, contents):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf_16") as f:
+            f.write(contents)
+        return path
+
+    def liked_urls(self, user_id):
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT shows.edfringe_url FROM interests INNER JOIN shows ON shows.id = interests.show_id "
+                + "WHERE interests.user_id = %s ORDER BY shows.edfringe_url",
+                (user_id,),
+            )
+            return [row[0] for row in cur.fetchall()]
+
+    def test_bulk_import(self):
+        first = self.write("first.csv", export(new_show("shared"), existing_show(1)))
+        second = self.write("second.csv", export(new_show("shared"), new_show("own")))
+        bad_venue = self.write("bad_venue.csv", export(new_show("lost", "Nowhere")))
+        bad_headings = self.write("bad_headings.csv", "Title\n")
+        entries = [
+            ManifestEntry("user0@example.com", first),
+            ManifestEntry("user1@example.com", second),
+            ManifestEntry("user2@example.com", bad_venue),
+            ManifestEntry("user2@example.com", bad_headings),
+            ManifestEntry("nobody@example.com", first),
+            ManifestEntry("user2@example.com", os.path.join(self.directory.name, "x")),
+        ]
+
+        with mock.patch.object(importer, "check_soldout_for_single_time") as check:
+            report = bulk_import(self.config, entries, processes=2, threads=2)
+
+        # The shared new show's performances are only looked up once.
+        self.assertEqual(2, check.call_count)
+        self.assertEqual(3, report.shows)
+        self.assertEqual(
+            [2, 2, 1, 0, 2, 0], [file_report.rows for file_report in report.files]
+        )
+        errors = [file_report.error for file_report in report.files]
+        self.assertEqual([None, None], errors[:2])
+        self.assertEqual("Didn't find venue with name Nowhere", errors[2])
+        self.assertTrue(
+            errors[3].startswith("Couldn't read export: Wrong CSV headings")
+        )
+        self.assertEqual("Email address not found", errors[4])
+        self.assertTrue(errors[5].startswith("Couldn't read export"))
+
+        self.assertEqual(
+            ["/whats-on/shared", "/whats-on/synthetic-1"],
+            self.liked_urls(self.user_ids[0]),
+        )
+        self.assertEqual(
+            ["/whats-on/own", "/whats-on/shared"], self.liked_urls(self.user_ids[1])
+        )
+        self.assertEqual([], self.liked_urls(self.user_ids[2]))
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT count(*) FROM performances INNER JOIN shows ON shows.id = performances.show_id "
+                + "WHERE shows.edfringe_url = '/whats-on/shared'"
+            )
+            self.assertEqual(2, cur.fetchone()[0])
+
+    def test_same_result_as_importing_one_at_a_time(self):
+        path = self.write("export.csv", export(new_show("solo"), existing_show(2)))
+        with mock.patch.object(importer, "check_soldout_for_single_time"):
+            with cursor(self.config) as cur:
+                importer.main(cur, self.user_ids[0], path)
+            bulk_import(
+                self.config, [ManifestEntry("user1@example.com", path)], processes=1
+            )
+        self.assertEqual(
+            self.liked_urls(self.user_ids[0]), self.liked_urls(self.user_ids[1])
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
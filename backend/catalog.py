@@ -0,0 +1,443 @@
+import bisect
+import datetime
+import math
+import mmap
+import os
+import struct
+import threading
+from array import array
+from dataclasses import dataclass, field
+from typing import List, Mapping, NamedTuple, Optional, Sequence
+
+import pytz
+
+from db import cursor
+
+SNAPSHOT_FILENAME = "catalog.bin"
+_SNAPSHOT_MAGIC = b"EFCAT1"
+# Magic, catalog version and when it changed (in microseconds since the
+# epoch), and the number of venues, shows, performances and strings.
+_SNAPSHOT_HEADER = struct.Struct("<6s2xqqIIII")
+
+
+class CatalogVenue(NamedTuple):
+    id: int
+    name: str
+    address: str
+    lat: Optional[float]
+    long: Optional[float]
+
+
+class CatalogShow(NamedTuple):
+    id: int
+    title: str
+    category: str
+    venue_id: int
+    duration: datetime.timedelta
+    edfringe_url: str
+
+
+class CatalogPerformance(NamedTuple):
+    id: int
+    show_id: int
+    datetime_utc: datetime.datetime
+    sold_out: bool
+
+
+class PerformanceColumns(NamedTuple):
+    # The catalog's performances column by column, in the same order: start
+    # times in whole seconds since the epoch, show ids, and whether each is
+    # sold out.
+    starts: Sequence[int]
+    show_ids: Sequence[int]
+    sold_out: Sequence[int]
+
+
+@dataclass
+class Catalog:
+    # The catalog_version the catalog was loaded at, and when that version was
+    # made; see schema/migrations/0003_catalog_version.sql. Versions restart
+    # when the database is recreated, but the time they changed doesn't.
+    version: int
+    venues: Mapping[int, CatalogVenue]
+    shows: Mapping[int, CatalogShow]
+    # Sorted by start time.
+    performances: Sequence[CatalogPerformance]
+    changed_at: Optional[datetime.datetime] = None
+    # The performances' start times, if there's a cheaper way to get them
+    # than from the performances.
+    _starts: Optional[Sequence[datetime.datetime]] = field(default=None, repr=False)
+    # Made from the performances when first asked for, unless given.
+    _columns: Optional[PerformanceColumns] = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self._starts is None:
+            self._starts = [
+                performance.datetime_utc for performance in self.performances
+            ]
+
+    def performance_columns(self) -> PerformanceColumns:
+        # For indexes over every performance, which would otherwise make each
+        # row of a snapshot only to read a field or two from it.
+        if self._columns is None:
+            self._columns = PerformanceColumns(
+                starts=array(
+                    "q",
+                    [
+                        (performance.datetime_utc - _EPOCH)
+                        // datetime.timedelta(seconds=1)
+                        for performance in self.performances
+                    ],
+                ),
+                show_ids=array(
+                    "i", [performance.show_id for performance in self.performances]
+                ),
+                sold_out=array(
+                    "B", [performance.sold_out for performance in self.performances]
+                ),
+            )
+        return self._columns
+
+    def performances_starting_between(self, start, end) -> List[CatalogPerformance]:
+        return self.performances[
+            bisect.bisect_left(self._starts, start) : bisect.bisect_left(
+                self._starts, end
+            )
+        ]
+
+
+def load_catalog(config) -> Catalog:
+    with cursor(config) as cur:
+        # Everything must come from the same snapshot as the version.
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cur.execute("SELECT version, changed_at FROM catalog_version")
+        version, changed_at = cur.fetchone()
+        cur.execute("SELECT id, name, address, latlong[0], latlong[1] FROM venues")
+        venues = {row[0]: CatalogVenue(*row) for row in cur}
+        cur.execute(
+            "SELECT id, title, category, venue_id, duration, edfringe_url FROM shows"
+        )
+        shows = {row[0]: CatalogShow(*row) for row in cur}
+        cur.execute(
+            "SELECT performances.id, performances.show_id, performances.datetime_utc, sold_out.id IS NOT NULL "
+            + "FROM performances LEFT JOIN sold_out ON sold_out.performance_id = performances.id AND sold_out.edition = performances.edition "
+            + "WHERE performances.edition = current_edition() "
+            + "ORDER BY performances.datetime_utc ASC, performances.id ASC"
+        )
+        performances = [CatalogPerformance(*row) for row in cur]
+    return Catalog(
+        version=version,
+        changed_at=changed_at,
+        venues=venues,
+        shows=shows,
+        performances=performances,
+    )
+
+
+# The snapshot is the catalog written out as fixed-width columns and a string
+# table, so that every worker can map the same file rather than each loading
+# and holding a copy of its own. It's rebuilt whenever it's found to be older
+# than the database, and after imports and venue syncs, and is always replaced
+# whole so that a worker never maps one that's partly written.
+#
+# After the header, each column is an array of the type given here, one entry
+# per venue, show or performance, padded to 8 bytes. Venues and shows are in
+# ID order, and performances in the order Catalog keeps them. Strings are
+# indexes into the string table, which is the offset of each string (and of
+# the end of the last) followed by their UTF-8.
+_SNAPSHOT_COLUMNS = (
+    ("venues", "id", "i"),
+    ("venues", "name", "I"),
+    ("venues", "address", "I"),
+    ("venues", "lat", "d"),
+    ("venues", "long", "d"),
+    ("shows", "id", "i"),
+    ("shows", "title", "I"),
+    ("shows", "category", "I"),
+    ("shows", "venue_id", "i"),
+    ("shows", "duration", "q"),
+    ("shows", "edfringe_url", "I"),
+    ("performances", "id", "i"),
+    ("performances", "show_id", "i"),
+    ("performances", "datetime_utc", "q"),
+    ("performances", "sold_out", "B"),
+)
+# Stands in for None in string and duration columns; None lats and longs are
+# NaN.
+_NO_STRING = 0xFFFFFFFF
+_NO_DURATION = -1
+_EPOCH = pytz.utc.localize(datetime.datetime(1970, 1, 1))
+
+
+def _padded(length):
+    return -(-length // 8) * 8
+
+
+def _snapshot_columns(source: Catalog):
+    strings = {}
+
+    def string(value):
+        if value is None:
+            return _NO_STRING
+        return strings.setdefault(value, len(strings))
+
+    def coordinate(value):
+        return math.nan if value is None else value
+
+    venues = [source.venues[venue_id] for venue_id in sorted(source.venues)]
+    shows = [source.shows[show_id] for show_id in sorted(source.shows)]
+    values = {
+        ("venues", "id"): [venue.id for venue in venues],
+        ("venues", "name"): [string(venue.name) for venue in venues],
+        ("venues", "address"): [string(venue.address) for venue in venues],
+        ("venues", "lat"): [coordinate(venue.lat) for venue in venues],
+        ("venues", "long"): [coordinate(venue.long) for venue in venues],
+        ("shows", "id"): [show.id for show in shows],
+        ("shows", "title"): [string(show.title) for show in shows],
+        ("shows", "category"): [string(show.category) for show in shows],
+        ("shows", "venue_id"): [show.venue_id for show in shows],
+        ("shows", "duration"): [
+            (
+                _NO_DURATION
+                if show.duration is None
+                else show.duration // datetime.timedelta(seconds=1)
+            )
+            for show in shows
+        ],
+        ("shows", "edfringe_url"): [string(show.edfringe_url) for show in shows],
+        ("performances", "id"): [performance.id for performance in source.performances],
+        ("performances", "show_id"): [
+            performance.show_id for performance in source.performances
+        ],
+        ("performances", "datetime_utc"): [
+            (performance.datetime_utc - _EPOCH) // datetime.timedelta(seconds=1)
+            for performance in source.performances
+        ],
+        ("performances", "sold_out"): [
+            int(performance.sold_out) for performance in source.performances
+        ],
+    }
+    columns = [
+        array(typecode, values[section, name])
+        for section, name, typecode in _SNAPSHOT_COLUMNS
+    ]
+    encoded = [value.encode("utf-8") for value in strings]
+    offsets = array("Q", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    return len(venues), len(shows), columns, offsets, b"".join(encoded)
+
+
+def write_snapshot(path, source: Catalog):
+    venue_count, show_count, columns, offsets, strings = _snapshot_columns(source)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(
+            _SNAPSHOT_HEADER.pack(
+                _SNAPSHOT_MAGIC,
+                source.version,
+                (
+                    0
+                    if source.changed_at is None
+                    else (source.changed_at - _EPOCH)
+                    // datetime.timedelta(microseconds=1)
+                ),
+                venue_count,
+                show_count,
+                len(source.performances),
+                len(offsets) - 1,
+            )
+        )
+        for column in columns + [offsets]:
+            data = column.tobytes()
+            f.write(data)
+            f.write(bytes(_padded(len(data)) - len(data)))
+        f.write(strings)
+    os.replace(tmp_path, path)
+
+
+class _Strings:
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __getitem__(self, index):
+        if index == _NO_STRING:
+            return None
+        return str(self._data[self._offsets[index] : self._offsets[index + 1]], "utf-8")
+
+
+class _Rows(Sequence):
+    # Rows made on demand from a section's columns.
+
+    def __init__(self, count, make_row):
+        self._count = count
+        self._make_row = make_row
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._make_row(i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return self._make_row(index)
+
+
+class _RowsById(Mapping):
+    def __init__(self, ids, rows: _Rows):
+        self._ids = ids
+        self._rows = rows
+
+    def __getitem__(self, id):
+        index = bisect.bisect_left(self._ids, id)
+        if index == len(self._ids) or self._ids[index] != id:
+            raise KeyError(id)
+        return self._rows[index]
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def read_snapshot(path) -> Optional[Catalog]:
+    # The returned catalog reads from the mapped file, so only the rows which
+    # are used are ever copied out of it, and performance_columns are the
+    # mapped columns themselves.
+    try:
+        with open(path, "rb") as f:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        (
+            magic,
+            version,
+            changed_at,
+            venue_count,
+            show_count,
+            performance_count,
+            string_count,
+        ) = _SNAPSHOT_HEADER.unpack_from(data)
+    except (FileNotFoundError, ValueError, struct.error):
+        return None
+    if magic != _SNAPSHOT_MAGIC:
+        return None
+    counts = {
+        "venues": venue_count,
+        "shows": show_count,
+        "performances": performance_count,
+    }
+    offset = _SNAPSHOT_HEADER.size
+    columns = {}
+    for section, name, typecode in _SNAPSHOT_COLUMNS + (("strings", "offsets", "Q"),):
+        count = string_count + 1 if section == "strings" else counts[section]
+        length = count * array(typecode).itemsize
+        columns[section, name] = data[offset : offset + length].cast(typecode)
+        offset += _padded(length)
+    if len(data) != offset + columns["strings", "offsets"][-1]:
+        return None
+    strings = _Strings(columns["strings", "offsets"], data[offset:])
+
+    def coordinate(value):
+        return None if math.isnan(value) else value
+
+    def venue(i):
+        return CatalogVenue(
+            columns["venues", "id"][i],
+            strings[columns["venues", "name"][i]],
+            strings[columns["venues", "address"][i]],
+            coordinate(columns["venues", "lat"][i]),
+            coordinate(columns["venues", "long"][i]),
+        )
+
+    def show(i):
+        duration = columns["shows", "duration"][i]
+        return CatalogShow(
+            columns["shows", "id"][i],
+            strings[columns["shows", "title"][i]],
+            strings[columns["shows", "category"][i]],
+            columns["shows", "venue_id"][i],
+            None if duration == _NO_DURATION else datetime.timedelta(seconds=duration),
+            strings[columns["shows", "edfringe_url"][i]],
+        )
+
+    def start(i):
+        return datetime.datetime.fromtimestamp(
+            columns["performances", "datetime_utc"][i], pytz.utc
+        )
+
+    def performance(i):
+        return CatalogPerformance(
+            columns["performances", "id"][i],
+            columns["performances", "show_id"][i],
+            start(i),
+            bool(columns["performances", "sold_out"][i]),
+        )
+
+    return Catalog(
+        version=version,
+        changed_at=_EPOCH + datetime.timedelta(microseconds=changed_at),
+        venues=_RowsById(columns["venues", "id"], _Rows(venue_count, venue)),
+        shows=_RowsById(columns["shows", "id"], _Rows(show_count, show)),
+        performances=_Rows(performance_count, performance),
+        _starts=_Rows(performance_count, start),
+        _columns=PerformanceColumns(
+            starts=columns["performances", "datetime_utc"],
+            show_ids=columns["performances", "show_id"],
+            sold_out=columns["performances", "sold_out"],
+        ),
+    )
+
+
+def refresh_snapshot(config) -> Catalog:
+    # Returns the mapped snapshot, first rebuilding it if the catalog has
+    # changed since it was written.
+    path = os.path.join(config.cache_dir, SNAPSHOT_FILENAME)
+    snapshot = read_snapshot(path)
+    if snapshot is not None:
+        with cursor(config) as cur:
+            cur.execute("SELECT version, changed_at FROM catalog_version")
+            if (snapshot.version, snapshot.changed_at) == cur.fetchone():
+                return snapshot
+    loaded = load_catalog(config)
+    os.makedirs(config.cache_dir, exist_ok=True)
+    write_snapshot(path, loaded)
+    return read_snapshot(path) or loaded
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog(config) -> Catalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = refresh_snapshot(config)
+        return _catalog
+
+
+def load_catalog_version(config) -> int:
+    with cursor(config) as cur:
+        cur.execute("SELECT version FROM catalog_version")
+        return cur.fetchone()[0]
+
+
+def invalidate_if_stale(config):
+    # For when changes may have been missed: drops the catalog only if it has
+    # changed, so that a catalog shared with a parent process is kept if it can
+    # be.
+    global _catalog
+    current = _catalog
+    if current is not None and current.version != load_catalog_version(config):
+        with _catalog_lock:
+            if _catalog is current:
+                _catalog = None
+
+
+def invalidate():
+    global _catalog
+    _catalog = None
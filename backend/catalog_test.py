@@ -0,0 +1,164 @@
+import dataclasses
+import datetime
+import os
+import tempfile
+import unittest
+from contextlib import closing
+
+import pytz
+
+import catalog
+import db
+from db import cursor
+from synthetic import seed_database
+from testdb import config_for_tests, reset_database
+
+
+class TestCatalog(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dir = tempfile.TemporaryDirectory()
+        cls.config = dataclasses.replace(
+            config_for_tests(), cache_dir=cls.cache_dir.name
+        )
+        reset_database(cls.config)
+        with cursor(cls.config) as cur:
+            seed_database(cur, venues=5, shows=20, users=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cache_dir.cleanup()
+
+    def tearDown(self):
+        catalog.invalidate()
+
+    def test_load(self):
+        loaded = catalog.load_catalog(self.config)
+        with cursor(self.config) as cur:
+            cur.execute("SELECT count(*) FROM performances")
+            self.assertEqual(cur.fetchone()[0], len(loaded.performances))
+            cur.execute("SELECT performance_id FROM sold_out")
+            sold_out = {row[0] for row in cur}
+        self.assertEqual(20, len(loaded.shows))
+        self.assertEqual(5, len(loaded.venues))
+        starts = [performance.datetime_utc for performance in loaded.performances]
+        self.assertEqual(sorted(starts), starts)
+        self.assertEqual(
+            sold_out,
+            {
+                performance.id
+                for performance in loaded.performances
+                if performance.sold_out
+            },
+        )
+
+    def test_performances_starting_between(self):
+        loaded = catalog.load_catalog(self.config)
+        start = pytz.utc.localize(datetime.datetime(2019, 8, 10, 4))
+        end = start + datetime.timedelta(days=1)
+        self.assertEqual(
+            [
+                performance
+                for performance in loaded.performances
+                if start <= performance.datetime_utc < end
+            ],
+            loaded.performances_starting_between(start, end),
+        )
+
+    def test_invalidate_if_stale(self):
+        loaded = catalog.get_catalog(self.config)
+        catalog.invalidate_if_stale(self.config)
+        self.assertIs(loaded, catalog.get_catalog(self.config))
+
+        # Changing interests doesn't change the catalog.
+        with cursor(self.config) as cur:
+            cur.execute("DELETE FROM interests")
+        catalog.invalidate_if_stale(self.config)
+        self.assertIs(loaded, catalog.get_catalog(self.config))
+
+        with cursor(self.config) as cur:
+            cur.execute(
+                "INSERT INTO sold_out (performance_id) SELECT id FROM performances "
+                + "ON CONFLICT DO NOTHING"
+            )
+        catalog.invalidate_if_stale(self.config)
+        reloaded = catalog.get_catalog(self.config)
+        self.assertIsNot(loaded, reloaded)
+        self.assertLess(loaded.version, reloaded.version)
+        self.assertTrue(
+            all(performance.sold_out for performance in reloaded.performances)
+        )
+
+    def test_writers_dont_wait_for_each_other(self):
+        # Catalog writes used to hold a lock on the version until they
+        # committed, so an import held up every other catalog write.
+        before = catalog.load_catalog_version(self.config)
+        with closing(db.connect(self.config)) as first, closing(
+            db.connect(self.config)
+        ) as second:
+            with first.cursor() as cur:
+                cur.execute("INSERT INTO shows (title) VALUES ('Uncommitted')")
+            with second.cursor() as cur:
+                cur.execute("SET lock_timeout = '2s'")
+                cur.execute("INSERT INTO venues (name) VALUES ('Committed')")
+            second.commit()
+            after_second = catalog.load_catalog_version(self.config)
+            first.commit()
+        self.assertLess(before, after_second)
+        self.assertLess(after_second, catalog.load_catalog_version(self.config))
+
+    def test_snapshot_round_trip(self):
+        loaded = catalog.load_catalog(self.config)
+        path = os.path.join(self.cache_dir.name, "round_trip.bin")
+        catalog.write_snapshot(path, loaded)
+        snapshot = catalog.read_snapshot(path)
+        self.assertEqual(
+            (loaded.version, loaded.changed_at), (snapshot.version, snapshot.changed_at)
+        )
+        self.assertEqual(loaded.venues, dict(snapshot.venues))
+        self.assertEqual(loaded.shows, dict(snapshot.shows))
+        self.assertEqual(loaded.performances, list(snapshot.performances))
+        for loaded_column, snapshot_column in zip(
+            loaded.performance_columns(), snapshot.performance_columns()
+        ):
+            self.assertEqual(list(loaded_column), list(snapshot_column))
+        start = pytz.utc.localize(datetime.datetime(2019, 8, 10, 4))
+        end = start + datetime.timedelta(days=1)
+        self.assertEqual(
+            loaded.performances_starting_between(start, end),
+            snapshot.performances_starting_between(start, end),
+        )
+        with self.assertRaises(KeyError):
+            snapshot.shows[max(loaded.shows) + 1]
+
+    def test_unreadable_snapshot(self):
+        path = os.path.join(self.cache_dir.name, "unreadable.bin")
+        self.assertIsNone(catalog.read_snapshot(path))
+        for contents in (b"", b"not a snapshot at all, but long enough to unpack"):
+            with open(path, "wb") as f:
+                f.write(contents)
+            self.assertIsNone(catalog.read_snapshot(path))
+
+    def test_snapshot_rebuilt_when_stale(self):
+        path = os.path.join(self.cache_dir.name, catalog.SNAPSHOT_FILENAME)
+        first = catalog.refresh_snapshot(self.config)
+        written = os.stat(path)
+        unchanged = catalog.refresh_snapshot(self.config)
+        self.assertEqual(first.version, unchanged.version)
+        self.assertEqual(written.st_mtime_ns, os.stat(path).st_mtime_ns)
+
+        with cursor(self.config) as cur:
+            cur.execute("UPDATE venues SET name = name || ' (renamed)'")
+        rebuilt = catalog.refresh_snapshot(self.config)
+        self.assertLess(first.version, rebuilt.version)
+        self.assertTrue(
+            all(venue.name.endswith(" (renamed)") for venue in rebuilt.venues.values())
+        )
+        # A worker still using the old snapshot can go on reading it.
+        self.assertFalse(
+            any(venue.name.endswith(" (renamed)") for venue in first.venues.values())
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+import psycopg2.extensions
+
+import db
+
+CHANNEL = "edfringeplanner_changes"
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeListener:
+    # Listens for the notifications sent by the triggers in
+    # schema/migrations/0002_change_notifications.sql, and calls the handlers
+    # registered for each table with the rows which changed, or None if any
+    # row may have changed.
+    #
+    # Changes this process made itself are handled like anyone else's, as
+    # triggers can write rows the writer never sees, except in the tables of
+    # ignore_own_changes, whose writers here keep their caches up to date
+    # themselves.
+
+    def __init__(self, config, ignore_own_changes=()):
+        self.config = config
+        self.ignore_own_changes = frozenset(ignore_own_changes)
+        self.notifications = 0
+        self._handlers = defaultdict(list)
+        self._thread = None
+        self._starting = threading.Lock()
+        self._stopping = threading.Event()
+        self._listening = threading.Event()
+
+    def on(self, table, handler):
+        self._handlers[table].append(handler)
+
+    def start(self):
+        with self._starting:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="change-listener", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wait_until_listening(self, timeout=None):
+        return self._listening.wait(timeout)
+
+    def dispatch(self, payload):
+        change = json.loads(payload)
+        if (
+            change["table"] in self.ignore_own_changes
+            and change.get("origin") == db.application_name()
+        ):
+            return
+        self.notifications += 1
+        for handler in self._handlers[change["table"]]:
+            try:
+                handler(change["rows"])
+            except Exception:
+                logger.exception("Error handling change to %s", change["table"])
+
+    def _run(self):
+        backoff = 0.1
+        while not self._stopping.is_set():
+            try:
+                self._listen()
+                backoff = 0.1
+            except psycopg2.Error:
+                logger.exception("Lost connection listening for changes")
+                self._listening.clear()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _listen(self):
+        conn = db.connect(self.config)
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute("LISTEN {}".format(CHANNEL))
+            # Anything could have changed while we weren't listening.
+            for table in list(self._handlers):
+                for handler in self._handlers[table]:
+                    handler(None)
+            self._listening.set()
+            while not self._stopping.is_set():
+                if select.select([conn], [], [], 1)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        self.dispatch(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
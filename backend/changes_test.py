@@ -0,0 +1,89 @@
+import queue
+import time
+import unittest
+
+import events
+from changes import ChangeListener
+from db import cursor
+from synthetic import seed_database
+from testdb import config_for_tests, reset_database
+
+
+class TestChangeListener(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.config = config_for_tests()
+        reset_database(cls.config)
+        with cursor(cls.config) as cur:
+            cls.user_ids = seed_database(cur, venues=5, shows=20, users=3)
+            cur.execute("SELECT id FROM shows ORDER BY id LIMIT 1")
+            cls.show_id = cur.fetchone()[0]
+
+    def setUp(self):
+        self.listener = ChangeListener(self.config)
+        self.changes = queue.Queue()
+        for table in ("interests", "shares", "sold_out"):
+            self.listener.on(
+                table, lambda rows, table=table: self.changes.put((table, rows))
+            )
+        self.listener.start()
+        self.assertTrue(self.listener.wait_until_listening(5))
+        # Starting to listen invalidates everything.
+        for _ in range(3):
+            self.assertEqual(None, self.changes.get(timeout=5)[1])
+
+    def tearDown(self):
+        self.listener.stop()
+
+    def test_interest_change(self):
+        started = time.monotonic()
+        events.set_interest(self.config, self.user_ids[0], self.show_id, "Must")
+        table, rows = self.changes.get(timeout=5)
+        elapsed = time.monotonic() - started
+        self.assertEqual("interests", table)
+        self.assertEqual(
+            [(self.user_ids[0], self.show_id, "Must")],
+            [(row["user_id"], row["show_id"], row["interest"]) for row in rows],
+        )
+        self.assertLess(elapsed, 0.5)
+
+    def test_one_notification_per_statement(self):
+        with cursor(self.config) as cur:
+            cur.execute(
+                "INSERT INTO sold_out (performance_id) SELECT id FROM performances "
+                + "ON CONFLICT DO NOTHING"
+            )
+            sold_out = cur.rowcount
+        table, rows = self.changes.get(timeout=5)
+        self.assertEqual("sold_out", table)
+        if rows is not None:
+            self.assertEqual(sold_out, len(rows))
+        self.assertTrue(self.changes.empty())
+
+    def test_ignores_own_changes(self):
+        listener = ChangeListener(self.config, ignore_own_changes=("interests",))
+        changes = queue.Queue()
+        for table in ("interests", "shares"):
+            listener.on(table, lambda rows, table=table: changes.put((table, rows)))
+        listener.start()
+        try:
+            self.assertTrue(listener.wait_until_listening(5))
+            for _ in range(2):
+                self.assertEqual(None, changes.get(timeout=5)[1])
+            events.set_interest(self.config, self.user_ids[1], self.show_id, "Like")
+            with cursor(self.config) as cur:
+                cur.execute(
+                    "INSERT INTO shares (shared_by, shared_with_email) VALUES (%s, %s)",
+                    (self.user_ids[0], "someone@example.com"),
+                )
+            self.assertEqual("interests", self.changes.get(timeout=5)[0])
+            self.assertEqual("shares", self.changes.get(timeout=5)[0])
+            self.assertEqual("shares", changes.get(timeout=5)[0])
+            time.sleep(0.1)
+            self.assertTrue(changes.empty())
+        finally:
+            listener.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
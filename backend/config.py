@@ -11,6 +11,11 @@ class Config:
     mailgun_domain: str
     mailgun_key: str
     domain_prefix: str
+    cache_dir: str = "cache"
+    mailgun_api_url: str = "https://api.mailgun.net/v3"
+    bind: str = "0.0.0.0:8000"
+    workers: int = 4
+    threads: int = 8
 
     @classmethod
     def from_env(cls) -> Config:
@@ -20,4 +25,11 @@ class Config:
             mailgun_domain=os.environ["EDFRINGEPLANNER_MAILGUN_DOMAIN"],
             mailgun_key=os.environ["EDFRINGEPLANNER_MAILGUN_KEY"],
             domain_prefix=os.environ["EDFRINGEPLANNER_DOMAIN_PREFIX"],
+            cache_dir=os.environ.get("EDFRINGEPLANNER_CACHE_DIR", "cache"),
+            mailgun_api_url=os.environ.get(
+                "EDFRINGEPLANNER_MAILGUN_API_URL", "https://api.mailgun.net/v3"
+            ),
+            bind=os.environ.get("EDFRINGEPLANNER_BIND", "0.0.0.0:8000"),
+            workers=int(os.environ.get("EDFRINGEPLANNER_WORKERS", "4")),
+            threads=int(os.environ.get("EDFRINGEPLANNER_THREADS", "8")),
         )
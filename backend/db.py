@@ -1,12 +1,88 @@
+import os
+import socket
+import threading
 from contextlib import contextmanager
 
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 
 from config import Config
 
+# Tests replace this to record or count the statements that code runs.
+cursor_factory = psycopg2.extensions.cursor
+
+# When a pool is open, cursor() borrows connections from it rather than
+# connecting afresh. Pools are per-process: see _forget_pool_after_fork.
+_pool = None
+_pool_database_name = None
+_pool_lock = threading.Lock()
+_abandoned_pools = []
+
+
+def application_name():
+    # Identifies this process to Postgres, so that it can recognise its own
+    # change notifications.
+    return "edfringeplanner:{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def connect(config: Config):
+    return psycopg2.connect(
+        dbname=config.database_name, application_name=application_name()
+    )
+
+
+def open_pool(config: Config, maxconn):
+    global _pool, _pool_database_name
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = psycopg2.pool.ThreadedConnectionPool(
+            0,
+            maxconn,
+            dbname=config.database_name,
+            application_name=application_name(),
+        )
+        _pool_database_name = config.database_name
+
+
+def close_pool():
+    global _pool, _pool_database_name
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+        _pool_database_name = None
+
+
+def _forget_pool_after_fork():
+    # A forked child shares its parent's sockets, so it mustn't use or close
+    # (which would tell the server to hang up) the parent's connections.
+    # Keeping the pool referenced stops it being garbage collected.
+    global _pool, _pool_database_name, _pool_lock
+    if _pool is not None:
+        _abandoned_pools.append(_pool)
+    _pool = None
+    _pool_database_name = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_pool_after_fork)
+
 
 @contextmanager
 def cursor(config: Config):
-    with psycopg2.connect("dbname={}".format(config.database_name)) as conn:
-        with conn.cursor() as cur:
-            yield cur
+    pool = _pool
+    if pool is None or _pool_database_name != config.database_name:
+        with connect(config) as conn:
+            with conn.cursor(cursor_factory=cursor_factory) as cur:
+                yield cur
+        return
+
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor(cursor_factory=cursor_factory) as cur:
+                yield cur
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
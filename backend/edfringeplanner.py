@@ -1,5 +1,6 @@
 import datetime
 import uuid
+from collections import defaultdict
 from multiprocessing import Process
 from urllib.parse import urlparse, urljoin
 
@@ -8,19 +9,29 @@ import flask
 import flask_login
 import psycopg2
 import pytz
-import requests
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
 from flask import Flask, request
 from flask_cachebuster import CacheBuster
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user
+from markupsafe import Markup
 from sortedcontainers import SortedSet
+from werkzeug.http import is_resource_modified
 
+import catalog
 import db
+import free_slots
+import groups
+import ical
+import mailer
+import nearby
+import search
 import sharing
+import travel
+from async_events import AsyncDayLoader
+from changes import ChangeListener
 from config import Config
 from events import (
-    load_events,
     mark_booked,
     set_interest,
     Filter,
@@ -28,8 +39,16 @@ from events import (
     set_performance_interest,
     unset_performance_interest,
     bin_pack_events,
+    column_category,
+    day_bounds,
+    day_extent,
+    filter_events,
+    pack_category,
 )
+from fragments import ChunkedStream, EventCardCache
 from importer import import_from_url_from_config
+from plans import DayPlanCache
+from query_budget import query_budget
 
 config = Config.from_env()
 
@@ -43,6 +62,88 @@ login_manager.init_app(app)
 cache_buster = CacheBuster(config={"extensions": [".css"], "hash_size": 8})
 cache_buster.init_app(app)
 
+event_cards = EventCardCache(app.jinja_env)
+day_plans = DayPlanCache()
+day_loader = AsyncDayLoader(config)
+calendar_feeds = ical.CalendarFeedCache(urlparse(config.domain_prefix).hostname)
+show_search = search.ShowSearch(config)
+# Interest changes made here are applied to cached days in place by
+# day_plans.update, rather than dropping them.
+change_listener = ChangeListener(
+    config, ignore_own_changes=("interests", "performance_interests")
+)
+mail_sender = mailer.MailSender(config)
+
+HOUR_HEIGHT_PX = 200
+
+
+def invalidate_users(rows):
+    if rows is None:
+        day_plans.clear()
+        return
+    for user_id in {row["user_id"] for row in rows}:
+        day_plans.invalidate_user(user_id)
+
+
+def invalidate_sold_out(rows):
+    if rows is None:
+        day_plans.clear()
+        return
+    day_plans.invalidate_performances(row["performance_id"] for row in rows)
+
+
+def invalidate_last_bookable(rows):
+    # Which days are a show's last chance depends on its later performances.
+    if rows is None:
+        day_plans.clear()
+        return
+    day_plans.invalidate_shows(row["show_id"] for row in rows)
+
+
+def invalidate_travel_times(rows):
+    if rows is None:
+        travel.invalidate_if_stale(config)
+    else:
+        travel.invalidate()
+
+
+def invalidate_catalog(rows):
+    if rows is None:
+        catalog.invalidate_if_stale(config)
+    else:
+        catalog.invalidate()
+
+
+change_listener.on("interests", invalidate_users)
+change_listener.on("performance_interests", invalidate_users)
+change_listener.on("sold_out", invalidate_sold_out)
+change_listener.on("show_last_bookable", invalidate_last_bookable)
+# New performances can add events to days they aren't yet in.
+change_listener.on("performances", lambda rows: day_plans.clear())
+change_listener.on("shares", lambda rows: sharing.invalidate())
+# Share-hydrated days include the interests of whoever shares with the user.
+sharing.on_invalidate(lambda: day_plans.invalidate_hydrated())
+change_listener.on("venues", invalidate_travel_times)
+for table in ("shows", "performances", "sold_out", "venues", "editions"):
+    change_listener.on(table, invalidate_catalog)
+# Moving on to another edition changes every day, and what can be searched.
+change_listener.on("editions", lambda rows: day_plans.clear())
+change_listener.on("editions", lambda rows: show_search.invalidate())
+change_listener.on("venues", show_search.on_venues)
+change_listener.on("shows", show_search.on_shows)
+change_listener.on("performances", show_search.on_performances)
+change_listener.on("sold_out", show_search.on_sold_out)
+
+
+@app.before_request
+def start_change_listener():
+    change_listener.start()
+
+
+@app.before_request
+def start_mail_sender():
+    mail_sender.start()
+
 
 def render_template(template, **kwargs):
     current_user = flask_login.current_user
@@ -51,6 +152,27 @@ def render_template(template, **kwargs):
     return flask.render_template(template, **kwargs)
 
 
+def stream_template(template, stream: ChunkedStream, **kwargs):
+    current_user = flask_login.current_user
+    if not current_user.is_anonymous:
+        kwargs = {**kwargs, "user": flask_login.current_user}
+    app.update_template_context(kwargs)
+    pieces = app.jinja_env.get_template(template).generate(
+        {**kwargs, "flush": stream.flush}
+    )
+    return flask.Response(flask.stream_with_context(stream.chunks(pieces)))
+
+
+def render_column(column, hour_height_px, url_hiding, cards=event_cards):
+    return Markup(
+        app.jinja_env.get_template("column.html").render(
+            column=column,
+            url_hiding=url_hiding,
+            render_event=lambda event: cards.render(event, hour_height_px),
+        )
+    )
+
+
 class User(UserMixin):
     def __init__(self, id):
         self.id = id
@@ -83,25 +205,49 @@ def user_id():
 
 
 @app.route("/")
+@query_budget(statements=1)
 def index():
     return render_template("index.html")
 
 
 @app.route("/day/<date_str>")
 @login_required
+@query_budget(statements=4)
 def one_day(date_str):
-    try:
-        date = datetime.datetime.strptime(
-            "{} +0100".format(date_str), "%Y-%m-%d %z"
-        ).date()
-    except ValueError:
+    date = parse_date(date_str)
+    if date is None:
         return "Invalid date in URL: {}".format(date_str)
 
+    display_filter = display_filter_from_args(date, request.args)
+
+    shared_boost = request.args.get("boost", "none")
+
+    walking = request.args.get("walking", "none")
+    travel_times = travel.get_travel_times(config) if walking != "none" else None
+
+    day = load_cached_day(date, shared_boost != "none")
+    event_columns, first_hour, number_of_hours = bin_pack_events(
+        filter_events(day, display_filter, travel_times), shared_boost, travel_times
+    )
+    return render_day_page(
+        date,
+        event_columns,
+        first_hour,
+        number_of_hours,
+        display_filter=display_filter,
+        shared_boost=shared_boost,
+        walking=walking,
+        start_at=request.args.get("start_at", None),
+        end_at=request.args.get("end_at", None),
+    )
+
+
+def display_filter_from_args(date, args):
     show_likes = True
     show_must = True
     show_booked = True
     show_past = True
-    start_at = request.args.get("start_at", None)
+    start_at = args.get("start_at", None)
     start_at_datetime = None
     if start_at is not None:
         try:
@@ -113,7 +259,7 @@ def one_day(date_str):
             ).astimezone(pytz.timezone("Europe/London"))
         except ValueError:
             pass
-    end_at = request.args.get("end_at", None)
+    end_at = args.get("end_at", None)
     end_at_datetime = None
     if end_at is not None:
         try:
@@ -126,7 +272,7 @@ def one_day(date_str):
         except ValueError:
             pass
     hidden_categories = set()
-    for hidden in request.args.getlist("hidden"):
+    for hidden in args.getlist("hidden"):
         if hidden == "like":
             show_likes = False
         elif hidden == "love":
@@ -138,7 +284,7 @@ def one_day(date_str):
         else:
             hidden_categories.add(hidden)
 
-    display_filter = Filter(
+    return Filter(
         show_like=show_likes,
         show_must=show_must,
         show_booked=show_booked,
@@ -148,79 +294,267 @@ def one_day(date_str):
         hidden_categories=SortedSet(hidden_categories),
     )
 
-    shared_boost = request.args.get("boost", "none")
 
-    event_columns, first_hour, number_of_hours = bin_pack_events(
-        load_events(config, user_id(), date, display_filter, shared_boost != "none"),
-        shared_boost,
+def load_cached_day(date, hydrate_shares):
+    uid = user_id()
+    return day_plans.get(
+        (uid, date, hydrate_shares),
+        lambda: day_loader.load_day(uid, date, hydrate_shares),
     )
-    return render_template(
+
+
+def render_day_page(
+    date,
+    event_columns,
+    first_hour,
+    number_of_hours,
+    *,
+    display_filter,
+    shared_boost,
+    walking,
+    start_at,
+    end_at,
+    cards=event_cards,
+):
+    url_hiding = lambda s: day_url(hiding=s)
+    stream = ChunkedStream()
+
+    def render_and_flush_column(column):
+        stream.flush()
+        return render_column(column, HOUR_HEIGHT_PX, url_hiding, cards)
+
+    return stream_template(
         "one_day.html",
+        stream,
         date=date,
         date_yyyymmdd=date.strftime("%Y-%m-%d"),
         event_columns=event_columns,
+        render_column=render_and_flush_column,
         first_hour=first_hour,
         number_of_hours=number_of_hours,
-        hour_height_px=200,
-        url_hiding=lambda s: day_url(hiding=s),
+        hour_height_px=HOUR_HEIGHT_PX,
+        url_hiding=url_hiding,
         url_showing=lambda s: day_url(showing=s),
         display_filter=display_filter,
         shared_boost=shared_boost,
+        walking=walking,
         start_at=start_at,
         end_at=end_at,
     )
 
 
-@app.route("/booked/<performance_id>")
+@app.route("/group/<date_str>")
+@login_required
+@query_budget(statements=4)
+def group(date_str):
+    date = parse_date(date_str)
+    if date is None:
+        return "Invalid date in URL: {}".format(date_str)
+
+    sharers = sharing.get_shared_by_user_ids_and_emails(config, user_id())
+    sharer_ids = {id for id, _ in sharers}
+    with_ids = set()
+    for with_id in request.args.getlist("with"):
+        try:
+            with_id = int(with_id)
+        except ValueError:
+            continue
+        if with_id in sharer_ids:
+            with_ids.add(with_id)
+
+    performances = []
+    if with_ids:
+        performances = groups.find_group_performances(
+            config, with_ids | {user_id()}, window=day_bounds(date)
+        )
+    return render_template(
+        "group.html",
+        date=date,
+        date_yyyymmdd=date.strftime("%Y-%m-%d"),
+        sharers=sharers,
+        with_ids=with_ids,
+        performances=performances,
+    )
+
+
+@app.route("/free/<date_str>")
 @login_required
+@query_budget(statements=6)
+def free(date_str):
+    date = parse_date(date_str)
+    if date is None:
+        return "Invalid date in URL: {}".format(date_str)
+
+    category = request.args.get("category") or None
+    slots = free_slots.find_free_slots(
+        config, user_id(), day_bounds(date), category=category
+    )
+    return render_template(
+        "free.html",
+        date=date,
+        date_yyyymmdd=date.strftime("%Y-%m-%d"),
+        category=category,
+        categories=free_slots.get_performance_intervals(config).categories,
+        slots=slots,
+        london=pytz.timezone("Europe/London"),
+    )
+
+
+@app.route("/nearby")
+@login_required
+@query_budget(statements=5)
+def nearby_shows():
+    try:
+        location = (float(request.args["lat"]), float(request.args["long"]))
+    except (KeyError, ValueError):
+        location = None
+    results = []
+    if location is not None:
+        results = nearby.get_nearby_index(config).find(
+            *location, now=datetime.datetime.now(pytz.utc)
+        )
+    return render_template(
+        "nearby.html",
+        location=location,
+        results=results,
+        london=pytz.timezone("Europe/London"),
+    )
+
+
+@app.route("/search")
+@login_required
+@query_budget(statements=5)
+def search_shows():
+    query = request.args.get("q", "").strip()
+    results = []
+    if query:
+        results = show_search.search(query, now=datetime.datetime.now(pytz.utc))
+    return render_template(
+        "search.html",
+        query=query,
+        results=results,
+        london=pytz.timezone("Europe/London"),
+    )
+
+
+@app.route("/booked/<int:performance_id>")
+@login_required
+@query_budget(statements=5)
 def booked(performance_id):
     mark_booked(config, user_id(), performance_id)
-    if is_safe_url(request.referrer):
-        return flask.redirect(request.referrer)
-    return "Done"
+    return after_update(lambda day: day.mark_booked(performance_id))
 
 
-@app.route("/love/<show_id>/<performance_id>")
+@app.route("/love/<int:show_id>/<int:performance_id>")
 @login_required
+@query_budget(statements=3)
 def love(show_id, performance_id):
     set_interest(config, user_id(), show_id, "Must")
     unset_performance_interest(config, user_id(), performance_id=performance_id)
-    if is_safe_url(request.referrer):
-        return flask.redirect(request.referrer)
-    return "Done"
+    return after_update(show_interest_change(show_id, performance_id, "Must"))
 
 
-@app.route("/like/<show_id>/<performance_id>")
+@app.route("/like/<int:show_id>/<int:performance_id>")
 @login_required
+@query_budget(statements=3)
 def like(show_id, performance_id):
     set_interest(config, user_id(), show_id, "Like")
     unset_performance_interest(config, user_id(), performance_id=performance_id)
-    if is_safe_url(request.referrer):
-        return flask.redirect(request.referrer)
-    return "Done"
+    return after_update(show_interest_change(show_id, performance_id, "Like"))
 
 
-@app.route("/love/performance/<performance_id>")
+@app.route("/love/performance/<int:performance_id>")
 @login_required
+@query_budget(statements=3)
 def love_performance(performance_id):
     set_performance_interest(config, user_id(), performance_id, "Must")
-    if is_safe_url(request.referrer):
-        return flask.redirect(request.referrer)
-    return "Done"
+    return after_update(
+        lambda day: day.set_performance_interest(performance_id, "Must")
+    )
 
 
-@app.route("/unlike/<show_id>")
+@app.route("/unlike/<int:show_id>")
 @login_required
+@query_budget(statements=4)
 def unlike(show_id):
     remove_interest(config, user_id(), show_id)
     unset_performance_interest(config, user_id(), show_id=show_id)
+    return after_update(lambda day: day.remove_interest(show_id))
+
+
+def show_interest_change(show_id, performance_id, interest):
+    def change(day):
+        day = day.set_interest(show_id, interest)
+        return day and day.unset_performance_interest(performance_id=performance_id)
+
+    return change
+
+
+def after_update(change):
+    # Pages which have the day's columns loaded ask for just the columns which
+    # changed, rather than being redirected back to reload the whole day.
+    if request.headers.get("X-Partial-Update") == "columns":
+        return partial_update(change)
+    day_plans.update(user_id(), change)
     if is_safe_url(request.referrer):
         return flask.redirect(request.referrer)
     return "Done"
 
 
+def partial_update(change):
+    date = parse_date(request.args.get("day", ""))
+    shared_boost = request.args.get("boost", "none")
+    key = (user_id(), date, shared_boost != "none")
+    before = day_plans.peek(key)
+    day_plans.update(user_id(), change)
+    after = day_plans.peek(key)
+    if date is None or before is None or after is None:
+        return flask.jsonify(reload=True)
+
+    display_filter = display_filter_from_args(date, request.args)
+    walking = request.args.get("walking", "none")
+    travel_times = travel.get_travel_times(config) if walking != "none" else None
+
+    before_events = filter_events(before, display_filter, travel_times)
+    after_events = filter_events(after, display_filter, travel_times)
+    # Columns are all drawn on the same grid of hours, so if the day got longer
+    # or shorter every column needs redrawing.
+    if not before_events or not after_events:
+        return flask.jsonify(reload=True)
+    start_of_day, end_of_day = day_extent(after_events)
+    if (start_of_day, end_of_day) != day_extent(before_events):
+        return flask.jsonify(reload=True)
+
+    before_by_category = defaultdict(list)
+    for event in before_events:
+        before_by_category[column_category(event)].append(event)
+    after_by_category = defaultdict(list)
+    for event in after_events:
+        after_by_category[column_category(event)].append(event)
+
+    day_path = flask.url_for("one_day", date_str=date.strftime("%Y-%m-%d"))
+    url_hiding = lambda s: day_url(hiding=s, path=day_path)
+    columns = {}
+    for category in set(before_by_category) | set(after_by_category):
+        if before_by_category[category] == after_by_category[category]:
+            continue
+        columns[category] = "".join(
+            render_column(column, HOUR_HEIGHT_PX, url_hiding)
+            for column in pack_category(
+                category,
+                after_by_category[category],
+                start_of_day,
+                end_of_day,
+                shared_boost,
+                travel_times,
+            )
+        )
+    return flask.jsonify(reload=False, columns=columns)
+
+
 @app.route("/sharing")
 @login_required
+@query_budget(statements=1)
 def serve_sharing():
     shared_by_emails, shared_with_emails = sharing.get_share_emails(config, user_id())
     return render_template(
@@ -233,6 +567,7 @@ def serve_sharing():
 
 @app.route("/sharing", methods=("POST",))
 @login_required
+@query_budget(statements=1)
 def handle_sharing():
     share_with_email = request.form.get("share_with_email", None)
     if share_with_email is None:
@@ -243,12 +578,14 @@ def handle_sharing():
 
 @app.route("/unshare/<shared_with_email>")
 @login_required
+@query_budget(statements=1)
 def unshare(shared_with_email):
     sharing.unshare(config, shared_by=user_id(), shared_with_email=shared_with_email)
     return flask.redirect(flask.url_for("serve_sharing"))
 
 
 @app.route("/login")
+@query_budget(statements=1)
 def login():
     kwargs = {}
     if flask.request.args.get("error") == "true":
@@ -260,6 +597,7 @@ def login():
 
 
 @app.route("/login", methods=("POST",))
+@query_budget(statements=2)
 def handle_login():
     email = request.form.get("email", None)
     password = request.form.get("password", None)
@@ -287,12 +625,14 @@ def handle_login():
 
 @app.route("/logout")
 @login_required
+@query_budget(statements=0)
 def logout():
     logout_user()
     return flask.redirect(flask.url_for("index"))
 
 
 @app.route("/signup")
+@query_budget(statements=1)
 def signup():
     kwargs = {}
     for key in ["error", "needs_verification", "email", "start_date", "end_date"]:
@@ -303,6 +643,7 @@ def signup():
 
 
 @app.route("/signup", methods=("POST",))
+@query_budget(statements=2)
 def handle_signup():
     email = flask.request.form.get("email")
     password = flask.request.form.get("password")
@@ -332,13 +673,14 @@ def handle_signup():
 
     confirm_email_token = uuid.uuid4().hex
     import_token = uuid.uuid4().hex
+    calendar_token = uuid.uuid4().hex
 
     with db.cursor(config) as cur:
         try:
             cur.execute(
                 "INSERT INTO users "
-                + "(email, password_hash, start_datetime_utc, end_datetime_utc, confirm_email_token, import_token) "
-                + "VALUES (%s, %s, %s, %s, %s, %s)",
+                + "(email, password_hash, start_datetime_utc, end_datetime_utc, confirm_email_token, import_token, calendar_token) "
+                + "VALUES (%s, %s, %s, %s, %s, %s, %s)",
                 (
                     email,
                     password_hash,
@@ -346,6 +688,7 @@ def handle_signup():
                     end_date,
                     confirm_email_token,
                     import_token,
+                    calendar_token,
                 ),
             )
         except psycopg2.errors.UniqueViolation:
@@ -358,25 +701,22 @@ def handle_signup():
                     end_date=end_date,
                 )
             )
-
-    requests.post(
-        "https://api.mailgun.net/v3/{}/messages".format(config.mailgun_domain),
-        auth=("api", config.mailgun_key),
-        data={
-            "from": "edfringe planner <signup@edfringeplanner.co.uk>",
-            "to": [email],
-            "subject": "Please verify your email for edfringeplanner",
-            "text": "Please follow this link to verify your account on edfringeplanner.co.uk - {}{} - if you didn't request this, just ignore the email and you'll never hear from us again.".format(
+        mailer.enqueue(
+            cur,
+            to=email,
+            subject="Please verify your email for edfringeplanner",
+            text="Please follow this link to verify your account on edfringeplanner.co.uk - {}{} - if you didn't request this, just ignore the email and you'll never hear from us again.".format(
                 config.domain_prefix,
                 flask.url_for("verify", email=email, token=confirm_email_token),
             ),
-        },
-    )
+        )
+    mail_sender.wake()
 
     return flask.redirect(flask.url_for("signup", needs_verification="true"))
 
 
 @app.route("/verify/<email>/<token>")
+@query_budget(statements=2)
 def verify(email, token):
     with db.cursor(config) as cur:
         cur.execute(
@@ -392,6 +732,7 @@ def verify(email, token):
 
 @app.route("/import")
 @login_required
+@query_budget(statements=1)
 def import_form():
     with db.cursor(config) as cur:
         cur.execute("SELECT import_token FROM users WHERE id = %s", (user_id(),))
@@ -403,7 +744,53 @@ def import_form():
     return render_template("import.html", import_email=import_email)
 
 
+@app.route("/calendar")
+@login_required
+@query_budget(statements=1)
+def calendar_form():
+    with db.cursor(config) as cur:
+        cur.execute("SELECT calendar_token FROM users WHERE id = %s", (user_id(),))
+        row = cur.fetchone()
+        if row is None:
+            raise ValueError("Internal error: couldn't find calendar token")
+        calendar_token = row[0]
+    feed_url = "{}{}".format(
+        config.domain_prefix,
+        flask.url_for("calendar_feed", calendar_token=calendar_token),
+    )
+    return render_template(
+        "calendar.html",
+        feed_url=feed_url,
+        webcal_url="webcal://{}".format(feed_url.split("://", 1)[1]),
+    )
+
+
+@app.route("/calendar/<calendar_token>.ics")
+@query_budget(statements=2)
+def calendar_feed(calendar_token):
+    # Calendar clients poll often, so an unchanged feed costs just the one
+    # lookup.
+    version = ical.load_feed_version(config, calendar_token)
+    if version is None:
+        flask.abort(404)
+    if is_resource_modified(
+        request.environ, etag=version.etag, last_modified=version.last_modified
+    ):
+        response = flask.Response(
+            calendar_feeds.get(version, lambda: ical.load_feed_events(config, version)),
+            mimetype="text/calendar",
+        )
+    else:
+        response = flask.Response(status=304)
+    response.set_etag(version.etag)
+    response.last_modified = version.last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
 @app.route("/import", methods=("POST",))
+@query_budget(statements=1)
 def import_csv():
     recipient = request.form.get("recipient")
     if recipient is None:
@@ -440,6 +827,15 @@ def import_csv():
     return "OK"
 
 
+def parse_date(date_str):
+    try:
+        return datetime.datetime.strptime(
+            "{} +0100".format(date_str), "%Y-%m-%d %z"
+        ).date()
+    except ValueError:
+        return None
+
+
 def is_safe_url(target):
     if target is None:
         return False
@@ -448,7 +844,7 @@ def is_safe_url(target):
     return test_url.scheme in ("http", "https") and ref_url.netloc == test_url.netloc
 
 
-def day_url(showing=None, hiding=None):
+def day_url(showing=None, hiding=None, path=None):
     hidden = set(request.args.getlist("hidden"))
     if showing is not None:
         hidden.remove(showing)
@@ -456,7 +852,7 @@ def day_url(showing=None, hiding=None):
         hidden.add(hiding)
     parts = "&".join("hidden={}".format(h) for h in sorted(hidden))
     query = "?{}".format(parts) if parts else ""
-    return "{}{}".format(request.path, query)
+    return "{}{}".format(path or request.path, query)
 
 
 def main():
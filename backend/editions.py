@@ -0,0 +1,80 @@
+import argparse
+import datetime
+from dataclasses import dataclass
+
+from config import Config
+from db import cursor
+
+
+@dataclass(frozen=True)
+class Edition:
+    # One year's festival. Performances and whether they're sold out are
+    # stored by edition, and everything the site shows is of the current one.
+    year: int
+    starts_on: datetime.date
+    ends_on: datetime.date
+
+    def date_of_day(self, day_of_month: int) -> datetime.date:
+        # edfringe lists performances by the day of the month alone.
+        date = self.starts_on
+        while date <= self.ends_on:
+            if date.day == day_of_month:
+                return date
+            date += datetime.timedelta(days=1)
+        raise ValueError(
+            "Day {} isn't during the {} festival".format(day_of_month, self.year)
+        )
+
+
+def current_edition(cur) -> Edition:
+    cur.execute("SELECT year, starts_on, ends_on FROM editions WHERE current")
+    row = cur.fetchone()
+    if row is None:
+        raise ValueError("No festival edition is current")
+    return Edition(*row)
+
+
+def add_edition(cur, edition: Edition, make_current=True):
+    # Adding an edition creates its partitions of performances and sold_out.
+    cur.execute(
+        "INSERT INTO editions (year, starts_on, ends_on) VALUES (%s, %s, %s) "
+        + "ON CONFLICT (year) DO UPDATE SET starts_on = EXCLUDED.starts_on, ends_on = EXCLUDED.ends_on",
+        (edition.year, edition.starts_on, edition.ends_on),
+    )
+    if make_current:
+        # In two statements, as only one edition may be current at a time.
+        cur.execute(
+            "UPDATE editions SET current = FALSE WHERE current AND year != %s",
+            (edition.year,),
+        )
+        cur.execute(
+            "UPDATE editions SET current = TRUE WHERE year = %s AND NOT current",
+            (edition.year,),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Adds a festival edition, and makes it the current one."
+    )
+    parser.add_argument("year", type=int)
+    parser.add_argument("starts_on", type=datetime.date.fromisoformat)
+    parser.add_argument("ends_on", type=datetime.date.fromisoformat)
+    parser.add_argument(
+        "--not-current",
+        action="store_true",
+        help="Add the edition without moving the site on to it",
+    )
+    args = parser.parse_args()
+
+    config = Config.from_env()
+    with cursor(config) as cur:
+        add_edition(
+            cur,
+            Edition(args.year, args.starts_on, args.ends_on),
+            make_current=not args.not_current,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import dataclasses
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+import catalog
+import importer
+from db import cursor
+from editions import Edition, add_edition, current_edition
+from events import mark_booked
+from synthetic import seed_database
+from testdb import config_for_tests, reset_database
+
+EDITION_2020 = Edition(2020, datetime.date(2020, 8, 7), datetime.date(2020, 8, 31))
+
+
+class TestEdition(unittest.TestCase):
+    def test_date_of_day(self):
+        self.assertEqual(datetime.date(2020, 8, 12), EDITION_2020.date_of_day(12))
+
+    def test_date_of_day_across_months(self):
+        edition = Edition(2021, datetime.date(2021, 8, 20), datetime.date(2021, 9, 5))
+        self.assertEqual(datetime.date(2021, 8, 31), edition.date_of_day(31))
+        self.assertEqual(datetime.date(2021, 9, 2), edition.date_of_day(2))
+
+    def test_date_of_day_outside_festival(self):
+        with self.assertRaises(ValueError):
+            EDITION_2020.date_of_day(3)
+
+
+class TestEditions(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dir = tempfile.TemporaryDirectory()
+        cls.config = dataclasses.replace(
+            config_for_tests(), cache_dir=cls.cache_dir.name
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cache_dir.cleanup()
+
+    def setUp(self):
+        reset_database(self.config)
+        with cursor(self.config) as cur:
+            self.user_id = seed_database(cur, venues=5, shows=20, users=1)[0]
+        catalog.invalidate()
+        self.addCleanup(catalog.invalidate)
+
+    def test_current_edition(self):
+        with cursor(self.config) as cur:
+            self.assertEqual(
+                Edition(2019, datetime.date(2019, 8, 2), datetime.date(2019, 8, 26)),
+                current_edition(cur),
+            )
+
+    def test_add_edition(self):
+        with cursor(self.config) as cur:
+            add_edition(cur, EDITION_2020)
+            self.assertEqual(EDITION_2020, current_edition(cur))
+            cur.execute("SELECT year FROM editions WHERE current")
+            self.assertEqual([(2020,)], cur.fetchall())
+            cur.execute(
+                "SELECT relname FROM pg_class WHERE relname IN ('performances_2020', 'sold_out_2020') ORDER BY relname"
+            )
+            self.assertEqual(
+                [("performances_2020",), ("sold_out_2020",)], cur.fetchall()
+            )
+
+    def test_add_edition_not_current(self):
+        with cursor(self.config) as cur:
+            add_edition(cur, EDITION_2020, make_current=False)
+            self.assertEqual(2019, current_edition(cur).year)
+
+    def test_catalog_only_has_current_edition(self):
+        before = catalog.load_catalog(self.config)
+        with cursor(self.config) as cur:
+            add_edition(cur, EDITION_2020)
+            cur.execute(
+                "INSERT INTO performances (show_id, datetime_utc) "
+                + "SELECT show_id, datetime_utc + interval '1 year' FROM performances "
+                + "WHERE edition = 2019 ORDER BY id LIMIT 5"
+            )
+        after = catalog.load_catalog(self.config)
+        self.assertNotEqual(before.version, after.version)
+        self.assertEqual(5, len(after.performances))
+        for performance in after.performances:
+            self.assertEqual(2020, performance.datetime_utc.year)
+
+    def test_performance_interests_take_performances_edition(self):
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT id FROM performances WHERE edition = 2019 ORDER BY id LIMIT 1"
+            )
+            performance_id = cur.fetchone()[0]
+            add_edition(cur, EDITION_2020)
+        mark_booked(self.config, self.user_id, performance_id)
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT edition FROM performance_interests WHERE performance_id = %s",
+                (performance_id,),
+            )
+            self.assertEqual([(2019,)], cur.fetchall())
+
+    def test_import_uses_current_edition(self):
+        with cursor(self.config) as cur:
+            add_edition(cur, EDITION_2020)
+            cur.execute("SELECT name FROM venues ORDER BY id LIMIT 1")
+            venue_name = cur.fetchone()[0]
+        rows = [
+            "Title\tCategory\tVenue\tDuration\tTimes\tDates\tBook Tickets\tGroup Name",
+            "New Show\tComedy\t{}\t1 hour\t12:00\t10 Aug, 11 Aug\t/whats-on/new-show\t".format(
+                venue_name
+            ),
+        ]
+        with mock.patch.object(
+            importer, "check_soldout_for_single_time"
+        ) as check, cursor(self.config) as cur:
+            importer.import_from_iter(cur, self.user_id, rows)
+        self.assertEqual(EDITION_2020, check.call_args.args[2])
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT performances.datetime_utc, performances.edition FROM performances "
+                + "INNER JOIN shows ON shows.id = performances.show_id "
+                + "WHERE shows.edfringe_url = '/whats-on/new-show' ORDER BY performances.datetime_utc"
+            )
+            self.assertEqual(
+                [
+                    (datetime.date(2020, 8, 10), 2020),
+                    (datetime.date(2020, 8, 11), 2020),
+                ],
+                [(row[0].date(), row[1]) for row in cur.fetchall()],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,20 +1,24 @@
 from __future__ import annotations
 
+import bisect
 import dataclasses
 import datetime
+import functools
 from collections import defaultdict
 from dataclasses import dataclass
 from sortedcontainers import SortedSet
-from typing import FrozenSet, List, Optional
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
 import pytz
 
 from db import cursor
 from sharing import get_shared_by_user_ids_and_emails
+from travel import TravelTimes
 
 
 @dataclass(eq=True, frozen=True)
 class Venue:
+    id: int
     name: str
     google_maps_url: str
 
@@ -118,11 +122,17 @@ class Event:
             for event in self.shared_interests
         )
 
-    def intersects(self, other: Event) -> bool:
+    def intersects(
+        self, other: Event, travel_times: Optional[TravelTimes] = None
+    ) -> bool:
         if self.start_edinburgh <= other.start_edinburgh:
-            return self.start_edinburgh + self.duration > other.start_edinburgh
+            first, second = self, other
         else:
-            return self.start_edinburgh < other.start_edinburgh + other.duration
+            first, second = other, self
+        first_end = first.start_edinburgh + first.duration
+        if travel_times is not None:
+            first_end += travel_times.between(first.venue.id, second.venue.id)
+        return first_end > second.start_edinburgh
 
 
 @dataclass
@@ -141,39 +151,51 @@ def duration_to_chunks(duration: datetime.timedelta):
     return duration.total_seconds() / 60
 
 
-def bin_pack_events(events, shared_boost):
-    if not events:
-        return [], 5, 0
-
-    categories_to_columns = defaultdict(list)
-
-    def category(event: Event) -> str:
-        if event.booked:
-            return "Booked"
-        else:
-            return event.category
+def column_category(event: Event) -> str:
+    if event.booked:
+        return "Booked"
+    else:
+        return event.category
 
-    def importance(event_or_padding: EventOrPadding) -> int:
-        event = event_or_padding.event
-        if event is None:
-            return 0
-        else:
-            return event.interest_int(shared_boost)
 
+def day_extent(events):
     start_of_day = min(event.start_edinburgh for event in events).replace(
         minute=0, second=0
     )
     end_of_day = max(
         event.start_edinburgh + event.duration for event in events
     ).replace(minute=0, second=0) + datetime.timedelta(hours=1)
-    number_of_hours = int((end_of_day - start_of_day).total_seconds()) // 3600
+    return start_of_day, end_of_day
+
+
+def column_importance(column: Column, shared_boost) -> int:
+    return sum(
+        event_or_padding.event.interest_int(shared_boost)
+        for event_or_padding in column.events_or_padding
+        if event_or_padding.event is not None
+    )
 
+
+def pack_category(
+    category,
+    events,
+    start_of_day,
+    end_of_day,
+    shared_boost,
+    travel_times: Optional[TravelTimes] = None,
+) -> List[Column]:
+    columns = []
     for event in events:
-        columns = categories_to_columns[category(event)]
         for column in columns:
             last_event = column[-1].event
             last_event_end = last_event.start_edinburgh + last_event.duration
-            if last_event_end < event.start_edinburgh:
+            if travel_times is not None:
+                free_from = last_event_end + travel_times.between(
+                    last_event.venue.id, event.venue.id
+                )
+            else:
+                free_from = last_event_end
+            if free_from < event.start_edinburgh:
                 if last_event_end < event.start_edinburgh:
                     column.append(
                         EventOrPadding(
@@ -191,29 +213,45 @@ def bin_pack_events(events, shared_boost):
                 EventOrPadding(event, duration_to_chunks(event.duration)),
             ]
             columns.append(new_column)
-    for columns in categories_to_columns.values():
-        for column in columns:
-            last_event = column[-1].event
-            last_event_end = last_event.start_edinburgh + last_event.duration
-            if last_event_end < end_of_day:
-                column.append(
-                    EventOrPadding(
-                        None, duration_to_chunks(end_of_day - last_event_end)
-                    )
-                )
+    for column in columns:
+        last_event = column[-1].event
+        last_event_end = last_event.start_edinburgh + last_event.duration
+        if last_event_end < end_of_day:
+            column.append(
+                EventOrPadding(None, duration_to_chunks(end_of_day - last_event_end))
+            )
+
+    columns = [Column(header=category, events_or_padding=column) for column in columns]
+    columns.sort(key=lambda c: column_importance(c, shared_boost), reverse=True)
+    return columns
+
+
+def bin_pack_events(events, shared_boost, travel_times: Optional[TravelTimes] = None):
+    if not events:
+        return [], 5, 0
+
+    start_of_day, end_of_day = day_extent(events)
+    number_of_hours = int((end_of_day - start_of_day).total_seconds()) // 3600
+
+    categories_to_events = defaultdict(list)
+    for event in events:
+        categories_to_events[column_category(event)].append(event)
 
     columns = []
-    for category, category_columns in categories_to_columns.items():
-        for column in category_columns:
-            columns.append(Column(header=category, events_or_padding=column))
-    columns.sort(
-        key=lambda c: sum(importance(event) for event in c.events_or_padding),
-        reverse=True,
-    )
+    for category, category_events in categories_to_events.items():
+        columns += pack_category(
+            category,
+            category_events,
+            start_of_day,
+            end_of_day,
+            shared_boost,
+            travel_times,
+        )
+    columns.sort(key=lambda c: column_importance(c, shared_boost), reverse=True)
     return columns, start_of_day.hour, number_of_hours
 
 
-def load_events(config, user_id, date, filter: Filter, hydrate_shares, email=None):
+def day_bounds(date):
     # TODO: Don't hard-code time zones
     start_of_day = datetime.datetime.strptime(
         "{} 05:00:00 +0100".format(date), "%Y-%m-%d %H:%M:%S %z"
@@ -222,111 +260,365 @@ def load_events(config, user_id, date, filter: Filter, hydrate_shares, email=Non
         "{} 05:00:00 +0100".format(date + datetime.timedelta(days=1)),
         "%Y-%m-%d %H:%M:%S %z",
     )
+    return start_of_day, end_of_day
+
 
+@dataclass(frozen=True)
+class Day:
+    # Every event of interest on the day, in start order, including sold out
+    # performances and ones which clash with bookings.
+    events: Tuple[Event, ...]
+    sold_out_performance_ids: FrozenSet[int]
+    later_show_ids: FrozenSet[int]
+
+    def _replacing(self, show_id=None, performance_id=None, **changes):
+        events = tuple(
+            (
+                dataclasses.replace(event, **changes)
+                if event.show_id == show_id or event.performance_id == performance_id
+                else event
+            )
+            for event in self.events
+        )
+        return dataclasses.replace(self, events=events)
+
+    def show_id_of(self, performance_id) -> Optional[int]:
+        return next(
+            (
+                event.show_id
+                for event in self.events
+                if event.performance_id == performance_id
+            ),
+            None,
+        )
+
+    def has_show(self, show_id) -> bool:
+        return any(event.show_id == show_id for event in self.events)
+
+    # Each of these mirrors the database change of the same name, returning
+    # None if the change can't be applied without reloading the day.
+
+    def set_interest(self, show_id, interest) -> Optional[Day]:
+        if not self.has_show(show_id):
+            return None
+        return self._replacing(show_id=show_id, show_interest=interest)
+
+    def remove_interest(self, show_id) -> Optional[Day]:
+        events = tuple(event for event in self.events if event.show_id != show_id)
+        return dataclasses.replace(self, events=events)
+
+    def mark_booked(self, performance_id) -> Optional[Day]:
+        show_id = self.show_id_of(performance_id)
+        if show_id is None:
+            return None
+        day = self.set_performance_interest(performance_id, "Booked")
+        return day.set_interest(show_id, "Booked")
+
+    def set_performance_interest(self, performance_id, interest) -> Optional[Day]:
+        if self.show_id_of(performance_id) is None:
+            return None
+        return self._replacing(
+            performance_id=performance_id, performance_interest=interest
+        )
+
+    def unset_performance_interest(
+        self, *, show_id=None, performance_id=None
+    ) -> Optional[Day]:
+        if show_id is not None:
+            return self._replacing(show_id=show_id, performance_interest=None)
+        return self._replacing(performance_id=performance_id, performance_interest=None)
+
+    @functools.cached_property
+    def index(self) -> DayIndex:
+        # Built on first filtering, and rebuilt for each changed copy.
+        return DayIndex(self)
+
+
+def _mask_of(indices) -> int:
+    mask = 0
+    for i in indices:
+        mask |= 1 << i
+    return mask
+
+
+class DayIndex:
+    # A day's events encoded as bitsets, bit i standing for day.events[i], so
+    # that any Filter can be applied to the day with a few bitwise operations
+    # rather than by checking every event.
+
+    def __init__(self, day: Day):
+        events = day.events
+        self.all = (1 << len(events)) - 1
+        self.categories: Dict[str, int] = {}
+        self.interests: Dict[str, int] = {}
+        for i, event in enumerate(events):
+            self.categories[event.category] = (
+                self.categories.get(event.category, 0) | 1 << i
+            )
+            self.interests[event.interest] = (
+                self.interests.get(event.interest, 0) | 1 << i
+            )
+        self.booked = _mask_of(i for i, event in enumerate(events) if event.booked)
+        self.last_chance = _mask_of(
+            i for i, event in enumerate(events) if event.last_chance
+        )
+        self.sold_out = _mask_of(
+            i
+            for i, event in enumerate(events)
+            if not event.booked and event.performance_id in day.sold_out_performance_ids
+        )
+
+        # Start times in order, with the events starting before each of them,
+        # so that the events starting either side of a time are a bisection.
+        order = sorted(range(len(events)), key=lambda i: events[i].start_edinburgh)
+        self._starts = [events[i].start_edinburgh for i in order]
+        self._starting_before = [0]
+        for i in order:
+            self._starting_before.append(self._starting_before[-1] | 1 << i)
+
+        # What filter_events returns for each bit, marked as last chances.
+        self.marked_events = tuple(
+            (
+                event
+                if event.show_id in day.later_show_ids
+                else dataclasses.replace(event, last_chance=True)
+            )
+            for event in events
+        )
+        self._events = events
+        self._clashes = None
+
+    def starting_before(self, time) -> int:
+        return self._starting_before[bisect.bisect_left(self._starts, time)]
+
+    def starting_by(self, time) -> int:
+        return self._starting_before[bisect.bisect_right(self._starts, time)]
+
+    def clashes(self, travel_times: Optional[TravelTimes] = None) -> int:
+        # Events which aren't booked but clash with an event which is. Only
+        # the latest travel times' clashes are kept.
+        if self._clashes is not None and self._clashes[0] is travel_times:
+            return self._clashes[1]
+        booked_events = [event for event in self._events if event.booked]
+        clashes = _mask_of(
+            i
+            for i, event in enumerate(self._events)
+            if not event.booked
+            and any(
+                event.intersects(booked_event, travel_times)
+                for booked_event in booked_events
+            )
+        )
+        self._clashes = (travel_times, clashes)
+        return clashes
+
+    def events_of(self, mask) -> List[Event]:
+        events = []
+        while mask:
+            low_bit = mask & -mask
+            events.append(self.marked_events[low_bit.bit_length() - 1])
+            mask ^= low_bit
+        return events
+
+
+def load_events(
+    config,
+    user_id,
+    date,
+    filter: Filter,
+    hydrate_shares,
+    email=None,
+    travel_times: Optional[TravelTimes] = None,
+):
+    return filter_events(
+        load_day(config, user_id, date, hydrate_shares, email=email),
+        filter,
+        travel_times,
+    )
+
+
+# A show's last bookable performance which starts before the user's visit
+# ends. That's its last bookable performance of all, from show_last_bookable,
+# unless the run goes on after the visit, when the show's own performances are
+# looked up backwards from the end of the visit.
+_LAST_BOOKABLE_IN_VISIT = (
+    "CASE WHEN show_last_bookable.datetime_utc < users.end_datetime_utc THEN show_last_bookable.datetime_utc "
+    + "WHEN show_last_bookable.datetime_utc IS NOT NULL THEN ("
+    + "SELECT max(later.datetime_utc) FROM performances later "
+    + "LEFT JOIN sold_out later_sold_out ON later_sold_out.performance_id = later.id AND later_sold_out.edition = later.edition "
+    + "WHERE later.show_id = shows.id AND later.edition = current_edition() "
+    + "AND later.datetime_utc < users.end_datetime_utc AND later_sold_out.id IS NULL"
+    + ") END"
+)
+
+
+# The parameters are formatted in, so that drivers with different parameter
+# styles can share the query. Only performances overlapping the start and end
+# parameters are fetched; whether a show has later bookable performances comes
+# from _LAST_BOOKABLE_IN_VISIT instead.
+DAY_QUERY = (
+    "SELECT shows.id, shows.title, shows.category, shows.duration, shows.edfringe_url, performances.datetime_utc, venues.id, venues.name, venues.latlong::text, interests.interest, performances.id, user_performance_interests.interest, sold_out.id, "
+    + _LAST_BOOKABLE_IN_VISIT
+    + " FROM shows INNER JOIN performances ON shows.id = performances.show_id "
+    + "INNER JOIN venues ON shows.venue_id = venues.id "
+    + "INNER JOIN interests ON shows.id = interests.show_id "
+    + "INNER JOIN users ON users.id = interests.user_id "
+    + "LEFT JOIN (SELECT * FROM performance_interests WHERE user_id = {user_id}) user_performance_interests ON performances.id = user_performance_interests.performance_id AND performances.edition = user_performance_interests.edition "
+    + "LEFT JOIN sold_out ON sold_out.performance_id = performances.id AND sold_out.edition = performances.edition "
+    + "LEFT JOIN show_last_bookable ON show_last_bookable.show_id = shows.id "
+    + "WHERE users.id = {user_id} AND performances.edition = current_edition() "
+    + "AND performances.datetime_utc > users.start_datetime_utc AND performances.datetime_utc < users.end_datetime_utc "
+    + "AND performances.datetime_utc < {end} AND performances.datetime_utc + shows.duration > {start} "
+    + "ORDER BY performances.datetime_utc ASC, shows.title ASC"
+)
+
+
+# The DAY_QUERY rows of several users at once, each prefixed by the user's ID
+# and email, so that sharers' days can be loaded in one query rather than one
+# per sharer. The user IDs parameter is an array.
+SHARED_DAY_QUERY = (
+    "SELECT users.id, users.email, shows.id, shows.title, shows.category, shows.duration, shows.edfringe_url, performances.datetime_utc, venues.id, venues.name, venues.latlong::text, interests.interest, performances.id, user_performance_interests.interest, sold_out.id, "
+    + _LAST_BOOKABLE_IN_VISIT
+    + " FROM shows INNER JOIN performances ON shows.id = performances.show_id "
+    + "INNER JOIN venues ON shows.venue_id = venues.id "
+    + "INNER JOIN interests ON shows.id = interests.show_id "
+    + "INNER JOIN users ON users.id = interests.user_id "
+    + "LEFT JOIN performance_interests user_performance_interests ON performances.id = user_performance_interests.performance_id AND performances.edition = user_performance_interests.edition AND user_performance_interests.user_id = users.id "
+    + "LEFT JOIN sold_out ON sold_out.performance_id = performances.id AND sold_out.edition = performances.edition "
+    + "LEFT JOIN show_last_bookable ON show_last_bookable.show_id = shows.id "
+    + "WHERE users.id = ANY({user_ids}) AND performances.edition = current_edition() "
+    + "AND performances.datetime_utc > users.start_datetime_utc AND performances.datetime_utc < users.end_datetime_utc "
+    + "AND performances.datetime_utc < {end} AND performances.datetime_utc + shows.duration > {start} "
+    + "ORDER BY performances.datetime_utc ASC, shows.title ASC"
+)
+
+
+def load_day(config, user_id, date, hydrate_shares, email=None) -> Day:
+    start_of_day, end_of_day = day_bounds(date)
     shared_interests = defaultdict(set)
     if hydrate_shares:
-        for (
-            shared_by_user_id,
-            shared_by_user_email,
-        ) in get_shared_by_user_ids_and_emails(config, user_id):
-            events = load_events(
-                config,
-                shared_by_user_id,
-                date,
-                Filter.show_all(),
-                False,
-                email=shared_by_user_email,
-            )
-            for event in events:
-                shared_interests[event.performance_id].add(event)
+        sharers = get_shared_by_user_ids_and_emails(config, user_id)
+        if sharers:
+            with cursor(config) as cur:
+                cur.execute(
+                    SHARED_DAY_QUERY.format(
+                        user_ids="%(user_ids)s", start="%(start)s", end="%(end)s"
+                    ),
+                    {
+                        "user_ids": [
+                            shared_by_user_id for shared_by_user_id, _ in sharers
+                        ],
+                        "start": start_of_day,
+                        "end": end_of_day,
+                    },
+                )
+                shared_interests = shared_interests_from_rows(cur.fetchall(), date)
 
-    events = []
-    booked_events = []
-    later_event_ids = set()
     with cursor(config) as cur:
-        # TODO: Filter on start/end time?
         cur.execute(
-            "SELECT shows.id, shows.title, shows.category, shows.duration, shows.edfringe_url, performances.datetime_utc, venues.name, venues.latlong, interests.interest, performances.id, user_performance_interests.interest, sold_out.id "
-            + "FROM shows INNER JOIN performances ON shows.id = performances.show_id "
-            + "INNER JOIN venues ON shows.venue_id = venues.id "
-            + "INNER JOIN interests ON shows.id = interests.show_id "
-            + "INNER JOIN users ON users.id = interests.user_id "
-            + "LEFT JOIN (SELECT * FROM performance_interests WHERE user_id = %(user_id)s) user_performance_interests ON performances.id = user_performance_interests.performance_id "
-            + "LEFT JOIN sold_out ON sold_out.performance_id = performances.id "
-            + "WHERE users.id = %(user_id)s "
-            + "AND performances.datetime_utc > users.start_datetime_utc AND performances.datetime_utc < users.end_datetime_utc "
-            + "ORDER BY performances.datetime_utc ASC, shows.title ASC",
-            {"user_id": user_id},
+            DAY_QUERY.format(user_id="%(user_id)s", start="%(start)s", end="%(end)s"),
+            {"user_id": user_id, "start": start_of_day, "end": end_of_day},
         )
         rows = cur.fetchall()
-        for row in rows:
-            # TODO: Shows which overlap around the day change
-            (
-                show_id,
-                title,
-                category,
-                duration,
-                edfringe_url,
-                datetime_utc,
-                venue_name,
-                venue_latlong,
-                show_interest,
-                performance_id,
-                performance_interest,
-                sold_out_id,
-            ) = row
-            start_edinburgh = datetime_utc.astimezone(pytz.timezone("Europe/London"))
-            end_edinburgh = start_edinburgh + duration
-            if end_edinburgh <= start_of_day:
-                continue
-            if start_edinburgh >= end_of_day:
-                # TODO: Filter out future conflicts
-                later_event_ids.add(show_id)
-                continue
-            event = Event(
-                show_id=show_id,
-                title=title,
-                category=category,
-                venue=Venue(
-                    name=venue_name,
-                    google_maps_url="https://www.google.co.uk/maps/search/{}".format(
-                        venue_latlong
-                    ),
-                ),
-                edfringe_url=edfringe_url,
-                duration=duration,
-                start_edinburgh=start_edinburgh,
-                show_interest=show_interest,
-                performance_id=performance_id,
-                performance_interest=performance_interest,
-                user_id=user_id,
-                shared_interests=frozenset(shared_interests[performance_id]),
-                user_email=email,
-            )
-            if event.booked:
-                booked_events.append(event)
-            else:
-                if sold_out_id is not None:
-                    continue
-            events.append(event)
-
-    def maybe_last_chance(event):
-        return (
-            event
-            if event.show_id in later_event_ids
-            else dataclasses.replace(event, last_chance=True)
+    return day_from_rows(rows, user_id, date, shared_interests, email)
+
+
+def shared_interests_from_rows(rows, date):
+    # Groups SHARED_DAY_QUERY rows into each sharer's day, and indexes the
+    # events they'd see on it by performance.
+    rows_by_sharer = defaultdict(list)
+    for row in rows:
+        rows_by_sharer[(row[0], row[1])].append(row[2:])
+    shared_interests = defaultdict(set)
+    for (
+        shared_by_user_id,
+        shared_by_user_email,
+    ), sharer_rows in rows_by_sharer.items():
+        day = day_from_rows(
+            sharer_rows,
+            shared_by_user_id,
+            date,
+            defaultdict(set),
+            shared_by_user_email,
         )
+        for event in filter_events(day, Filter.show_all()):
+            shared_interests[event.performance_id].add(event)
+    return shared_interests
 
-    events = [
-        maybe_last_chance(event)
-        for event in events
-        if filter.show(event)
-        and (
-            event.booked
-            or not any(event.intersects(booked_event) for booked_event in booked_events)
+
+def day_from_rows(rows, user_id, date, shared_interests, email=None) -> Day:
+    start_of_day, end_of_day = day_bounds(date)
+    events = []
+    sold_out_performance_ids = set()
+    later_event_ids = set()
+    for row in rows:
+        # TODO: Shows which overlap around the day change
+        (
+            show_id,
+            title,
+            category,
+            duration,
+            edfringe_url,
+            datetime_utc,
+            venue_id,
+            venue_name,
+            venue_latlong,
+            show_interest,
+            performance_id,
+            performance_interest,
+            sold_out_id,
+            last_bookable_in_visit_utc,
+        ) = row
+        start_edinburgh = datetime_utc.astimezone(pytz.timezone("Europe/London"))
+        end_edinburgh = start_edinburgh + duration
+        if end_edinburgh <= start_of_day or start_edinburgh >= end_of_day:
+            continue
+        # A show can be seen later if it has a bookable performance after
+        # today and during the visit.
+        # TODO: Filter out future conflicts
+        if (
+            last_bookable_in_visit_utc is not None
+            and last_bookable_in_visit_utc >= end_of_day
+        ):
+            later_event_ids.add(show_id)
+        event = Event(
+            show_id=show_id,
+            title=title,
+            category=category,
+            venue=Venue(
+                id=venue_id,
+                name=venue_name,
+                google_maps_url="https://www.google.co.uk/maps/search/{}".format(
+                    venue_latlong
+                ),
+            ),
+            edfringe_url=edfringe_url,
+            duration=duration,
+            start_edinburgh=start_edinburgh,
+            show_interest=show_interest,
+            performance_id=performance_id,
+            performance_interest=performance_interest,
+            user_id=user_id,
+            shared_interests=frozenset(shared_interests[performance_id]),
+            user_email=email,
         )
-    ]
-    return events
+        if sold_out_id is not None:
+            sold_out_performance_ids.add(performance_id)
+        events.append(event)
+
+    return Day(
+        events=tuple(events),
+        sold_out_performance_ids=frozenset(sold_out_performance_ids),
+        later_show_ids=frozenset(later_event_ids),
+    )
+
+
+def filter_events(
+    day: Day, filter: Filter, travel_times: Optional[TravelTimes] = None
+) -> List[Event]:
+    index = day.index
+    shown = filter.mask(index) & ~index.sold_out & ~index.clashes(travel_times)
+    return index.events_of(shown)
 
 
 def set_interest(config, user_id, show_id, interest):
@@ -435,6 +727,27 @@ class Filter:
             return False
         return True
 
+    def mask(self, index: DayIndex) -> int:
+        # The events of index which show() would show, as a bitset.
+        shown = index.all
+        if not self.show_past:
+            now = datetime.datetime.utcnow().astimezone(pytz.timezone("Europe/London"))
+            shown &= ~index.starting_by(now)
+        if self.start_at is not None:
+            shown &= ~index.starting_before(self.start_at)
+        if self.end_at is not None:
+            shown &= index.starting_by(self.end_at)
+        hidden = 0
+        if not self.show_like:
+            hidden |= index.interests.get("Like", 0)
+        if not self.show_must:
+            hidden |= index.interests.get("Must", 0)
+        if not self.show_booked:
+            hidden |= index.interests.get("Booked", 0)
+        for category in self.hidden_categories:
+            hidden |= index.categories.get(category, 0)
+        return shown & ~(hidden & ~(index.booked | index.last_chance))
+
 
 _interest_rates = {"": 0, None: 0, "Booked": 0, "Like": 1, "Must": 2}
 
@@ -0,0 +1,337 @@
+import dataclasses
+import datetime
+import random
+import unittest
+from unittest import mock
+
+import pytz
+from sortedcontainers import SortedSet
+
+import sharing
+from db import cursor
+from events import (
+    Day,
+    Filter,
+    bin_pack_events,
+    filter_events,
+    load_day,
+    load_events,
+)
+from plans import DayPlanCache
+from synthetic import CATEGORIES, FESTIVAL_START, make_events, seed_database
+from testdb import config_for_tests, reset_database
+
+DATE = datetime.date(2019, 8, 10)
+
+
+def make_day(events, sold_out=()):
+    return Day(
+        events=tuple(events),
+        sold_out_performance_ids=frozenset(sold_out),
+        later_show_ids=frozenset(event.show_id for event in events),
+    )
+
+
+class TestDay(unittest.TestCase):
+    def setUp(self):
+        self.events = [
+            dataclasses.replace(event, performance_interest=None)
+            for event in make_events(DATE, 20)
+        ]
+        self.day = make_day(self.events)
+
+    def test_set_interest(self):
+        show_id = self.events[3].show_id
+        day = self.day.set_interest(show_id, "Must")
+        for event in day.events:
+            if event.show_id == show_id:
+                self.assertEqual("Must", event.interest)
+            else:
+                self.assertIn(event, self.events)
+
+    def test_set_interest_of_unknown_show(self):
+        self.assertIsNone(self.day.set_interest(10000, "Must"))
+
+    def test_mark_booked(self):
+        performance_id = self.events[3].performance_id
+        day = self.day.mark_booked(performance_id)
+        booked = [event for event in day.events if event.booked]
+        self.assertEqual([performance_id], [event.performance_id for event in booked])
+        self.assertEqual("Booked", booked[0].show_interest)
+
+    def test_remove_interest(self):
+        show_id = self.events[3].show_id
+        day = self.day.remove_interest(show_id)
+        self.assertNotIn(show_id, [event.show_id for event in day.events])
+        self.assertEqual(len(self.events) - 1, len(day.events))
+
+    def test_unset_performance_interest(self):
+        performance_id = self.events[3].performance_id
+        day = self.day.set_performance_interest(performance_id, "Must")
+        day = day.unset_performance_interest(performance_id=performance_id)
+        self.assertEqual(self.day, day)
+
+
+class TestFilterEvents(unittest.TestCase):
+    def test_sold_out_only_shown_if_booked(self):
+        events = make_events(DATE, 20)
+        day = make_day(events, sold_out=[event.performance_id for event in events])
+        shown = filter_events(day, Filter.show_all())
+        self.assertTrue(shown)
+        self.assertTrue(all(event.booked for event in shown))
+
+    def test_clashes_with_bookings_hidden(self):
+        events = make_events(DATE, 50)
+        shown = filter_events(make_day(events), Filter.show_all())
+        booked = [event for event in shown if event.booked]
+        for event in shown:
+            if not event.booked:
+                self.assertFalse(any(event.intersects(b) for b in booked))
+
+    def test_matches_checking_each_event(self):
+        events = make_events(DATE, 100)
+        rng = random.Random(0)
+        day = make_day(
+            events,
+            sold_out=rng.sample([event.performance_id for event in events], 10),
+        )
+        day = dataclasses.replace(
+            day,
+            later_show_ids=frozenset(rng.sample(sorted(day.later_show_ids), 80)),
+        )
+        booked = [event for event in day.events if event.booked]
+        times = [event.start_edinburgh for event in events]
+        for _ in range(200):
+            filter = Filter(
+                show_like=rng.random() < 0.5,
+                show_must=rng.random() < 0.5,
+                show_booked=rng.random() < 0.5,
+                start_at=rng.choice([None] + times),
+                end_at=rng.choice([None] + times),
+                show_past=True,
+                hidden_categories=SortedSet(
+                    rng.sample(CATEGORIES, rng.randrange(len(CATEGORIES)))
+                ),
+            )
+            expected = [
+                (
+                    event
+                    if event.show_id in day.later_show_ids
+                    else dataclasses.replace(event, last_chance=True)
+                )
+                for event in day.events
+                if (
+                    event.booked
+                    or event.performance_id not in day.sold_out_performance_ids
+                )
+                and filter.show(event)
+                and (event.booked or not any(event.intersects(b) for b in booked))
+            ]
+            with self.subTest(filter=filter):
+                self.assertEqual(expected, filter_events(day, filter))
+
+    def test_past_hidden(self):
+        events = make_events(datetime.date.today(), 20)
+        now = datetime.datetime.now(pytz.utc)
+        filter = dataclasses.replace(Filter.show_all(), show_past=False)
+        shown = filter_events(make_day(events), filter)
+        self.assertEqual(
+            [event for event in shown if event.start_edinburgh > now], shown
+        )
+
+    def test_changed_day_is_reindexed(self):
+        events = make_events(DATE, 20)
+        day = make_day(events)
+        filter = dataclasses.replace(Filter.show_all(), show_must=False)
+        before = filter_events(day, filter)
+        show_id = next(
+            event.show_id
+            for event in day.events
+            if event.interest == "Like" and not event.last_chance
+        )
+        after = filter_events(day.set_interest(show_id, "Must"), filter)
+        self.assertNotIn(show_id, [event.show_id for event in after])
+        self.assertEqual(before, filter_events(day, filter))
+
+
+class TestBinPackEvents(unittest.TestCase):
+    def test_columns_dont_overlap(self):
+        events = make_events(DATE, 100)
+        columns, first_hour, number_of_hours = bin_pack_events(events, "none")
+        self.assertEqual(10, first_hour)
+        packed = []
+        for column in columns:
+            self.assertEqual(
+                60 * number_of_hours,
+                sum(e.one_minute_chunks for e in column.events_or_padding),
+            )
+            column_events = [
+                e.event for e in column.events_or_padding if e.event is not None
+            ]
+            for earlier, later in zip(column_events, column_events[1:]):
+                self.assertFalse(earlier.intersects(later))
+            packed += column_events
+        self.assertEqual(sorted(map(id, events)), sorted(map(id, packed)))
+
+
+class TestLastChance(unittest.TestCase):
+    def setUp(self):
+        self.config = config_for_tests()
+        reset_database(self.config)
+        with cursor(self.config) as cur:
+            (self.user_id,) = seed_database(
+                cur, venues=1, shows=1, users=1, interests_per_user=1, shares_per_user=0
+            )
+            cur.execute(
+                "UPDATE users SET start_datetime_utc = %s, end_datetime_utc = %s",
+                (
+                    datetime.datetime.combine(FESTIVAL_START, datetime.time(4)),
+                    datetime.datetime.combine(
+                        FESTIVAL_START + datetime.timedelta(days=30),
+                        datetime.time(4),
+                    ),
+                ),
+            )
+            cur.execute("DELETE FROM sold_out")
+            cur.execute(
+                "SELECT id, datetime_utc FROM performances ORDER BY datetime_utc"
+            )
+            self.performances = cur.fetchall()
+
+    def is_last_chance(self, performance_id, datetime_utc):
+        date = datetime_utc.astimezone(pytz.timezone("Europe/London")).date()
+        (event,) = (
+            event
+            for event in load_events(
+                self.config, self.user_id, date, Filter.show_all(), False
+            )
+            if event.performance_id == performance_id
+        )
+        return event.last_chance
+
+    def sell_out(self, performances):
+        with cursor(self.config) as cur:
+            for performance_id, _ in performances:
+                cur.execute(
+                    "INSERT INTO sold_out (performance_id) VALUES (%s)",
+                    (performance_id,),
+                )
+
+    def last_bookable(self):
+        with cursor(self.config) as cur:
+            cur.execute("SELECT datetime_utc FROM show_last_bookable")
+            row = cur.fetchone()
+        return None if row is None else row[0]
+
+    def test_last_performance(self):
+        self.assertFalse(self.is_last_chance(*self.performances[0]))
+        self.assertTrue(self.is_last_chance(*self.performances[-1]))
+        self.assertEqual(self.performances[-1][1], self.last_bookable())
+
+    def test_later_performances_sold_out(self):
+        self.sell_out(self.performances[2:])
+        self.assertFalse(self.is_last_chance(*self.performances[0]))
+        self.assertTrue(self.is_last_chance(*self.performances[1]))
+        self.assertEqual(self.performances[1][1], self.last_bookable())
+
+        with cursor(self.config) as cur:
+            cur.execute(
+                "DELETE FROM sold_out WHERE performance_id = %s",
+                (self.performances[-1][0],),
+            )
+        self.assertFalse(self.is_last_chance(*self.performances[1]))
+        self.assertEqual(self.performances[-1][1], self.last_bookable())
+
+    def test_no_performances_for_rest_of_visit(self):
+        # The run goes on after the visit ends, but has nothing on the
+        # visit's last days.
+        with cursor(self.config) as cur:
+            cur.execute(
+                "UPDATE users SET end_datetime_utc = %s", (self.performances[6][1],)
+            )
+            cur.execute(
+                "DELETE FROM performances WHERE id IN (%s, %s)",
+                (self.performances[4][0], self.performances[5][0]),
+            )
+        self.assertFalse(self.is_last_chance(*self.performances[2]))
+        self.assertTrue(self.is_last_chance(*self.performances[3]))
+        self.assertEqual(self.performances[-1][1], self.last_bookable())
+
+    def test_everything_sold_out(self):
+        self.sell_out(self.performances)
+        self.assertIsNone(self.last_bookable())
+
+    def test_new_performance(self):
+        with cursor(self.config) as cur:
+            cur.execute(
+                "INSERT INTO performances (show_id, datetime_utc) "
+                + "SELECT show_id, datetime_utc + interval '1 day' FROM performances "
+                + "WHERE id = %s RETURNING datetime_utc",
+                (self.performances[-1][0],),
+            )
+            (datetime_utc,) = cur.fetchone()
+        self.assertFalse(self.is_last_chance(*self.performances[-1]))
+        self.assertEqual(datetime_utc, self.last_bookable())
+
+
+class TestSharedDays(unittest.TestCase):
+    def setUp(self):
+        self.config = config_for_tests()
+        reset_database(self.config)
+        with cursor(self.config) as cur:
+            self.user_ids = seed_database(
+                cur, venues=1, shows=1, users=2, interests_per_user=1, shares_per_user=0
+            )
+            cur.execute(
+                "UPDATE users SET start_datetime_utc = %s, end_datetime_utc = %s",
+                (
+                    datetime.datetime.combine(FESTIVAL_START, datetime.time(4)),
+                    datetime.datetime.combine(
+                        FESTIVAL_START + datetime.timedelta(days=30),
+                        datetime.time(4),
+                    ),
+                ),
+            )
+            cur.execute("SELECT datetime_utc FROM performances ORDER BY datetime_utc")
+            self.date = (
+                cur.fetchone()[0].astimezone(pytz.timezone("Europe/London")).date()
+            )
+        self.day_plans = DayPlanCache()
+        patcher = mock.patch.object(
+            sharing, "_on_invalidate", [self.day_plans.invalidate_hydrated]
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(sharing.invalidate)
+
+    def sharers(self):
+        user_id = self.user_ids[1]
+        day = self.day_plans.get(
+            (user_id, self.date, True),
+            lambda: load_day(self.config, user_id, self.date, True),
+        )
+        self.assertTrue(day.events)
+        return {
+            shared.user_email
+            for event in day.events
+            for shared in event.shared_interests
+        }
+
+    def test_share_and_unshare(self):
+        self.assertEqual(set(), self.sharers())
+        sharing.share(
+            self.config,
+            shared_by=self.user_ids[0],
+            shared_with_email="user1@example.com",
+        )
+        self.assertEqual({"user0@example.com"}, self.sharers())
+        sharing.unshare(
+            self.config,
+            shared_by=self.user_ids[0],
+            shared_with_email="user1@example.com",
+        )
+        self.assertEqual(set(), self.sharers())
+
+
+if __name__ == "__main__":
+    unittest.main()
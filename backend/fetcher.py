@@ -6,56 +6,57 @@ import pytz
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 
+from editions import Edition
 
-def check_soldout_for_single_time(cur, show_id):
+
+def check_soldout_for_single_time(cur, show_id, edition: Edition):
     cur.execute("SELECT edfringe_url FROM shows WHERE id = %s", (show_id,))
     edfringe_url = cur.fetchone()[0]
 
     with make_driver() as driver:
-        day_links = lookup_day_links(driver, edfringe_url, "01-08-2019")
+        day_links = lookup_day_links(driver, edfringe_url, edition.starts_on)
         for day_link in day_links:
             day = day_link.text
             span = day_link.find_element_by_tag_name("span")
             soldout = "tickets-soldout" in span.get_attribute("class").split(" ")
             if soldout:
+                early_morning = pytz.timezone("Europe/London").localize(
+                    datetime.datetime.combine(
+                        edition.date_of_day(int(day)), datetime.time(5)
+                    )
+                )
                 cur.execute(
-                    "SELECT id FROM performances WHERE show_id = %s AND datetime_utc > %s LIMIT 1",
-                    (
-                        show_id,
-                        datetime.datetime.strptime(
-                            "2019 08 {:02d} 05:00 +0100".format(int(day)),
-                            "%Y %m %d %H:%M %z",
-                        ),
-                    ),
+                    "SELECT id FROM performances WHERE show_id = %s AND datetime_utc > %s AND edition = %s LIMIT 1",
+                    (show_id, early_morning, edition.year),
                 )
                 performance_id = cur.fetchone()[0]
                 cur.execute(
-                    "INSERT INTO sold_out (performance_id) VALUES (%s) "
+                    "INSERT INTO sold_out (performance_id, edition) VALUES (%s, %s) "
                     + "ON CONFLICT ON CONSTRAINT sold_out_performance_id_key DO NOTHING",
-                    (performance_id,),
+                    (performance_id, edition.year),
                 )
 
 
-def fetch_multitime(cur, show_id, some_date_DD_MM_YYYY):
+def fetch_multitime(cur, show_id, edition: Edition, some_date: datetime.date):
     cur.execute("SELECT edfringe_url FROM shows WHERE id = %s", (show_id,))
     edfringe_url = cur.fetchone()[0]
 
     for datetime_utc, available_or_sold_out in lookup_shows(
-        edfringe_url, some_date_DD_MM_YYYY
+        edfringe_url, edition, some_date
     ):
         cur.execute(
-            "INSERT INTO performances (show_id, datetime_utc) VALUES (%(show_id)s, %(datetime_utc)s) "
+            "INSERT INTO performances (show_id, datetime_utc, edition) VALUES (%(show_id)s, %(datetime_utc)s, %(edition)s) "
             + "ON CONFLICT ON CONSTRAINT performances_show_id_datetime_utc_key "
             + "DO UPDATE SET show_id = EXCLUDED.show_id "
             + "RETURNING id",
-            dict(show_id=show_id, datetime_utc=datetime_utc),
+            dict(show_id=show_id, datetime_utc=datetime_utc, edition=edition.year),
         )
         performance_id = cur.fetchone()[0]
         if available_or_sold_out == "sold_out":
             cur.execute(
-                "INSERT INTO sold_out (performance_id) VALUES (%s) "
+                "INSERT INTO sold_out (performance_id, edition) VALUES (%s, %s) "
                 + "ON CONFLICT ON CONSTRAINT sold_out_performance_id_key DO NOTHING",
-                (performance_id,),
+                (performance_id, edition.year),
             )
 
 
@@ -70,9 +71,9 @@ def make_driver():
         driver.quit()
 
 
-def lookup_shows(edfringe_url, some_date_dd_mm_yyyy):
+def lookup_shows(edfringe_url, edition: Edition, some_date: datetime.date):
     with make_driver() as driver:
-        day_links = lookup_day_links(driver, edfringe_url, some_date_dd_mm_yyyy)
+        day_links = lookup_day_links(driver, edfringe_url, some_date)
         days = [(link.text, link.get_property("href")) for link in day_links]
         for day, href in days:
             driver.get(href)
@@ -87,8 +88,9 @@ def lookup_shows(edfringe_url, some_date_dd_mm_yyyy):
             for link in links:
                 time_str = link.text
                 soldout = "tickets-soldout" in link.get_attribute("class").split(" ")
-                local = datetime.datetime.strptime(
-                    "2019 08 {:02d} {}".format(int(day), time_str), "%Y %m %d %H:%M"
+                local = datetime.datetime.combine(
+                    edition.date_of_day(int(day)),
+                    datetime.datetime.strptime(time_str, "%H:%M").time(),
                 )
                 local = pytz.timezone("Europe/London").localize(local)
                 yield (
@@ -97,9 +99,9 @@ def lookup_shows(edfringe_url, some_date_dd_mm_yyyy):
                 )
 
 
-def lookup_day_links(driver, edfringe_url, some_date_dd_mm_yyyy):
+def lookup_day_links(driver, edfringe_url, some_date: datetime.date):
     url = "https://tickets.edfringe.com{}?step=times&day={}".format(
-        edfringe_url, some_date_dd_mm_yyyy
+        edfringe_url, some_date.strftime("%d-%m-%Y")
     )
     driver.get(url)
 
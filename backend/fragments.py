@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+
+class EventCardCache:
+    def __init__(self, jinja_env, maxsize=10000):
+        self.jinja_env = jinja_env
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cards = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, event, hour_height_px):
+        # Events are frozen, so the event itself (including its interests and
+        # any shared interests) identifies everything the card shows.
+        key = (event, hour_height_px)
+        with self._lock:
+            card = self._cards.get(key)
+            if card is not None:
+                self._cards.move_to_end(key)
+                self.hits += 1
+                return card
+        card = Markup(
+            self.jinja_env.get_template("event.html").render(
+                event=event, hour_height_px=hour_height_px
+            )
+        )
+        with self._lock:
+            self.misses += 1
+            self._cards[key] = card
+            if len(self._cards) > self.maxsize:
+                self._cards.popitem(last=False)
+        return card
+
+    def clear(self):
+        with self._lock:
+            self._cards.clear()
+
+
+class ChunkedStream:
+    # Groups the many small pieces Jinja generates into one chunk per call to
+    # flush(), so that a page can be sent a section at a time.
+    def __init__(self):
+        self._flush = False
+
+    def flush(self):
+        self._flush = True
+        return ""
+
+    def chunks(self, pieces):
+        buffer = []
+        for piece in pieces:
+            buffer.append(piece)
+            if self._flush:
+                self._flush = False
+                yield "".join(buffer)
+                buffer = []
+        if buffer:
+            yield "".join(buffer)
@@ -0,0 +1,51 @@
+import unittest
+
+from jinja2 import DictLoader, Environment
+
+from fragments import ChunkedStream, EventCardCache
+
+
+class TestChunkedStream(unittest.TestCase):
+    def test_flushes_after_marked_pieces(self):
+        stream = ChunkedStream()
+
+        def pieces():
+            yield "<head>"
+            yield stream.flush()
+            yield "<body>"
+            stream.flush()
+            yield "<column>"
+            yield "</body>"
+
+        self.assertEqual(
+            ["<head>", "<body><column>", "</body>"], list(stream.chunks(pieces()))
+        )
+
+
+class TestEventCardCache(unittest.TestCase):
+    def setUp(self):
+        self.env = Environment(
+            loader=DictLoader({"event.html": "{{event}}@{{hour_height_px}}"}),
+            autoescape=True,
+        )
+
+    def test_renders_each_card_once(self):
+        cards = EventCardCache(self.env)
+        self.assertEqual("a@200", cards.render("a", 200))
+        self.assertEqual("a@200", cards.render("a", 200))
+        self.assertEqual("a@100", cards.render("a", 100))
+        self.assertEqual((1, 2), (cards.hits, cards.misses))
+
+    def test_evicts_least_recently_used(self):
+        cards = EventCardCache(self.env, maxsize=2)
+        cards.render("a", 200)
+        cards.render("b", 200)
+        cards.render("a", 200)
+        cards.render("c", 200)
+        cards.render("a", 200)
+        cards.render("b", 200)
+        self.assertEqual((2, 4), (cards.hits, cards.misses))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import bisect
+import datetime
+import math
+import threading
+from array import array
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import catalog
+from catalog import Catalog, CatalogPerformance, CatalogShow, CatalogVenue
+from db import cursor
+from groups import Interval, free_intervals
+
+
+@dataclass(frozen=True)
+class FreePerformance:
+    performance: CatalogPerformance
+    show: CatalogShow
+    venue: Optional[CatalogVenue]
+
+    @property
+    def end_utc(self) -> datetime.datetime:
+        return self.performance.datetime_utc + self.show.duration
+
+
+@dataclass(frozen=True)
+class FreeSlot:
+    start: datetime.datetime
+    end: datetime.datetime
+    # Sorted by start time.
+    performances: Tuple[FreePerformance, ...]
+
+
+class PerformanceIntervals:
+    # An interval tree over every performance in a catalog which can still be
+    # booked, for finding those which fit inside a given interval.
+    #
+    # Performances are the leaves of an implicit balanced tree, in order of
+    # start time, and each node holds the earliest end of any performance
+    # below it. Those starting inside the interval are a range of leaves, and
+    # subtrees in that range where everything ends after the interval are
+    # skipped whole, so a lookup takes time in proportion to how many
+    # performances fit rather than to how many start in the interval.
+    #
+    # Every performance in the catalog is a leaf, in the catalog's order, with
+    # those which can't be booked ending never, so the start times are the
+    # catalog's own column (mapped, from a snapshot) and rows are only made
+    # for the performances which fit. The tree of ends is still each
+    # process's own, at 16 bytes a performance.
+
+    def __init__(self, source: Catalog):
+        self.catalog = source
+        columns = source.performance_columns()
+        # Seconds since the epoch.
+        self._starts = columns.starts
+        durations = {
+            show.id: show.duration.total_seconds()
+            for show in source.shows.values()
+            if show.duration is not None
+        }
+        self._leaves = 1
+        while self._leaves < len(self._starts):
+            self._leaves *= 2
+        self._earliest_ends = array("d", [math.inf]) * (2 * self._leaves)
+        self._bookable = 0
+        bookable_show_ids = set()
+        for i, show_id in enumerate(columns.show_ids):
+            duration = durations.get(show_id)
+            if duration is None or columns.sold_out[i]:
+                continue
+            self._earliest_ends[self._leaves + i] = self._starts[i] + duration
+            self._bookable += 1
+            bookable_show_ids.add(show_id)
+        # Of the shows with performances here.
+        self.categories = sorted(
+            {source.shows[show_id].category for show_id in bookable_show_ids}
+        )
+        for node in range(self._leaves - 1, 0, -1):
+            self._earliest_ends[node] = min(
+                self._earliest_ends[2 * node], self._earliest_ends[2 * node + 1]
+            )
+
+    def __len__(self):
+        return self._bookable
+
+    def fitting(self, start, end) -> List[CatalogPerformance]:
+        # Performances which start no earlier than start and end no later
+        # than end, in order of start time.
+        start, end = start.timestamp(), end.timestamp()
+        first = bisect.bisect_left(self._starts, start)
+        last = bisect.bisect_right(self._starts, end)
+        fitting = []
+        # Right children are pushed first so that leaves are found in order.
+        to_visit = [(1, 0, self._leaves)]
+        while to_visit:
+            node, node_first, node_last = to_visit.pop()
+            if (
+                node_last <= first
+                or node_first >= last
+                or self._earliest_ends[node] > end
+            ):
+                continue
+            if node >= self._leaves:
+                fitting.append(self.catalog.performances[node - self._leaves])
+                continue
+            middle = (node_first + node_last) // 2
+            to_visit.append((2 * node + 1, middle, node_last))
+            to_visit.append((2 * node, node_first, middle))
+        return fitting
+
+
+_intervals = None
+_intervals_lock = threading.Lock()
+
+
+def get_performance_intervals(config) -> PerformanceIntervals:
+    # Rebuilt whenever the catalog is.
+    global _intervals
+    source = catalog.get_catalog(config)
+    with _intervals_lock:
+        if _intervals is None or _intervals.catalog is not source:
+            _intervals = PerformanceIntervals(source)
+        return _intervals
+
+
+def find_free_slots(
+    config, user_id, window: Interval, category: Optional[str] = None
+) -> List[FreeSlot]:
+    # The gaps between the user's bookings during window (and their visit),
+    # with every bookable performance which fits in each, optionally only of
+    # one category. Gaps which nothing fits in are left out.
+    with cursor(config) as cur:
+        cur.execute(
+            "SELECT users.start_datetime_utc, users.end_datetime_utc, booked.datetime_utc, booked.duration "
+            + "FROM users LEFT JOIN ("
+            + "SELECT performances.datetime_utc, shows.duration FROM performance_interests "
+            + "INNER JOIN performances ON performances.id = performance_interests.performance_id AND performances.edition = performance_interests.edition "
+            + "INNER JOIN shows ON shows.id = performances.show_id "
+            + "WHERE performance_interests.user_id = %(user_id)s "
+            + "AND performance_interests.interest = 'Booked' "
+            + "AND performances.edition = current_edition() "
+            + "AND performances.datetime_utc < %(end)s "
+            + "AND performances.datetime_utc + shows.duration > %(start)s"
+            + ") booked ON true WHERE users.id = %(user_id)s",
+            {"user_id": user_id, "start": window[0], "end": window[1]},
+        )
+        rows = cur.fetchall()
+    if not rows:
+        raise ValueError("Unknown user: {}".format(user_id))
+
+    visit_start, visit_end = rows[0][:2]
+    search_start = max(window[0], visit_start)
+    search_end = min(window[1], visit_end)
+    if search_start >= search_end:
+        return []
+    busy = [
+        (datetime_utc, datetime_utc + duration)
+        for _, _, datetime_utc, duration in rows
+        if datetime_utc is not None
+    ]
+
+    intervals = get_performance_intervals(config)
+    source = intervals.catalog
+    slots = []
+    for start, end in free_intervals((search_start, search_end), busy):
+        performances = []
+        for performance in intervals.fitting(start, end):
+            show = source.shows[performance.show_id]
+            if category is None or show.category == category:
+                performances.append(
+                    FreePerformance(
+                        performance=performance,
+                        show=show,
+                        venue=source.venues.get(show.venue_id),
+                    )
+                )
+        if performances:
+            slots.append(FreeSlot(start, end, tuple(performances)))
+    return slots
@@ -0,0 +1,238 @@
+import dataclasses
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+import unittest
+
+import pytz
+
+import catalog
+import free_slots
+from catalog import CatalogPerformance, CatalogShow, CatalogVenue
+from db import cursor
+from events import day_bounds, mark_booked
+from free_slots import PerformanceIntervals
+from synthetic import CATEGORIES, FESTIVAL_DAYS, FESTIVAL_START, seed_database
+from testdb import config_for_tests, reset_database
+
+DATE = FESTIVAL_START + datetime.timedelta(days=7)
+
+
+def make_catalog(performances, seed=0):
+    # A festival's worth of performances spread over a few thousand shows.
+    rng = random.Random(seed)
+    venues = {
+        i: CatalogVenue(i, "Venue {}".format(i), "", None, None) for i in range(1, 301)
+    }
+    shows = {
+        show_id: CatalogShow(
+            show_id,
+            "Show {}".format(show_id),
+            rng.choice(CATEGORIES),
+            rng.choice(list(venues)),
+            datetime.timedelta(minutes=rng.choice((45, 60, 60, 75, 90, 150))),
+            "/whats-on/{}".format(show_id),
+        )
+        for show_id in range(1, performances // 20 + 1)
+    }
+    first_start = pytz.utc.localize(
+        datetime.datetime.combine(FESTIVAL_START, datetime.time(9))
+    )
+    rows = [
+        CatalogPerformance(
+            performance_id,
+            rng.choice(list(shows)),
+            first_start
+            + datetime.timedelta(
+                days=rng.randrange(FESTIVAL_DAYS), minutes=5 * rng.randrange(12 * 14)
+            ),
+            rng.random() < 0.05,
+        )
+        for performance_id in range(performances)
+    ]
+    rows.sort(key=lambda performance: (performance.datetime_utc, performance.id))
+    return catalog.Catalog(version=0, venues=venues, shows=shows, performances=rows)
+
+
+def brute_force_fitting(source, start, end):
+    return [
+        performance
+        for performance in source.performances
+        if not performance.sold_out
+        and performance.datetime_utc >= start
+        and performance.datetime_utc + source.shows[performance.show_id].duration <= end
+    ]
+
+
+class TestPerformanceIntervals(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.catalog = make_catalog(50000)
+        cls.intervals = PerformanceIntervals(cls.catalog)
+
+    def random_gaps(self, count):
+        rng = random.Random(1)
+        first_start = pytz.utc.localize(
+            datetime.datetime.combine(FESTIVAL_START, datetime.time(8))
+        )
+        for _ in range(count):
+            start = first_start + datetime.timedelta(
+                days=rng.randrange(FESTIVAL_DAYS), minutes=rng.randrange(16 * 60)
+            )
+            yield start, start + datetime.timedelta(minutes=rng.randrange(300))
+
+    def test_matches_brute_force(self):
+        for start, end in self.random_gaps(50):
+            with self.subTest(start=start, end=end):
+                self.assertEqual(
+                    brute_force_fitting(self.catalog, start, end),
+                    self.intervals.fitting(start, end),
+                )
+
+    def test_boundaries(self):
+        performance = next(p for p in self.catalog.performances if not p.sold_out)
+        start = performance.datetime_utc
+        end = start + self.catalog.shows[performance.show_id].duration
+        self.assertIn(performance, self.intervals.fitting(start, end))
+        self.assertNotIn(
+            performance,
+            self.intervals.fitting(start, end - datetime.timedelta(seconds=1)),
+        )
+        self.assertNotIn(
+            performance,
+            self.intervals.fitting(start + datetime.timedelta(seconds=1), end),
+        )
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = os.path.join(cache_dir, "snapshot.bin")
+            catalog.write_snapshot(path, self.catalog)
+            intervals = PerformanceIntervals(catalog.read_snapshot(path))
+            self.assertEqual(len(self.intervals), len(intervals))
+            self.assertEqual(self.intervals.categories, intervals.categories)
+            for start, end in self.random_gaps(20):
+                with self.subTest(start=start, end=end):
+                    self.assertEqual(
+                        self.intervals.fitting(start, end),
+                        intervals.fitting(start, end),
+                    )
+
+    def test_empty(self):
+        intervals = PerformanceIntervals(
+            catalog.Catalog(version=0, venues={}, shows={}, performances=[])
+        )
+        start = pytz.utc.localize(datetime.datetime(2019, 8, 10, 12))
+        self.assertEqual(
+            [], intervals.fitting(start, start + datetime.timedelta(hours=3))
+        )
+
+    def test_fast(self):
+        gaps = list(self.random_gaps(200))
+        timings = []
+        for start, end in gaps:
+            before = time.perf_counter()
+            self.intervals.fitting(start, end)
+            timings.append(time.perf_counter() - before)
+        self.assertLess(statistics.median(timings), 0.002)
+
+
+class TestFindFreeSlots(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dir = tempfile.TemporaryDirectory()
+        cls.config = dataclasses.replace(
+            config_for_tests(), cache_dir=cls.cache_dir.name
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cache_dir.cleanup()
+
+    def setUp(self):
+        reset_database(self.config)
+        with cursor(self.config) as cur:
+            self.user_id = seed_database(
+                cur,
+                venues=5,
+                shows=100,
+                users=1,
+                interests_per_user=0,
+                shares_per_user=0,
+            )[0]
+            visit_start, _ = day_bounds(FESTIVAL_START)
+            visit_end, _ = day_bounds(
+                FESTIVAL_START + datetime.timedelta(days=FESTIVAL_DAYS)
+            )
+            cur.execute(
+                "UPDATE users SET start_datetime_utc = %s, end_datetime_utc = %s",
+                (visit_start, visit_end),
+            )
+        catalog.invalidate()
+        self.addCleanup(catalog.invalidate)
+        self.window = day_bounds(DATE)
+
+    def book(self, hour):
+        # Books the first performance on DATE starting at or after hour.
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT performances.id, performances.datetime_utc, performances.datetime_utc + shows.duration "
+                + "FROM performances INNER JOIN shows ON shows.id = performances.show_id "
+                + "WHERE performances.datetime_utc >= %s ORDER BY performances.datetime_utc, performances.id LIMIT 1",
+                (self.window[0] + datetime.timedelta(hours=hour),),
+            )
+            performance_id, start, end = cur.fetchone()
+        mark_booked(self.config, self.user_id, performance_id)
+        return start, end
+
+    def test_gaps_between_bookings(self):
+        first = self.book(6)
+        second = self.book(10)
+        slots = free_slots.find_free_slots(self.config, self.user_id, self.window)
+
+        self.assertEqual(
+            [
+                (self.window[0], first[0]),
+                (first[1], second[0]),
+                (second[1], self.window[1]),
+            ],
+            [(slot.start, slot.end) for slot in slots],
+        )
+        source = catalog.get_catalog(self.config)
+        for slot in slots:
+            self.assertEqual(
+                brute_force_fitting(source, slot.start, slot.end),
+                [free.performance for free in slot.performances],
+            )
+
+    def test_category(self):
+        self.book(8)
+        slots = free_slots.find_free_slots(
+            self.config, self.user_id, self.window, category="Comedy"
+        )
+        self.assertTrue(slots)
+        for slot in slots:
+            for free in slot.performances:
+                self.assertEqual("Comedy", free.show.category)
+
+    def test_outside_visit(self):
+        window = day_bounds(FESTIVAL_START + datetime.timedelta(days=FESTIVAL_DAYS + 5))
+        self.assertEqual(
+            [], free_slots.find_free_slots(self.config, self.user_id, window)
+        )
+
+    def test_unknown_user(self):
+        with self.assertRaises(ValueError):
+            free_slots.find_free_slots(self.config, self.user_id + 1, self.window)
+
+    def test_rebuilt_with_catalog(self):
+        before = free_slots.get_performance_intervals(self.config)
+        self.assertIs(before, free_slots.get_performance_intervals(self.config))
+        catalog.invalidate()
+        self.assertIsNot(before, free_slots.get_performance_intervals(self.config))
+
+
+if __name__ == "__main__":
+    unittest.main()
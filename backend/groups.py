@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import bisect
+import datetime
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import pytz
+
+from db import cursor
+
+Interval = Tuple[datetime.datetime, datetime.datetime]
+
+
+@dataclass(eq=True, frozen=True)
+class GroupPerformance:
+    show_id: int
+    title: str
+    category: str
+    venue_name: str
+    edfringe_url: str
+    performance_id: int
+    start_edinburgh: datetime.datetime
+    duration: datetime.timedelta
+    # How many of the group marked the show as a Must, rather than a Like.
+    musts: int
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def free_intervals(window: Interval, busy: Iterable[Interval]) -> List[Interval]:
+    window_start, window_end = window
+    free = []
+    cursor_at = window_start
+    for start, end in merge_intervals(busy):
+        if end <= cursor_at:
+            continue
+        if start >= window_end:
+            break
+        if start > cursor_at:
+            free.append((cursor_at, start))
+        cursor_at = max(cursor_at, end)
+    if cursor_at < window_end:
+        free.append((cursor_at, window_end))
+    return free
+
+
+def common_free_intervals(per_user_free: Sequence[List[Interval]]) -> List[Interval]:
+    # Sweep over every interval boundary, tracking how many people are free.
+    # Each user's intervals are already merged, so a count equal to the group
+    # size means everyone is free.
+    boundaries = []
+    for free in per_user_free:
+        for start, end in free:
+            boundaries.append((start, 1))
+            boundaries.append((end, -1))
+    # Ends sort before starts at the same instant, so touching intervals
+    # don't produce zero-length overlaps.
+    boundaries.sort()
+
+    common = []
+    free_count = 0
+    opened_at = None
+    for at, delta in boundaries:
+        free_count += delta
+        if free_count == len(per_user_free):
+            opened_at = at
+        elif opened_at is not None:
+            if at > opened_at:
+                common.append((opened_at, at))
+            opened_at = None
+    return common
+
+
+def fits(common: List[Interval], common_starts: List, start, end) -> bool:
+    index = bisect.bisect_right(common_starts, start) - 1
+    return index >= 0 and end <= common[index][1]
+
+
+def is_connected(user_ids: Set[int], edges: Iterable[Tuple[int, int]]) -> bool:
+    neighbours = defaultdict(set)
+    for a, b in edges:
+        neighbours[a].add(b)
+        neighbours[b].add(a)
+    start = next(iter(user_ids))
+    seen = {start}
+    to_visit = [start]
+    while to_visit:
+        for neighbour in neighbours[to_visit.pop()]:
+            if neighbour in user_ids and neighbour not in seen:
+                seen.add(neighbour)
+                to_visit.append(neighbour)
+    return seen == user_ids
+
+
+def find_group_performances(
+    config, user_ids: Iterable[int], window: Optional[Interval] = None
+) -> List[GroupPerformance]:
+    user_ids = set(user_ids)
+    if not user_ids:
+        return []
+
+    with cursor(config) as cur:
+        cur.execute(
+            "SELECT id, start_datetime_utc, end_datetime_utc FROM users WHERE id = ANY(%s)",
+            (list(user_ids),),
+        )
+        visits: Dict[int, Interval] = {row[0]: (row[1], row[2]) for row in cur}
+        if set(visits) != user_ids:
+            raise ValueError("Unknown users: {}".format(sorted(user_ids - set(visits))))
+
+        cur.execute(
+            "SELECT shared_by, shared_with_user_id FROM shares "
+            + "WHERE shared_by = ANY(%(user_ids)s) AND shared_with_user_id = ANY(%(user_ids)s)",
+            {"user_ids": list(user_ids)},
+        )
+        if not is_connected(user_ids, cur.fetchall()):
+            raise ValueError(
+                "Users {} don't all share with each other".format(sorted(user_ids))
+            )
+
+        search_start = max(start for start, _ in visits.values())
+        search_end = min(end for _, end in visits.values())
+        if window is not None:
+            search_start = max(search_start, window[0])
+            search_end = min(search_end, window[1])
+        if search_start >= search_end:
+            return []
+
+        cur.execute(
+            "SELECT performance_interests.user_id, performances.datetime_utc, shows.duration "
+            + "FROM performance_interests "
+            + "INNER JOIN performances ON performances.id = performance_interests.performance_id AND performances.edition = performance_interests.edition "
+            + "INNER JOIN shows ON shows.id = performances.show_id "
+            + "WHERE performance_interests.user_id = ANY(%(user_ids)s) "
+            + "AND performance_interests.interest = 'Booked' "
+            + "AND performances.edition = current_edition() "
+            + "AND performances.datetime_utc < %(end)s "
+            + "AND performances.datetime_utc + shows.duration > %(start)s",
+            {"user_ids": list(user_ids), "start": search_start, "end": search_end},
+        )
+        busy = defaultdict(list)
+        for booked_by, datetime_utc, duration in cur:
+            busy[booked_by].append((datetime_utc, datetime_utc + duration))
+
+        common = common_free_intervals(
+            [
+                free_intervals((search_start, search_end), busy[user_id])
+                for user_id in user_ids
+            ]
+        )
+        if not common:
+            return []
+
+        cur.execute(
+            "SELECT shows.id, shows.title, shows.category, venues.name, shows.edfringe_url, performances.id, performances.datetime_utc, shows.duration, group_interests.musts "
+            + "FROM shows INNER JOIN performances ON shows.id = performances.show_id "
+            + "INNER JOIN venues ON shows.venue_id = venues.id "
+            + "INNER JOIN (SELECT show_id, count(*) FILTER (WHERE interest = 'Must') AS musts FROM interests "
+            + "WHERE user_id = ANY(%(user_ids)s) AND interest IN ('Like', 'Must') "
+            + "GROUP BY show_id HAVING count(*) = %(group_size)s) group_interests ON group_interests.show_id = shows.id "
+            + "LEFT JOIN sold_out ON sold_out.performance_id = performances.id AND sold_out.edition = performances.edition "
+            + "WHERE sold_out.id IS NULL AND performances.edition = current_edition() "
+            + "AND performances.datetime_utc >= %(start)s AND performances.datetime_utc < %(end)s "
+            + "ORDER BY performances.datetime_utc ASC, shows.title ASC",
+            {
+                "user_ids": list(user_ids),
+                "group_size": len(user_ids),
+                "start": common[0][0],
+                "end": common[-1][1],
+            },
+        )
+        rows = cur.fetchall()
+
+    common_starts = [start for start, _ in common]
+    london = pytz.timezone("Europe/London")
+    return [
+        GroupPerformance(
+            show_id=show_id,
+            title=title,
+            category=category,
+            venue_name=venue_name,
+            edfringe_url=edfringe_url,
+            performance_id=performance_id,
+            start_edinburgh=datetime_utc.astimezone(london),
+            duration=duration,
+            musts=musts,
+        )
+        for (
+            show_id,
+            title,
+            category,
+            venue_name,
+            edfringe_url,
+            performance_id,
+            datetime_utc,
+            duration,
+            musts,
+        ) in rows
+        if fits(common, common_starts, datetime_utc, datetime_utc + duration)
+    ]
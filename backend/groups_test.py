@@ -0,0 +1,98 @@
+import datetime
+import unittest
+
+from groups import (
+    common_free_intervals,
+    fits,
+    free_intervals,
+    is_connected,
+    merge_intervals,
+)
+
+
+def at(hour, minute=0):
+    return datetime.datetime(2019, 8, 10, hour, minute)
+
+
+class TestMergeIntervals(unittest.TestCase):
+    def test_overlapping(self):
+        self.assertEqual(
+            [(at(10), at(13))], merge_intervals([(at(11), at(13)), (at(10), at(12))])
+        )
+
+    def test_touching(self):
+        self.assertEqual(
+            [(at(10), at(13))], merge_intervals([(at(10), at(12)), (at(12), at(13))])
+        )
+
+    def test_contained(self):
+        self.assertEqual(
+            [(at(10), at(14))], merge_intervals([(at(10), at(14)), (at(11), at(12))])
+        )
+
+    def test_disjoint(self):
+        self.assertEqual(
+            [(at(10), at(11)), (at(12), at(13))],
+            merge_intervals([(at(12), at(13)), (at(10), at(11))]),
+        )
+
+
+class TestFreeIntervals(unittest.TestCase):
+    def test_nothing_booked(self):
+        self.assertEqual([(at(10), at(22))], free_intervals((at(10), at(22)), []))
+
+    def test_bookings(self):
+        self.assertEqual(
+            [(at(11), at(14)), (at(15), at(22))],
+            free_intervals(
+                (at(10), at(22)),
+                [(at(14), at(15)), (at(9), at(11)), (at(14, 30), at(15))],
+            ),
+        )
+
+    def test_booked_all_day(self):
+        self.assertEqual([], free_intervals((at(10), at(22)), [(at(9), at(23))]))
+
+
+class TestCommonFreeIntervals(unittest.TestCase):
+    def test_intersection(self):
+        self.assertEqual(
+            [(at(11), at(12)), (at(15), at(16))],
+            common_free_intervals(
+                [
+                    [(at(10), at(12)), (at(14), at(18))],
+                    [(at(11), at(16))],
+                    [(at(9), at(13)), (at(15), at(20))],
+                ]
+            ),
+        )
+
+    def test_touching_is_not_common(self):
+        self.assertEqual(
+            [],
+            common_free_intervals([[(at(10), at(12))], [(at(12), at(14))]]),
+        )
+
+    def test_fits(self):
+        common = [(at(11), at(12)), (at(15), at(17))]
+        starts = [start for start, _ in common]
+        self.assertTrue(fits(common, starts, at(15), at(16)))
+        self.assertTrue(fits(common, starts, at(11), at(12)))
+        self.assertFalse(fits(common, starts, at(11, 30), at(12, 30)))
+        self.assertFalse(fits(common, starts, at(10), at(11)))
+        self.assertFalse(fits(common, starts, at(13), at(14)))
+
+
+class TestIsConnected(unittest.TestCase):
+    def test_chain(self):
+        self.assertTrue(is_connected({1, 2, 3}, [(1, 2), (3, 2)]))
+
+    def test_disconnected(self):
+        self.assertFalse(is_connected({1, 2, 3}, [(1, 2), (3, 4)]))
+
+    def test_single_user(self):
+        self.assertTrue(is_connected({1}, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+import datetime
+import threading
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import List, Optional
+
+import pytz
+
+from db import cursor
+from events import DAY_QUERY, Event, Filter, day_from_rows, filter_events
+
+FEED_INTERESTS = ("Booked", "Must")
+
+
+@dataclass(frozen=True)
+class FeedVersion:
+    # Everything which can change a user's feed, as of one lookup.
+    user_id: int
+    start_datetime_utc: datetime.datetime
+    end_datetime_utc: datetime.datetime
+    interests_changed_at: datetime.datetime
+    catalog_version: int
+    catalog_changed_at: datetime.datetime
+
+    @property
+    def etag(self):
+        return "{}-{}-{}".format(
+            self.user_id,
+            int(self.interests_changed_at.timestamp() * 1000000),
+            self.catalog_version,
+        )
+
+    @property
+    def last_modified(self):
+        return max(self.interests_changed_at, self.catalog_changed_at)
+
+    def dates(self):
+        london = pytz.timezone("Europe/London")
+        date = self.start_datetime_utc.astimezone(london).date()
+        end_date = self.end_datetime_utc.astimezone(london).date()
+        while date < end_date:
+            yield date
+            date += datetime.timedelta(days=1)
+
+
+def load_feed_version(config, calendar_token) -> Optional[FeedVersion]:
+    with cursor(config) as cur:
+        cur.execute(
+            "SELECT users.id, users.start_datetime_utc, users.end_datetime_utc, users.interests_changed_at, catalog_version.version, catalog_version.changed_at "
+            + "FROM users CROSS JOIN catalog_version WHERE users.calendar_token = %s",
+            (calendar_token,),
+        )
+        row = cur.fetchone()
+    return None if row is None else FeedVersion(*row)
+
+
+def load_feed_events(config, version: FeedVersion) -> List[Event]:
+    # The same events the day pages show, for every day of the visit, keeping
+    # only the performances the user has booked or picked.
+    with cursor(config) as cur:
+        cur.execute(
+            DAY_QUERY.format(user_id="%(user_id)s", start="%(start)s", end="%(end)s"),
+            {
+                "user_id": version.user_id,
+                "start": version.start_datetime_utc,
+                "end": version.end_datetime_utc,
+            },
+        )
+        rows = cur.fetchall()
+    events = {}
+    for date in version.dates():
+        day = day_from_rows(rows, version.user_id, date, defaultdict(set))
+        for event in filter_events(day, Filter.show_all()):
+            if event.performance_interest in FEED_INTERESTS:
+                events.setdefault(event.performance_id, event)
+    return sorted(events.values(), key=lambda event: event.start_edinburgh)
+
+
+class CalendarFeedCache:
+    # Keeps each user's latest feed, and the rendered entry for each event,
+    # so that a changed feed only renders the events which changed.
+
+    def __init__(self, uid_domain, maxsize=1000, max_events=100000):
+        self.uid_domain = uid_domain
+        self.maxsize = maxsize
+        self.max_events = max_events
+        self._feeds = OrderedDict()
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version: FeedVersion, load) -> str:
+        with self._lock:
+            feed = self._feeds.get(version.user_id)
+            if feed is not None and feed[0] == version.etag:
+                self._feeds.move_to_end(version.user_id)
+                return feed[1]
+        body = self._render(version, load())
+        with self._lock:
+            self._feeds[version.user_id] = (version.etag, body)
+            self._feeds.move_to_end(version.user_id)
+            if len(self._feeds) > self.maxsize:
+                self._feeds.popitem(last=False)
+        return body
+
+    def _render(self, version, events):
+        stamp = "DTSTAMP:{}\r\n".format(format_datetime(version.last_modified))
+        lines = [
+            "BEGIN:VCALENDAR\r\n",
+            "VERSION:2.0\r\n",
+            "PRODID:-//edfringeplanner//Fringe plan//EN\r\n",
+            "CALSCALE:GREGORIAN\r\n",
+            "X-WR-CALNAME:Edinburgh Fringe plan\r\n",
+        ]
+        for event in events:
+            lines.append("BEGIN:VEVENT\r\n")
+            lines.append(stamp)
+            lines.append(self._render_event(event))
+            lines.append("END:VEVENT\r\n")
+        lines.append("END:VCALENDAR\r\n")
+        return "".join(lines)
+
+    def _render_event(self, event):
+        with self._lock:
+            rendered = self._events.get(event)
+            if rendered is not None:
+                self._events.move_to_end(event)
+                return rendered
+        rendered = render_event(event, self.uid_domain)
+        with self._lock:
+            self._events[event] = rendered
+            if len(self._events) > self.max_events:
+                self._events.popitem(last=False)
+        return rendered
+
+
+def render_event(event: Event, uid_domain) -> str:
+    # Everything in a VEVENT except its DTSTAMP, which is per-feed.
+    booked = event.performance_interest == "Booked"
+    properties = (
+        (
+            "UID",
+            "performance-{}-user-{}@{}".format(
+                event.performance_id, event.user_id, uid_domain
+            ),
+        ),
+        ("DTSTART", format_datetime(event.start_edinburgh)),
+        ("DTEND", format_datetime(event.start_edinburgh + event.duration)),
+        ("SUMMARY", escape_text(event.title)),
+        ("LOCATION", escape_text(event.venue.name)),
+        (
+            "DESCRIPTION",
+            escape_text(
+                "{} - {}".format("Booked" if booked else "Must see", event.category)
+            ),
+        ),
+        ("URL", "https://tickets.edfringe.com{}".format(event.edfringe_url)),
+        ("STATUS", "CONFIRMED" if booked else "TENTATIVE"),
+    )
+    return "".join(fold_line("{}:{}".format(name, value)) for name, value in properties)
+
+
+def format_datetime(value: datetime.datetime) -> str:
+    return value.astimezone(pytz.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def escape_text(text: str) -> str:
+    return (
+        text.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def fold_line(line: str) -> str:
+    # Lines longer than 75 octets are continued on lines starting with a
+    # space, without splitting any UTF-8 sequence.
+    folded = []
+    current = []
+    length = 0
+    for character in line:
+        size = len(character.encode("utf-8"))
+        if length + size > 75:
+            folded.append("".join(current))
+            current = [" "]
+            length = 1
+        current.append(character)
+        length += size
+    folded.append("".join(current))
+    return "\r\n".join(folded) + "\r\n"
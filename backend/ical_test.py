@@ -0,0 +1,152 @@
+import datetime
+import unittest
+
+import events
+import ical
+from db import cursor
+from synthetic import FESTIVAL_START, make_events, seed_database
+from testdb import config_for_tests, reset_database
+
+
+class TestRendering(unittest.TestCase):
+    def test_escape_text(self):
+        self.assertEqual(
+            "Fish\\, chips\\; peas \\\\ gravy\\nand more",
+            ical.escape_text("Fish, chips; peas \\ gravy\nand more"),
+        )
+
+    def test_fold_line(self):
+        line = "SUMMARY:" + "Ceòl agus òrain " * 20
+        folded = ical.fold_line(line)
+        physical_lines = folded.split("\r\n")
+        self.assertEqual("", physical_lines.pop())
+        for physical_line in physical_lines:
+            self.assertLessEqual(len(physical_line.encode("utf-8")), 75)
+        for physical_line in physical_lines[1:]:
+            self.assertTrue(physical_line.startswith(" "))
+        self.assertEqual(line, folded.replace("\r\n ", "").rstrip("\r\n"))
+
+    def test_short_line_is_not_folded(self):
+        self.assertEqual("STATUS:CONFIRMED\r\n", ical.fold_line("STATUS:CONFIRMED"))
+
+    def test_render_event(self):
+        event = make_events(datetime.date(2019, 8, 10), 1)[0]
+        rendered = ical.render_event(event, "example.com")
+        self.assertIn(
+            "UID:performance-{}-user-1@example.com\r\n".format(event.performance_id),
+            rendered,
+        )
+        self.assertIn(
+            "DTSTART:{}\r\n".format(ical.format_datetime(event.start_edinburgh)),
+            rendered,
+        )
+        self.assertTrue(rendered.endswith("\r\n"))
+
+
+class TestFeed(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.config = config_for_tests()
+        reset_database(cls.config)
+        with cursor(cls.config) as cur:
+            cls.user_ids = seed_database(cur, venues=5, shows=50, users=2)
+
+    def setUp(self):
+        self.token = "synthetic-calendar-0"
+        self.user_id = self.user_ids[0]
+
+    def test_unknown_token(self):
+        self.assertIsNone(ical.load_feed_version(self.config, "not-a-token"))
+
+    def test_feed_has_booked_and_must_performances(self):
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT performances.id FROM performances "
+                + "INNER JOIN interests ON interests.show_id = performances.show_id "
+                + "INNER JOIN users ON users.id = interests.user_id "
+                + "WHERE users.id = %s AND performances.datetime_utc > users.start_datetime_utc "
+                + "AND performances.datetime_utc < users.end_datetime_utc LIMIT 1",
+                (self.user_id,),
+            )
+            performance_id = cur.fetchone()[0]
+        events.mark_booked(self.config, self.user_id, performance_id)
+
+        version = ical.load_feed_version(self.config, self.token)
+        feed_events = ical.load_feed_events(self.config, version)
+        self.assertIn(performance_id, {event.performance_id for event in feed_events})
+        for event in feed_events:
+            self.assertIn(event.performance_interest, ("Booked", "Must"))
+
+        feed = ical.CalendarFeedCache("example.com").get(version, lambda: feed_events)
+        self.assertTrue(feed.startswith("BEGIN:VCALENDAR\r\n"))
+        self.assertTrue(feed.endswith("END:VCALENDAR\r\n"))
+        self.assertEqual(len(feed_events), feed.count("BEGIN:VEVENT\r\n"))
+
+    def test_interest_change_changes_version(self):
+        before = ical.load_feed_version(self.config, self.token)
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT show_id FROM interests WHERE user_id = %s LIMIT 1",
+                (self.user_id,),
+            )
+            show_id = cur.fetchone()[0]
+        events.set_interest(self.config, self.user_id, show_id, "Must")
+        after = ical.load_feed_version(self.config, self.token)
+        self.assertNotEqual(before.etag, after.etag)
+        self.assertGreater(after.last_modified, before.last_modified)
+
+        # Other users' feeds are unaffected.
+        other = "synthetic-calendar-1"
+        other_before = ical.load_feed_version(self.config, other)
+        events.set_interest(self.config, self.user_id, show_id, "Like")
+        self.assertEqual(
+            other_before.etag, ical.load_feed_version(self.config, other).etag
+        )
+
+    def test_sold_out_change_changes_version(self):
+        before = ical.load_feed_version(self.config, self.token)
+        with cursor(self.config) as cur:
+            cur.execute("DELETE FROM sold_out")
+        after = ical.load_feed_version(self.config, self.token)
+        self.assertNotEqual(before.etag, after.etag)
+
+
+class TestCalendarFeedCache(unittest.TestCase):
+    def version(self, etag_time):
+        return ical.FeedVersion(
+            user_id=1,
+            start_datetime_utc=datetime.datetime(2019, 8, 10, 4),
+            end_datetime_utc=datetime.datetime(2019, 8, 12, 4),
+            interests_changed_at=etag_time,
+            catalog_version=0,
+            catalog_changed_at=etag_time,
+        )
+
+    def test_only_changed_feeds_are_loaded_and_rendered(self):
+        cache = ical.CalendarFeedCache("example.com")
+        feed_events = make_events(FESTIVAL_START, 20)
+        loads = []
+
+        def load():
+            loads.append(1)
+            return feed_events
+
+        first = self.version(
+            datetime.datetime(2019, 8, 1, tzinfo=datetime.timezone.utc)
+        )
+        feed = cache.get(first, load)
+        self.assertIs(feed, cache.get(first, load))
+        self.assertEqual(1, len(loads))
+        self.assertEqual(20, len(cache._events))
+
+        second = self.version(
+            datetime.datetime(2019, 8, 2, tzinfo=datetime.timezone.utc)
+        )
+        feed_events = feed_events[:10] + make_events(FESTIVAL_START, 1, seed=1)
+        cache.get(second, load)
+        self.assertEqual(2, len(loads))
+        self.assertEqual(21, len(cache._events))
+
+
+if __name__ == "__main__":
+    unittest.main()
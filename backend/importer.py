@@ -1,16 +1,43 @@
 import csv
 import datetime
+import functools
+import hashlib
+import io
 import sys
+import tempfile
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 import psycopg2
 import pytz
 import requests
+from psycopg2.extras import execute_values
 
+import catalog
 from config import Config
 from db import cursor
+from editions import current_edition
+from query_budget import query_budget, unbudgeted
 
 from fetcher import fetch_multitime, check_soldout_for_single_time
 
+# Exports are tens of kilobytes per show listed; anything bigger than this
+# isn't one.
+MAX_EXPORT_BYTES = 16 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# Downloaded exports are kept in memory up to this size, and on disk beyond.
+DOWNLOAD_SPOOL_BYTES = 1024 * 1024
+DOWNLOAD_ATTEMPTS = 3
+DOWNLOAD_RETRY_BASE_SECONDS = 0.5
+# Seconds to connect, and to wait for each chunk.
+DOWNLOAD_TIMEOUT = (3.05, 30)
+# Changed shows are written this many at a time as an export is read.
+IMPORT_BATCH_SIZE = 500
+
+
+class ExportTooLarge(ValueError):
+    pass
+
 
 def parse_time(human):
     parts = human.split()
@@ -38,40 +65,43 @@ def parse_time(human):
     return str(delta)
 
 
-def lookup_venue_id(cur: psycopg2.extensions.cursor, name):
-    cur.execute("SELECT id FROM venues WHERE name = %s", (name,))
-    rows = cur.fetchmany(2)
-    if len(rows) > 1:
-        raise ValueError("Found more than 1 venue with name {}".format(name))
-    elif len(rows) == 0:
-        raise ValueError("Didn't find venue with name {}".format(name))
-    else:
-        return rows[0][0]
+def lookup_venue_ids(cur: psycopg2.extensions.cursor, names) -> Dict[str, int]:
+    # Venue names are unique, so names which aren't found are simply missing
+    # from the result.
+    cur.execute("SELECT name, id FROM venues WHERE name = ANY(%s)", (sorted(names),))
+    return dict(cur.fetchall())
 
 
-def import_from_iter(cur, user_id, it):
-    cur.execute(
-        "SELECT id, show_id FROM interests WHERE user_id = %s AND interest != 'Booked'",
-        (user_id,),
-    )
-    rows = cur.fetchall()
-    existing_interests = {row[1]: row[0] for row in rows}
+WANT_HEADINGS = (
+    "Title",
+    "Category",
+    "Venue",
+    "Duration",
+    "Times",
+    "Dates",
+    "Book Tickets",
+    "Group Name",
+)
+
+
+class ImportRow(NamedTuple):
+    title: str
+    category: str
+    venue_name: str
+    duration: str
+    times: List[str]
+    dates: List[str]
+    edfringe_url: str
 
+
+def iter_rows(it) -> Iterator[ImportRow]:
+    # Everything about an export which doesn't need the database, a row at a
+    # time as lines arrive.
     reader = csv.reader(it, delimiter="\t")
-    headings = tuple(next(reader))
-    want_headings = (
-        "Title",
-        "Category",
-        "Venue",
-        "Duration",
-        "Times",
-        "Dates",
-        "Book Tickets",
-        "Group Name",
-    )
-    if headings != want_headings:
+    headings = tuple(next(reader, ()))
+    if headings != WANT_HEADINGS:
         raise ValueError(
-            "Wrong CSV headings; got {}, want {}".format(headings, want_headings)
+            "Wrong CSV headings; got {}, want {}".format(headings, WANT_HEADINGS)
         )
 
     for row in reader:
@@ -85,85 +115,389 @@ def import_from_iter(cur, user_id, it):
             edfringe_url,
             _group_name,
         ) = row
-        venue_id = lookup_venue_id(cur, venue_name)
+        yield ImportRow(
+            title=title,
+            category=category,
+            venue_name=venue_name,
+            duration=parse_time(duration),
+            times=times_str.split(", "),
+            dates=dates_str.split(", "),
+            edfringe_url=edfringe_url,
+        )
 
-        times = times_str.split(", ")
-        dates = dates_str.split(", ")
 
-        cur.execute("SELECT id FROM shows WHERE edfringe_url = %s", (edfringe_url,))
-        show_already_exists = cur.rowcount > 0
+def parse_rows(it) -> List[ImportRow]:
+    # All of an export's rows, so that files can be checked (and parsed in
+    # other processes) before anything is written.
+    return list(iter_rows(it))
 
-        # Trust existing data, as updates are more likely to be bogus than existing imported data.
-        cur.execute(
-            "INSERT INTO shows (edfringe_url, title, category, venue_id, duration) "
-            + "VALUES (%(edfringe_url)s, %(title)s, %(category)s, %(venue_id)s, %(duration)s) "
-            + "ON CONFLICT ON CONSTRAINT shows_edfringe_url_key DO UPDATE SET edfringe_url = EXCLUDED.edfringe_url "
-            + "RETURNING id",
-            dict(
-                edfringe_url=edfringe_url,
-                category=category,
-                title=title,
-                venue_id=venue_id,
-                duration=parse_time(duration),
-            ),
+
+@query_budget(statements=5)
+def write_shows(
+    cur, rows: Iterable[ImportRow], venue_ids: Optional[Dict[str, int]] = None
+) -> Dict[str, int]:
+    # Makes sure each row's show exists, along with its performances if it's
+    # new, and returns the show ids by edfringe URL. venue_ids saves looking up
+    # venues which the caller already has.
+    unique_rows = {}
+    for row in rows:
+        unique_rows.setdefault(row.edfringe_url, row)
+    rows = list(unique_rows.values())
+    if not rows:
+        return {}
+    if venue_ids is None:
+        venue_ids = lookup_venue_ids(cur, {row.venue_name for row in rows})
+    for row in rows:
+        if row.venue_name not in venue_ids:
+            raise ValueError("Didn't find venue with name {}".format(row.venue_name))
+
+    cur.execute(
+        "SELECT edfringe_url, id FROM shows WHERE edfringe_url = ANY(%s)",
+        ([row.edfringe_url for row in rows],),
+    )
+    show_ids = dict(cur.fetchall())
+
+    # Trust existing data, as updates are more likely to be bogus than existing imported data.
+    new_rows = [row for row in rows if row.edfringe_url not in show_ids]
+    if new_rows:
+        show_ids.update(
+            execute_values(
+                cur,
+                "INSERT INTO shows (edfringe_url, title, category, venue_id, duration) VALUES %s "
+                + "ON CONFLICT ON CONSTRAINT shows_edfringe_url_key DO UPDATE SET edfringe_url = EXCLUDED.edfringe_url "
+                + "RETURNING edfringe_url, id",
+                [
+                    (
+                        row.edfringe_url,
+                        row.title,
+                        row.category,
+                        venue_ids[row.venue_name],
+                        row.duration,
+                    )
+                    for row in new_rows
+                ],
+                page_size=len(new_rows),
+                fetch=True,
+            )
         )
-        show_id = cur.fetchone()[0]
+        write_performances(cur, [(show_ids[row.edfringe_url], row) for row in new_rows])
+    return show_ids
 
+
+def write_performances(cur, new_shows: List[Tuple[int, ImportRow]]):
+    # Shows with one time a day list their dates in the export. Other shows'
+    # performances, and whether any are sold out, are looked up on edfringe.
+    # Exports are of the current edition, and give dates without a year.
+    edition = current_edition(cur)
+    performances = []
+    for show_id, row in new_shows:
+        if len(row.times) == 1:
+            for date in row.dates:
+                local_datetime = datetime.datetime.strptime(
+                    "{} {} {}".format(edition.year, date, row.times[0]),
+                    "%Y %d %b %H:%M",
+                )
+                local_datetime = pytz.timezone("Europe/London").localize(local_datetime)
+                performances.append(
+                    (show_id, local_datetime.astimezone(pytz.utc), edition.year)
+                )
+    if performances:
+        execute_values(
+            cur,
+            "INSERT INTO performances (show_id, datetime_utc, edition) VALUES %s "
+            + "ON CONFLICT ON CONSTRAINT performances_show_id_datetime_utc_key DO NOTHING",
+            performances,
+            page_size=len(performances),
+        )
+
+    # These take far longer than any queries they make.
+    with unbudgeted():
+        for show_id, row in new_shows:
+            if len(row.times) == 1:
+                check_soldout_for_single_time(cur, show_id, edition)
+            elif row.dates:
+                some_date = datetime.datetime.strptime(
+                    "{} {}".format(edition.year, row.dates[0]), "%Y %d %b"
+                ).date()
+                fetch_multitime(cur, show_id, edition, some_date)
+
+
+@query_budget(statements=3)
+def write_interests(cur, user_id, show_ids: Iterable[int]):
+    # Marks the user as liking each show, unless they already have a stronger
+    # interest in it, and drops their interest in shows no longer listed
+    # (except for ones they've booked).
+    show_ids = list(show_ids)
+    cur.execute(
+        "SELECT id, show_id FROM interests WHERE user_id = %s AND interest != 'Booked'",
+        (user_id,),
+    )
+    rows = cur.fetchall()
+    listed = set(show_ids)
+    stale_interest_ids = [row[0] for row in rows if row[1] not in listed]
+
+    if show_ids:
         cur.execute(
-            "INSERT INTO interests (show_id, user_id, interest) VALUES (%s, %s, %s) "
+            "INSERT INTO interests (show_id, user_id, interest) "
+            + "SELECT show_id, %s, 'Like' FROM unnest(%s) AS show_id "
             + "ON CONFLICT ON CONSTRAINT interests_show_id_user_id_key DO NOTHING",
-            (show_id, user_id, "Like"),
+            (user_id, show_ids),
         )
 
-        existing_interests.pop(show_id, None)
+    if stale_interest_ids:
+        cur.execute(
+            "DELETE FROM interests WHERE id = ANY(%s) AND user_id = %s",
+            (stale_interest_ids, user_id),
+        )
 
-        if not show_already_exists:
-            if len(times) == 1:
-                for date in dates:
-                    local_datetime = datetime.datetime.strptime(
-                        "2019 {} {}".format(date, times[0]), "%Y %d %b %H:%M"
-                    )
-                    local_datetime = pytz.timezone("Europe/London").localize(
-                        local_datetime
-                    )
-                    local_datetime = local_datetime.astimezone(pytz.utc)
 
-                    cur.execute(
-                        "INSERT INTO performances (show_id, datetime_utc) VALUES (%s, %s) "
-                        + "ON CONFLICT ON CONSTRAINT performances_show_id_datetime_utc_key DO NOTHING",
-                        (show_id, local_datetime),
-                    )
-                check_soldout_for_single_time(cur, show_id)
-            else:
-                if dates:
-                    some_date = "{:02d}-08-2019".format(int(dates[0].split(" ")[0]))
-                    fetch_multitime(cur, show_id, some_date)
+def row_fingerprint(row: ImportRow) -> str:
+    return hashlib.sha1(
+        "\x1f".join(
+            (
+                row.title,
+                row.category,
+                row.venue_name,
+                row.duration,
+                ", ".join(row.times),
+                ", ".join(row.dates),
+                row.edfringe_url,
+            )
+        ).encode("utf-8")
+    ).hexdigest()
 
-    for interest_id in existing_interests.values():
-        cur.execute(
-            "DELETE FROM interests WHERE id = %s AND user_id = %s",
-            (interest_id, user_id),
+
+@query_budget(statements=10)
+def import_rows(
+    cur,
+    user_id,
+    rows: Iterable[ImportRow],
+    show_ids: Optional[Dict[str, int]] = None,
+    batch_size=IMPORT_BATCH_SIZE,
+):
+    # Compares the rows with the user's last import, and only writes the shows
+    # and interests which were added, changed or removed since, so importing
+    # an unchanged file is a single query. show_ids saves writing shows which
+    # the caller already has.
+    #
+    # Rows may be a stream of them: changed shows are written batch_size at a
+    # time as they arrive, and only each row's URL, fingerprint and show id is
+    # kept after that. An export of up to batch_size rows stays within budget.
+    cur.execute(
+        "SELECT edfringe_url, fingerprint, show_id FROM import_fingerprints WHERE user_id = %s",
+        (user_id,),
+    )
+    previous = {url: (fingerprint, show_id) for url, fingerprint, show_id in cur}
+
+    # Every row's fingerprint, and the show ids of those which changed, by
+    # URL. With no previous fingerprints, either this is the user's first
+    # import, or their first since fingerprints were kept, so their interests
+    # may not match any earlier file and every row counts as changed.
+    fingerprints = {}
+    changed_show_ids = {}
+
+    def write_batch(batch):
+        batch_show_ids = show_ids if show_ids is not None else write_shows(cur, batch)
+        for row in batch:
+            changed_show_ids[row.edfringe_url] = batch_show_ids[row.edfringe_url]
+
+    batch = []
+    for row in rows:
+        if row.edfringe_url in fingerprints:
+            continue
+        fingerprint = row_fingerprint(row)
+        fingerprints[row.edfringe_url] = fingerprint
+        if previous.get(row.edfringe_url, (None,))[0] != fingerprint:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                write_batch(batch)
+                batch = []
+    if batch:
+        write_batch(batch)
+
+    removed_urls = [url for url in previous if url not in fingerprints]
+    if not changed_show_ids and not removed_urls:
+        return
+
+    if not previous:
+        write_interests(cur, user_id, changed_show_ids.values())
+    else:
+        if changed_show_ids:
+            cur.execute(
+                "INSERT INTO interests (show_id, user_id, interest) "
+                + "SELECT show_id, %s, 'Like' FROM unnest(%s) AS show_id "
+                + "ON CONFLICT ON CONSTRAINT interests_show_id_user_id_key DO NOTHING",
+                (user_id, list(changed_show_ids.values())),
+            )
+        if removed_urls:
+            cur.execute(
+                "DELETE FROM interests WHERE user_id = %s AND show_id = ANY(%s) AND interest != 'Booked'",
+                (user_id, [previous[url][1] for url in removed_urls]),
+            )
+            cur.execute(
+                "DELETE FROM import_fingerprints WHERE user_id = %s AND edfringe_url = ANY(%s)",
+                (user_id, removed_urls),
+            )
+
+    if changed_show_ids:
+        execute_values(
+            cur,
+            "INSERT INTO import_fingerprints (user_id, edfringe_url, show_id, fingerprint) VALUES %s "
+            + "ON CONFLICT (user_id, edfringe_url) DO UPDATE "
+            + "SET show_id = EXCLUDED.show_id, fingerprint = EXCLUDED.fingerprint",
+            [
+                (user_id, url, show_id, fingerprints[url])
+                for url, show_id in changed_show_ids.items()
+            ],
+            page_size=len(changed_show_ids),
         )
 
 
-def import_from_url(cur, user_id, url):
-    req = requests.get(url)
-    req.encoding = "utf_16"
-    it = req.iter_lines(decode_unicode=True)
-    return import_from_iter(cur, user_id, it)
+@query_budget(statements=10)
+def import_from_iter(cur, user_id, it):
+    return import_rows(cur, user_id, iter_rows(it))
 
 
-def import_from_url_from_config(config, user_id, url):
-    with cursor(config) as cur:
-        return import_from_url(cur, user_id, url)
+def download(
+    url,
+    session: Optional[requests.Session] = None,
+    max_bytes=MAX_EXPORT_BYTES,
+    attempts=DOWNLOAD_ATTEMPTS,
+) -> Iterator[bytes]:
+    # The body of url, a chunk at a time as it arrives. Connection failures
+    # and server errors are retried, picking up where the last attempt left
+    # off, and bodies longer than max_bytes raise ExportTooLarge rather than
+    # being read to the end.
+    session = session or requests.Session()
+    received = 0
+    attempt = 1
+    while True:
+        headers = {"Range": "bytes={}-".format(received)} if received else {}
+        try:
+            with session.get(
+                url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+            ) as response:
+                response.raise_for_status()
+                # Servers which ignore the range send everything again.
+                skip = 0 if response.status_code == 206 else received
+                length = response.headers.get("Content-Length")
+                if length is not None and received - skip + int(length) > max_bytes:
+                    raise ExportTooLarge(
+                        "Export is {} bytes, over the limit of {}".format(
+                            received - skip + int(length), max_bytes
+                        )
+                    )
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                    if skip:
+                        skipped = min(skip, len(chunk))
+                        chunk = chunk[skipped:]
+                        skip -= skipped
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise ExportTooLarge(
+                            "Export is over the limit of {} bytes".format(max_bytes)
+                        )
+                    if chunk:
+                        yield chunk
+                return
+        except requests.RequestException as e:
+            response = getattr(e, "response", None)
+            if response is not None and response.status_code < 500:
+                raise
+            if attempt >= attempts:
+                raise
+        time.sleep(DOWNLOAD_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+        attempt += 1
 
 
-def main(cur, user_id, path_or_url):
+class _ChunkReader(io.RawIOBase):
+    # A file over an iterator of byte strings, to decode as it's read.
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def decode_lines(chunks: Iterable[bytes], encoding="utf_16") -> Iterator[str]:
+    # Lines of text from chunks of bytes, which may split characters and line
+    # endings anywhere.
+    return io.TextIOWrapper(
+        io.BufferedReader(_ChunkReader(chunks)), encoding=encoding, newline=""
+    )
+
+
+def stream_url(url) -> Iterator[ImportRow]:
+    return iter_rows(decode_lines(download(url)))
+
+
+def download_to_file(url, session: Optional[requests.Session] = None):
+    # The whole body of url, in a file positioned at its start. Imports
+    # download the export first, so that a slow download doesn't hold a
+    # connection and transaction open.
+    export = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_BYTES)
+    try:
+        for chunk in download(url, session):
+            export.write(chunk)
+    except BaseException:
+        export.close()
+        raise
+    export.seek(0)
+    return export
+
+
+def iter_file_rows(export) -> Iterator[ImportRow]:
+    return iter_rows(
+        decode_lines(iter(functools.partial(export.read, DOWNLOAD_CHUNK_BYTES), b""))
+    )
+
+
+def parse_url(url) -> List[ImportRow]:
+    return list(stream_url(url))
+
+
+def parse_source(path_or_url) -> List[ImportRow]:
     if path_or_url.startswith("http"):
-        return import_from_url(cur, user_id, path_or_url)
+        return parse_url(path_or_url)
     else:
         with open(path_or_url, encoding="utf_16") as it:
-            return import_from_iter(cur, user_id, it)
+            return parse_rows(it)
+
+
+@query_budget(statements=10)
+def import_from_url(cur, user_id, url):
+    with download_to_file(url) as export:
+        return import_rows(cur, user_id, iter_file_rows(export))
+
+
+@query_budget(statements=10)
+def import_from_url_from_config(config, user_id, url):
+    with download_to_file(url) as export:
+        with cursor(config) as cur:
+            result = import_rows(cur, user_id, iter_file_rows(export))
+    # Rebuilding the catalog snapshot reads the whole catalog, for every
+    # worker's benefit rather than this import's.
+    with unbudgeted():
+        catalog.refresh_snapshot(config)
+    return result
+
+
+@query_budget(statements=10)
+def main(cur, user_id, path_or_url):
+    return import_rows(cur, user_id, parse_source(path_or_url))
 
 
 if __name__ == "__main__":
@@ -179,3 +513,4 @@ if __name__ == "__main__":
             print("Email address not found", file=sys.stderr)
         user_id = row[0]
         main(cur, user_id, path_or_url)
+    catalog.refresh_snapshot(config)
@@ -1,6 +1,16 @@
+import contextlib
 import unittest
+from unittest import mock
 
-from importer import parse_time
+import requests
+
+import importer
+from db import cursor
+from importer import import_from_iter, parse_time
+from synthetic import seed_database
+from testdb import config_for_tests, recording_statements, reset_database
+
+HEADINGS = "Title\tCategory\tVenue\tDuration\tTimes\tDates\tBook Tickets\tGroup Name"
 
 
 class TestTimeParsing(unittest.TestCase):
@@ -25,5 +35,248 @@ class TestTimeParsing(unittest.TestCase):
             parse_time("1 day 2 hours 3 minutes")
 
 
+class FakeResponse:
+    def __init__(self, status_code=200, chunks=(), headers=None, fail_after=None):
+        self.status_code = status_code
+        self.chunks = list(chunks)
+        self.headers = headers or {}
+        self.fail_after = fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code), response=self)
+
+    def iter_content(self, chunk_size):
+        for index, chunk in enumerate(self.chunks):
+            if index == self.fail_after:
+                raise requests.exceptions.ChunkedEncodingError("Connection reset")
+            yield chunk
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers, stream, timeout):
+        self.requests.append(headers)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@mock.patch.object(importer, "DOWNLOAD_RETRY_BASE_SECONDS", 0)
+class TestDownload(unittest.TestCase):
+    def test_resumes_after_failure(self):
+        session = FakeSession(
+            requests.ConnectionError("Refused"),
+            FakeResponse(chunks=[b"ab", b"cd", b"ef"], fail_after=2),
+            FakeResponse(status_code=503),
+            FakeResponse(status_code=206, chunks=[b"ef"]),
+        )
+        self.assertEqual(
+            [b"ab", b"cd", b"ef"], list(importer.download("url", session, attempts=4))
+        )
+        self.assertEqual(
+            [{}, {}, {"Range": "bytes=4-"}, {"Range": "bytes=4-"}], session.requests
+        )
+
+    def test_resumes_when_range_is_ignored(self):
+        session = FakeSession(
+            FakeResponse(chunks=[b"abc", b"def"], fail_after=1),
+            FakeResponse(chunks=[b"ab", b"cdef"]),
+        )
+        self.assertEqual(b"abcdef", b"".join(importer.download("url", session)))
+
+    def test_gives_up(self):
+        session = FakeSession(*[FakeResponse(status_code=500)] * 3)
+        with self.assertRaises(requests.HTTPError):
+            list(importer.download("url", session))
+        self.assertEqual(3, len(session.requests))
+
+    def test_client_errors_are_not_retried(self):
+        session = FakeSession(FakeResponse(status_code=404))
+        with self.assertRaises(requests.HTTPError):
+            list(importer.download("url", session))
+
+    def test_too_large(self):
+        with self.assertRaises(importer.ExportTooLarge):
+            list(
+                importer.download(
+                    "url",
+                    FakeSession(FakeResponse(headers={"Content-Length": "11"})),
+                    max_bytes=10,
+                )
+            )
+        chunks = importer.download(
+            "url", FakeSession(FakeResponse(chunks=[b"x" * 6] * 100)), max_bytes=10
+        )
+        self.assertEqual(b"x" * 6, next(chunks))
+        with self.assertRaises(importer.ExportTooLarge):
+            next(chunks)
+
+    def test_downloads_before_connecting(self):
+        events = []
+
+        def download(url, session=None):
+            yield (HEADINGS + "\n").encode("utf_16")
+            yield show_row(0).encode("utf_16_le")
+            events.append("downloaded")
+
+        @contextlib.contextmanager
+        def connect(config):
+            events.append("connected")
+            yield mock.sentinel.cur
+
+        def import_rows(cur, user_id, rows):
+            events.append([row.title for row in rows])
+
+        with mock.patch.object(importer, "download", download), mock.patch.object(
+            importer, "cursor", connect
+        ), mock.patch.object(importer, "import_rows", import_rows), mock.patch.object(
+            importer.catalog, "refresh_snapshot"
+        ):
+            importer.import_from_url_from_config(mock.sentinel.config, 1, "url")
+        self.assertEqual(["downloaded", "connected", ["Synthetic show 0"]], events)
+
+
+class TestStreamingParse(unittest.TestCase):
+    def test_chunks_split_anywhere(self):
+        text = "\r\n".join(
+            [HEADINGS]
+            + [show_row(i).replace("Synthetic", "Caf\u00e9") for i in range(3)]
+        )
+        encoded = text.encode("utf_16")
+        for size in (1, 2, 3, 7):
+            with self.subTest(size=size):
+                chunks = [
+                    encoded[start : start + size]
+                    for start in range(0, len(encoded), size)
+                ]
+                rows = importer.iter_rows(importer.decode_lines(chunks))
+                self.assertEqual(
+                    ["Caf\u00e9 show {}".format(i) for i in range(3)],
+                    [row.title for row in rows],
+                )
+
+    def test_rows_are_parsed_as_they_arrive(self):
+        def chunks():
+            yield (HEADINGS + "\n" + show_row(0) + "\n").encode("utf_16")
+            raise AssertionError("Read past the first row")
+
+        rows = importer.iter_rows(importer.decode_lines(chunks()))
+        self.assertEqual("Synthetic show 0", next(rows).title)
+
+
+def show_row(i, times="12:00"):
+    return "Synthetic show {}\tComedy\tVenue 1\t1 hour\t{}\t10 Aug\t/whats-on/synthetic-{}\t".format(
+        i, times, i
+    )
+
+
+class TestReimport(unittest.TestCase):
+    def setUp(self):
+        self.config = config_for_tests()
+        reset_database(self.config)
+        with cursor(self.config) as cur:
+            self.user_id = seed_database(
+                cur,
+                venues=3,
+                shows=20,
+                users=1,
+                interests_per_user=0,
+                shares_per_user=0,
+            )[0]
+        patcher = mock.patch.object(importer, "check_soldout_for_single_time")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def import_rows(self, rows):
+        with recording_statements() as statements:
+            with cursor(self.config) as cur:
+                import_from_iter(cur, self.user_id, [HEADINGS] + rows)
+        return list(statements)
+
+    def interests(self):
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT shows.edfringe_url, interests.interest FROM interests "
+                + "INNER JOIN shows ON shows.id = interests.show_id "
+                + "WHERE interests.user_id = %s ORDER BY shows.edfringe_url",
+                (self.user_id,),
+            )
+            return cur.fetchall()
+
+    def test_unchanged_reimport_is_one_query(self):
+        rows = [show_row(i) for i in range(10)]
+        self.import_rows(rows)
+        self.assertEqual(1, len(self.import_rows(rows)))
+        self.assertEqual(10, len(self.interests()))
+
+    def test_reimport_writes_only_differences(self):
+        self.import_rows([show_row(i) for i in range(5)])
+        with cursor(self.config) as cur:
+            cur.execute(
+                "UPDATE interests SET interest = 'Booked' FROM shows "
+                + "WHERE shows.id = interests.show_id AND shows.edfringe_url = '/whats-on/synthetic-4'"
+            )
+
+        statements = self.import_rows(
+            [show_row(0), show_row(1, "13:00"), show_row(2), show_row(5)]
+        )
+
+        self.assertEqual(
+            [
+                ("/whats-on/synthetic-0", "Like"),
+                ("/whats-on/synthetic-1", "Like"),
+                ("/whats-on/synthetic-2", "Like"),
+                ("/whats-on/synthetic-4", "Booked"),
+                ("/whats-on/synthetic-5", "Like"),
+            ],
+            self.interests(),
+        )
+        show_lookups = [s for s in statements if "FROM shows" in s]
+        self.assertEqual(1, len(show_lookups))
+        self.assertIn("synthetic-1'", show_lookups[0])
+        self.assertIn("synthetic-5'", show_lookups[0])
+        self.assertNotIn("synthetic-0'", show_lookups[0])
+
+        # Removed rows stay removed, rather than being diffed against again.
+        statements = self.import_rows(
+            [show_row(0), show_row(1, "13:00"), show_row(2), show_row(5)]
+        )
+        self.assertEqual(1, len(statements))
+
+    def test_first_import_replaces_earlier_interests(self):
+        with cursor(self.config) as cur:
+            cur.execute(
+                "INSERT INTO interests (show_id, user_id, interest) "
+                + "SELECT id, %s, 'Like' FROM shows WHERE edfringe_url = '/whats-on/synthetic-9'",
+                (self.user_id,),
+            )
+        self.import_rows([show_row(0)])
+        self.assertEqual([("/whats-on/synthetic-0", "Like")], self.interests())
+
+    def test_writes_shows_in_batches(self):
+        rows = importer.iter_rows([HEADINGS] + [show_row(i) for i in range(5)])
+        with mock.patch.object(
+            importer, "write_shows", wraps=importer.write_shows
+        ) as write_shows:
+            with cursor(self.config) as cur:
+                importer.import_rows(cur, self.user_id, rows, batch_size=2)
+        self.assertEqual(
+            [2, 2, 1], [len(call.args[1]) for call in write_shows.call_args_list]
+        )
+        self.assertEqual(5, len(self.interests()))
+        self.assertEqual(1, len(self.import_rows([show_row(i) for i in range(5)])))
+
+
 if __name__ == "__main__":
     unittest.main()
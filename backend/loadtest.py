@@ -0,0 +1,307 @@
+import argparse
+import datetime
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import List, NamedTuple
+
+import pytz
+import requests
+from argon2 import PasswordHasher
+
+import db
+from synthetic import seed_database
+from testdb import config_for_tests, reset_database
+
+# Replays a mix of user sessions against a running instance, and reports
+# per-route latency and how many database connections the instance held.
+#
+# The instance and this tool share the test database (see testdb.py), which
+# --seed wipes and fills with synthetic users whose password is PASSWORD:
+#
+#   python loadtest.py --seed 200 --dry-run
+#   EDFRINGEPLANNER_DB_NAME=$EDFRINGEPLANNER_TEST_DB_NAME python server.py &
+#   python loadtest.py --url http://localhost:8000 --rate 100 --duration 60
+#
+# Imports aren't part of the mix, as /import fetches exports from edfringe.
+
+PASSWORD = "loadtest"
+
+# Relative weights of each kind of request in the mix.
+MIX = (
+    ("day", 40),
+    ("day_filtered", 20),
+    ("day_shared", 15),
+    ("interest", 20),
+    ("login", 5),
+)
+
+FILTER_TOGGLES = ("like", "love", "booked", "past", "Comedy", "Theatre", "Music")
+
+
+class Sample(NamedTuple):
+    route: str
+    seconds: float
+    ok: bool
+
+
+class LoadUser(NamedTuple):
+    email: str
+    dates: List[datetime.date]
+    # (show_id, performance_id) pairs for shows the user is interested in.
+    interests: List[tuple]
+
+
+def load_users(config, limit) -> List[LoadUser]:
+    london = pytz.timezone("Europe/London")
+    users = []
+    with db.cursor(config) as cur:
+        cur.execute(
+            "SELECT id, email, start_datetime_utc, end_datetime_utc FROM users "
+            + "WHERE confirm_email_token IS NULL ORDER BY id LIMIT %s",
+            (limit,),
+        )
+        rows = cur.fetchall()
+        for user_id, email, start, end in rows:
+            date = start.astimezone(london).date()
+            dates = []
+            while date < end.astimezone(london).date():
+                dates.append(date)
+                date += datetime.timedelta(days=1)
+            cur.execute(
+                "SELECT DISTINCT ON (interests.show_id) interests.show_id, performances.id "
+                + "FROM interests INNER JOIN performances ON performances.show_id = interests.show_id "
+                + "WHERE interests.user_id = %s ORDER BY interests.show_id, performances.datetime_utc",
+                (user_id,),
+            )
+            users.append(LoadUser(email, dates, cur.fetchall()))
+    return users
+
+
+class Session:
+    # One simulated person, logged in with a session of their own.
+
+    def __init__(self, base_url, user: LoadUser, rng: random.Random):
+        self.base_url = base_url
+        self.user = user
+        self.rng = rng
+        self.http = requests.Session()
+        self.date = rng.choice(user.dates)
+
+    def run(self, action):
+        return getattr(self, action)()
+
+    def login(self):
+        self.http.cookies.clear()
+        response = self.http.post(
+            self.base_url + "/login",
+            data={"email": self.user.email, "password": PASSWORD},
+            allow_redirects=False,
+        )
+        ok = response.status_code == 302 and "error=true" not in response.headers.get(
+            "Location", ""
+        )
+        return "POST /login", ok
+
+    def day(self, params=None, route="GET /day/<date>"):
+        # Mostly stay on the same day, as people do between clicks.
+        if self.rng.random() < 0.3:
+            self.date = self.rng.choice(self.user.dates)
+        response = self.http.get(
+            "{}/day/{}".format(self.base_url, self.date),
+            params=params,
+            allow_redirects=False,
+        )
+        return route, response.status_code == 200
+
+    def day_filtered(self):
+        hidden = self.rng.sample(FILTER_TOGGLES, self.rng.randint(1, 3))
+        return self.day({"hidden": hidden}, "GET /day/<date>?hidden=...")
+
+    def day_shared(self):
+        # As picked from the day page's "Boost shared events" menu.
+        boost = self.rng.choice(("bit", "lot"))
+        return self.day({"boost": boost}, "GET /day/<date>?boost={}".format(boost))
+
+    def interest(self):
+        if not self.user.interests:
+            return self.day()
+        show_id, performance_id = self.rng.choice(self.user.interests)
+        route, path = self.rng.choice(
+            (
+                ("GET /love/<show>/<performance>", "/love/{}/{}"),
+                ("GET /like/<show>/<performance>", "/like/{}/{}"),
+                ("GET /love/performance/<performance>", "/love/performance/{1}"),
+            )
+        )
+        # Clicks from a loaded day page ask for just the changed columns.
+        response = self.http.get(
+            self.base_url + path.format(show_id, performance_id),
+            params={"day": str(self.date)},
+            headers={"X-Partial-Update": "columns"},
+            allow_redirects=False,
+        )
+        return route, response.status_code == 200
+
+
+class ConnectionSampler(threading.Thread):
+    # Counts the instance's connections to the database by state, a few times
+    # a second.
+
+    def __init__(self, config, interval=0.25):
+        super().__init__(name="connection-sampler", daemon=True)
+        self.config = config
+        self.interval = interval
+        self.samples = []
+        self._stopped = threading.Event()
+
+    def run(self):
+        with db.cursor(self.config) as cur:
+            cur.connection.autocommit = True
+            while not self._stopped.wait(self.interval):
+                cur.execute(
+                    "SELECT coalesce(state, 'unknown'), count(*) FROM pg_stat_activity "
+                    + "WHERE datname = %s AND application_name LIKE 'edfringeplanner:%%' "
+                    + "AND pid != pg_backend_pid() GROUP BY 1",
+                    (self.config.database_name,),
+                )
+                self.samples.append(dict(cur.fetchall()))
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def run_load(base_url, users: List[LoadUser], rate, duration, concurrency, seed=0):
+    # Each of the concurrent sessions sends its share of the rate on a fixed
+    # schedule, so a slow server is offered the same load as a fast one until
+    # every session is busy.
+    samples = []
+    interval = concurrency / rate
+    start = time.monotonic()
+    end = start + duration
+    actions = [action for action, _ in MIX]
+    weights = [weight for _, weight in MIX]
+
+    def simulate(index):
+        rng = random.Random(seed + index)
+        session = Session(base_url, users[index % len(users)], rng)
+        session.login()
+        next_at = start + interval * index / concurrency
+        while next_at < end:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            action = rng.choices(actions, weights)[0]
+            request_start = time.perf_counter()
+            try:
+                route, ok = session.run(action)
+            except requests.RequestException:
+                route, ok = action, False
+            samples.append(Sample(route, time.perf_counter() - request_start, ok))
+            next_at += interval
+
+    threads = [
+        threading.Thread(target=simulate, args=(index,), daemon=True)
+        for index in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.monotonic() - start
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, int(len(sorted_values) * fraction) - 1))
+    return sorted_values[index]
+
+
+def report(samples: List[Sample], elapsed, connection_samples):
+    by_route = defaultdict(list)
+    for sample in samples:
+        by_route[sample.route].append(sample)
+    print(
+        "{:<40} {:>7} {:>6} {:>8} {:>9} {:>9} {:>9}".format(
+            "route", "count", "errors", "req/s", "p50", "p95", "p99"
+        )
+    )
+    for route, route_samples in sorted(by_route.items()) + [("all", samples)]:
+        if not route_samples:
+            continue
+        seconds = sorted(sample.seconds for sample in route_samples)
+        print(
+            "{:<40} {:>7} {:>6} {:>8.1f} {:>7.1f}ms {:>7.1f}ms {:>7.1f}ms".format(
+                route,
+                len(route_samples),
+                sum(1 for sample in route_samples if not sample.ok),
+                len(route_samples) / elapsed,
+                1000 * percentile(seconds, 0.5),
+                1000 * percentile(seconds, 0.95),
+                1000 * percentile(seconds, 0.99),
+            )
+        )
+    if connection_samples:
+        totals = [sum(counts.values()) for counts in connection_samples]
+        active = [counts.get("active", 0) for counts in connection_samples]
+        print(
+            "DB connections: mean {:.1f}, max {}; active: mean {:.1f}, max {}".format(
+                sum(totals) / len(totals),
+                max(totals),
+                sum(active) / len(active),
+                max(active),
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replays a mix of user sessions against a local instance."
+    )
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument(
+        "--rate", type=float, default=50, help="Requests per second to offer"
+    )
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument(
+        "--concurrency", type=int, default=32, help="Sessions sending at once"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        metavar="USERS",
+        help="Wipe the test database and seed it with this many users first",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only seed, without sending requests"
+    )
+    args = parser.parse_args()
+
+    config = config_for_tests()
+    if args.seed is not None:
+        reset_database(config)
+        with db.cursor(config) as cur:
+            seed_database(
+                cur, users=args.seed, password_hash=PasswordHasher().hash(PASSWORD)
+            )
+        print("Seeded {} users".format(args.seed))
+    if args.dry_run:
+        return
+
+    users = load_users(config, args.concurrency)
+    if not users:
+        raise ValueError("No users to log in as; seed the database with --seed")
+    sampler = ConnectionSampler(config)
+    sampler.start()
+    try:
+        samples, elapsed = run_load(
+            args.url.rstrip("/"), users, args.rate, args.duration, args.concurrency
+        )
+    finally:
+        sampler.stop()
+    report(samples, elapsed, sampler.samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, NamedTuple, Optional
+
+import psycopg2
+import requests
+from psycopg2.extras import execute_values
+from requests.adapters import HTTPAdapter
+
+import db
+from config import Config
+
+# Outbound email is queued in outbound_emails (see
+# schema/migrations/0008_outbound_emails.sql) and sent through the Mailgun API
+# by a MailSender in each server process. Senders claim batches of emails with
+# SKIP LOCKED, so however many are running, each email is only sent by one.
+
+SENDER = "edfringe planner <signup@edfringeplanner.co.uk>"
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 8
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+# How long a sender has to send a batch it's claimed before another sender
+# may claim it again, in case the first died part way through.
+CLAIM_SECONDS = 300
+# Seconds to connect, and to wait for a response.
+TIMEOUT = (3.05, 10)
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(cur, *, to, subject, text, sender=SENDER):
+    cur.execute(
+        "INSERT INTO outbound_emails (sender, recipient, subject, body) VALUES (%s, %s, %s, %s)",
+        (sender, to, subject, text),
+    )
+
+
+class OutboundEmail(NamedTuple):
+    id: int
+    sender: str
+    recipient: str
+    subject: str
+    body: str
+    attempts: int
+
+
+class Outcome(NamedTuple):
+    id: int
+    sent: bool
+    abandoned: bool
+    retry_in_seconds: float
+    error: Optional[str]
+
+
+@dataclass
+class DeliveryMetrics:
+    sent: int = 0
+    retried: int = 0
+    abandoned: int = 0
+    batches: int = 0
+    # Time spent waiting for the API, in total and for its slowest response.
+    api_seconds: float = 0.0
+    slowest_api_seconds: float = 0.0
+
+
+def retry_delay(attempts) -> float:
+    return min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+
+
+def make_session() -> requests.Session:
+    # Reuses connections to the API between emails. Retries are left to the
+    # queue, which backs off for much longer than urllib3 would.
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(max_retries=0))
+    session.mount("http://", HTTPAdapter(max_retries=0))
+    return session
+
+
+class Mailer:
+    def __init__(
+        self,
+        config: Config,
+        session: Optional[requests.Session] = None,
+        batch_size=BATCH_SIZE,
+        max_attempts=MAX_ATTEMPTS,
+    ):
+        self.config = config
+        self.session = session or make_session()
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.metrics = DeliveryMetrics()
+        self._metrics_lock = threading.Lock()
+
+    def send_batch(self) -> int:
+        # Sends the emails which are due, up to a batch of them, and returns
+        # how many were due.
+        emails = self._claim()
+        if not emails:
+            return 0
+        outcomes = [self._send(email) for email in emails]
+        with db.cursor(self.config) as cur:
+            execute_values(
+                cur,
+                "UPDATE outbound_emails SET "
+                + "sent_at = CASE WHEN outcomes.sent THEN now() END, "
+                + "abandoned_at = CASE WHEN outcomes.abandoned THEN now() END, "
+                + "next_attempt_at = now() + make_interval(secs => outcomes.retry_in_seconds), "
+                + "last_error = outcomes.error "
+                + "FROM (VALUES %s) AS outcomes (id, sent, abandoned, retry_in_seconds, error) "
+                + "WHERE outbound_emails.id = outcomes.id",
+                outcomes,
+                template="(%s::integer, %s::boolean, %s::boolean, %s::double precision, %s::varchar)",
+                page_size=len(outcomes),
+            )
+        with self._metrics_lock:
+            self.metrics.batches += 1
+            for outcome in outcomes:
+                if outcome.sent:
+                    self.metrics.sent += 1
+                elif outcome.abandoned:
+                    self.metrics.abandoned += 1
+                else:
+                    self.metrics.retried += 1
+        logger.info(
+            "Sent %d of %d emails",
+            sum(1 for outcome in outcomes if outcome.sent),
+            len(outcomes),
+        )
+        return len(emails)
+
+    def _claim(self) -> List[OutboundEmail]:
+        with db.cursor(self.config) as cur:
+            cur.execute(
+                "UPDATE outbound_emails SET attempts = attempts + 1, "
+                + "next_attempt_at = now() + make_interval(secs => %(claim_seconds)s) "
+                + "WHERE id IN (SELECT id FROM outbound_emails "
+                + "WHERE sent_at IS NULL AND abandoned_at IS NULL AND next_attempt_at <= now() "
+                + "ORDER BY next_attempt_at ASC, id ASC LIMIT %(limit)s FOR UPDATE SKIP LOCKED) "
+                + "RETURNING id, sender, recipient, subject, body, attempts",
+                {"claim_seconds": CLAIM_SECONDS, "limit": self.batch_size},
+            )
+            return sorted(OutboundEmail(*row) for row in cur.fetchall())
+
+    def _send(self, email: OutboundEmail) -> Outcome:
+        start = time.perf_counter()
+        try:
+            response = self.session.post(
+                "{}/{}/messages".format(
+                    self.config.mailgun_api_url, self.config.mailgun_domain
+                ),
+                auth=("api", self.config.mailgun_key),
+                data={
+                    "from": email.sender,
+                    "to": [email.recipient],
+                    "subject": email.subject,
+                    "text": email.body,
+                },
+                timeout=TIMEOUT,
+            )
+            status = response.status_code
+            error = None if response.ok else "{} {}".format(status, response.text)
+        except requests.RequestException as e:
+            status = None
+            error = repr(e)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._metrics_lock:
+                self.metrics.api_seconds += elapsed
+                self.metrics.slowest_api_seconds = max(
+                    self.metrics.slowest_api_seconds, elapsed
+                )
+
+        if error is None:
+            return Outcome(email.id, True, False, 0, None)
+        # Other client errors mean the API will never accept the email.
+        retryable = status is None or status == 429 or status >= 500
+        if not retryable or email.attempts >= self.max_attempts:
+            logger.error("Giving up sending email %s: %s", email.id, error)
+            return Outcome(email.id, False, True, 0, error)
+        logger.warning(
+            "Failed to send email %s, attempt %s: %s", email.id, email.attempts, error
+        )
+        return Outcome(email.id, False, False, retry_delay(email.attempts), error)
+
+
+class MailSender:
+    # Sends queued email from a thread of its own, checking for more every
+    # poll_seconds or when woken by something which has just queued some.
+
+    def __init__(self, config: Config, mailer: Optional[Mailer] = None, poll_seconds=5):
+        self.mailer = mailer or Mailer(config)
+        self.poll_seconds = poll_seconds
+        self._thread = None
+        self._starting = threading.Lock()
+        self._stopping = threading.Event()
+        self._woken = threading.Event()
+
+    def start(self):
+        with self._starting:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="mail-sender", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._woken.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wake(self):
+        self._woken.set()
+
+    def _run(self):
+        backoff = 0.1
+        while not self._stopping.is_set():
+            self._woken.clear()
+            try:
+                claimed = self.mailer.send_batch()
+                backoff = 0.1
+            except psycopg2.Error:
+                logger.exception("Couldn't send queued email")
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            # A full batch means there may be more waiting.
+            if claimed < self.mailer.batch_size:
+                self._woken.wait(self.poll_seconds)
+
+
+def main():
+    # Sends everything which is due, for when no server is running to.
+    mailer = Mailer(Config.from_env())
+    while mailer.send_batch():
+        pass
+    print(mailer.metrics)
+
+
+if __name__ == "__main__":
+    main()
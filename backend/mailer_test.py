@@ -0,0 +1,165 @@
+import dataclasses
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import mailer
+from db import cursor
+from mailer import MailSender, Mailer
+from testdb import config_for_tests, reset_database
+
+
+class StubMailgun(ThreadingHTTPServer):
+    # Answers each POST with the next of statuses, and then 200s, recording
+    # the form it was sent and the connection it came in on.
+
+    def __init__(self, statuses=()):
+        super().__init__(("127.0.0.1", 0), StubMailgunHandler)
+        self.statuses = list(statuses)
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/v3".format(self.server_address[1])
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubMailgunHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            self.server.requests.append(
+                (self.path, self.client_address, parse_qs(body.decode("utf-8")))
+            )
+            status = self.server.statuses.pop(0) if self.server.statuses else 200
+        response = b'{"message": "Queued"}'
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestMailer(unittest.TestCase):
+    def setUp(self):
+        reset_database(config_for_tests())
+        self.stub = StubMailgun()
+        self.addCleanup(self.stub.close)
+        self.config = dataclasses.replace(
+            config_for_tests(), mailgun_api_url=self.stub.url
+        )
+
+    def enqueue(self, count):
+        with cursor(self.config) as cur:
+            for i in range(count):
+                mailer.enqueue(
+                    cur,
+                    to="user{}@example.com".format(i),
+                    subject="Hello",
+                    text="Message {}".format(i),
+                )
+
+    def emails(self):
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT recipient, attempts, sent_at IS NOT NULL, abandoned_at IS NOT NULL, last_error "
+                + "FROM outbound_emails ORDER BY id"
+            )
+            return cur.fetchall()
+
+    def make_due(self):
+        with cursor(self.config) as cur:
+            cur.execute("UPDATE outbound_emails SET next_attempt_at = now()")
+
+    def test_sends_in_batches_over_one_connection(self):
+        self.enqueue(5)
+        sender = Mailer(self.config, batch_size=2)
+        self.assertEqual([2, 2, 1, 0], [sender.send_batch() for _ in range(4)])
+
+        self.assertEqual(
+            [("user{}@example.com".format(i), 1, True, False, None) for i in range(5)],
+            self.emails(),
+        )
+        self.assertEqual(5, len(self.stub.requests))
+        path, _, form = self.stub.requests[0]
+        self.assertEqual("/v3/example.com/messages", path)
+        self.assertEqual(["user0@example.com"], form["to"])
+        self.assertEqual(["Message 0"], form["text"])
+        self.assertEqual(1, len({address for _, address, _ in self.stub.requests}))
+        self.assertEqual(5, sender.metrics.sent)
+        self.assertEqual(3, sender.metrics.batches)
+
+    def test_retries_with_backoff(self):
+        self.enqueue(1)
+        self.stub.statuses = [503, 429]
+        sender = Mailer(self.config)
+        self.assertEqual(1, sender.send_batch())
+        # Not due again until the backoff has passed.
+        self.assertEqual(0, sender.send_batch())
+        (email,) = self.emails()
+        self.assertEqual((1, False, False), email[1:4])
+        self.assertTrue(email[4].startswith("503"))
+
+        self.make_due()
+        sender.send_batch()
+        self.make_due()
+        sender.send_batch()
+        self.assertEqual([("user0@example.com", 3, True, False, None)], self.emails())
+        self.assertEqual(2, sender.metrics.retried)
+        self.assertEqual(1, sender.metrics.sent)
+
+    def test_gives_up(self):
+        self.enqueue(2)
+        self.stub.statuses = [400, 500, 500]
+        sender = Mailer(self.config, max_attempts=2)
+        sender.send_batch()
+        self.make_due()
+        sender.send_batch()
+        self.assertEqual(
+            [(1, False, True), (2, False, True)],
+            [email[1:4] for email in self.emails()],
+        )
+        self.assertEqual(2, sender.metrics.abandoned)
+
+    def test_unreachable_api_is_retried(self):
+        self.enqueue(1)
+        self.stub.close()
+        self.config = dataclasses.replace(
+            self.config, mailgun_api_url="http://127.0.0.1:1/v3"
+        )
+        Mailer(self.config).send_batch()
+        (email,) = self.emails()
+        self.assertEqual((1, False, False), email[1:4])
+
+    def test_retry_delay(self):
+        self.assertEqual(
+            [30, 60, 120, 3600],
+            [mailer.retry_delay(attempts) for attempts in (1, 2, 3, 20)],
+        )
+
+    def test_sender_thread_sends_when_woken(self):
+        sender = MailSender(self.config, poll_seconds=60)
+        sender.start()
+        self.addCleanup(sender.stop)
+        self.enqueue(3)
+        sender.wake()
+        for _ in range(100):
+            if sender.mailer.metrics.sent == 3:
+                break
+            threading.Event().wait(0.05)
+        self.assertEqual(3, sender.mailer.metrics.sent)
+
+
+if __name__ == "__main__":
+    unittest.main()
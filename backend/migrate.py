@@ -0,0 +1,73 @@
+import os
+import re
+import sys
+
+from config import Config
+from db import cursor
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "schema")
+MIGRATIONS_DIR = os.path.join(SCHEMA_DIR, "migrations")
+
+_MIGRATION_FILENAME = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+
+def available_migrations():
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = _MIGRATION_FILENAME.match(filename)
+        if match is None:
+            continue
+        migrations.append(
+            (
+                int(match.group(1)),
+                match.group(2),
+                os.path.join(MIGRATIONS_DIR, filename),
+            )
+        )
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError("Duplicate migration versions in {}".format(MIGRATIONS_DIR))
+    return migrations
+
+
+def migrate(cur, log=lambda message: None):
+    # Migrations apply on top of schema/initial.sql.
+    with open(os.path.join(SCHEMA_DIR, "initial.sql")) as f:
+        cur.execute(f.read())
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        + "version INTEGER PRIMARY KEY, "
+        + "name VARCHAR, "
+        + "applied_at TIMESTAMP WITH TIME ZONE DEFAULT now())"
+    )
+    # Stop two processes applying the same migrations at once.
+    cur.execute("LOCK TABLE schema_migrations IN EXCLUSIVE MODE")
+    cur.execute("SELECT version FROM schema_migrations")
+    applied = {row[0] for row in cur.fetchall()}
+
+    newly_applied = []
+    for version, name, path in available_migrations():
+        if version in applied:
+            continue
+        log("Applying migration {} ({})".format(version, name))
+        with open(path) as f:
+            cur.execute(f.read())
+        cur.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+            (version, name),
+        )
+        newly_applied.append(version)
+    return newly_applied
+
+
+def main():
+    config = Config.from_env()
+    with cursor(config) as cur:
+        applied = migrate(cur, log=lambda message: print(message, file=sys.stderr))
+    if not applied:
+        print("Already up to date", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import datetime
+import math
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+
+import catalog
+from catalog import Catalog, CatalogPerformance, CatalogShow, CatalogVenue
+from travel import walking_minutes
+
+CELL_METRES = 250
+METRES_PER_DEGREE_LATITUDE = 111195
+
+DEFAULT_RADIUS_METRES = 1500
+DEFAULT_WITHIN = datetime.timedelta(hours=1)
+DEFAULT_LIMIT = 20
+
+
+@dataclass(frozen=True)
+class NearbyPerformance:
+    performance: CatalogPerformance
+    show: CatalogShow
+    venue: CatalogVenue
+    distance_metres: float
+    walking_minutes: int
+
+
+class VenueGrid:
+    # Venues with locations, bucketed into a grid of square cells over the
+    # city, so that only the cells around a point need checking to find the
+    # venues near it.
+    #
+    # Locations are projected onto a flat plane, in metres, with longitude
+    # scaled for the venues' average latitude. Across a city that's out by
+    # less than a metre in every kilometre, and far cheaper than working out
+    # great-circle distances.
+
+    def __init__(self, venues: Iterable[CatalogVenue]):
+        located = [
+            venue
+            for venue in venues
+            if venue.lat is not None and venue.long is not None
+        ]
+        average_lat = (
+            sum(venue.lat for venue in located) / len(located) if located else 0.0
+        )
+        self._metres_per_degree_long = METRES_PER_DEGREE_LATITUDE * math.cos(
+            math.radians(average_lat)
+        )
+        cells = defaultdict(list)
+        for venue in located:
+            x, y = self._project(venue.lat, venue.long)
+            cells[self._cell(x, y)].append((x, y, venue))
+        self._cells: Dict[Tuple[int, int], List[Tuple[float, float, CatalogVenue]]] = (
+            dict(cells)
+        )
+
+    def _project(self, lat, long) -> Tuple[float, float]:
+        return long * self._metres_per_degree_long, lat * METRES_PER_DEGREE_LATITUDE
+
+    def distance_metres(self, lat_a, long_a, lat_b, long_b) -> float:
+        x_a, y_a = self._project(lat_a, long_a)
+        x_b, y_b = self._project(lat_b, long_b)
+        return math.hypot(x_b - x_a, y_b - y_a)
+
+    @staticmethod
+    def _cell(x, y) -> Tuple[int, int]:
+        return math.floor(x / CELL_METRES), math.floor(y / CELL_METRES)
+
+    def within(self, lat, long, radius_metres) -> List[Tuple[float, CatalogVenue]]:
+        # The venues no further than radius_metres from the point, nearest
+        # first, with their distances.
+        x, y = self._project(lat, long)
+        first_column, first_row = self._cell(x - radius_metres, y - radius_metres)
+        last_column, last_row = self._cell(x + radius_metres, y + radius_metres)
+        found = []
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                for venue_x, venue_y, venue in self._cells.get((column, row), ()):
+                    distance = math.hypot(venue_x - x, venue_y - y)
+                    if distance <= radius_metres:
+                        found.append((distance, venue))
+        found.sort(key=lambda found_venue: (found_venue[0], found_venue[1].id))
+        return found
+
+
+class NearbyIndex:
+    # What's starting soon near a point: the venues near it from a VenueGrid,
+    # and the performances starting soon from the catalog's performances,
+    # which are sorted by start time, checked against each other. Never
+    # changed once built, so any number of requests can share one.
+
+    def __init__(self, source: Catalog):
+        self.catalog = source
+        self.venues = VenueGrid(source.venues.values())
+
+    def find(
+        self,
+        lat,
+        long,
+        now: datetime.datetime,
+        within: datetime.timedelta = DEFAULT_WITHIN,
+        radius_metres=DEFAULT_RADIUS_METRES,
+        limit=DEFAULT_LIMIT,
+    ) -> List[NearbyPerformance]:
+        # Performances which aren't sold out, start within the given time,
+        # and are at venues close enough to walk to before they start. The
+        # soonest come first, and the nearest of those which start together.
+        nearby_venues = {
+            venue.id: (distance, venue)
+            for distance, venue in self.venues.within(lat, long, radius_metres)
+        }
+        if not nearby_venues:
+            return []
+
+        found = []
+        for performance in self.catalog.performances_starting_between(
+            now, now + within
+        ):
+            # Performances come in order of start time, so once there are
+            # enough, only those starting at the same time as the last can
+            # still make the cut.
+            if len(found) >= limit and performance.datetime_utc > found[-1][0]:
+                break
+            if performance.sold_out:
+                continue
+            show = self.catalog.shows.get(performance.show_id)
+            if show is None or show.venue_id not in nearby_venues:
+                continue
+            distance, venue = nearby_venues[show.venue_id]
+            minutes = walking_minutes(distance)
+            if 60 * minutes > (performance.datetime_utc - now).total_seconds():
+                continue
+            found.append(
+                (
+                    performance.datetime_utc,
+                    distance,
+                    performance.id,
+                    performance,
+                    show,
+                    venue,
+                    minutes,
+                )
+            )
+        found.sort(key=lambda each: each[:3])
+        return [
+            NearbyPerformance(
+                performance=performance,
+                show=show,
+                venue=venue,
+                distance_metres=distance,
+                walking_minutes=minutes,
+            )
+            for _, distance, _, performance, show, venue, minutes in found[:limit]
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_nearby_index(config) -> NearbyIndex:
+    # Rebuilt whenever the catalog is.
+    global _index
+    source = catalog.get_catalog(config)
+    with _index_lock:
+        if _index is None or _index.catalog is not source:
+            _index = NearbyIndex(source)
+        return _index
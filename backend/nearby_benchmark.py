@@ -0,0 +1,125 @@
+import datetime
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytz
+
+from events import day_bounds
+from nearby import DEFAULT_RADIUS_METRES, DEFAULT_WITHIN, NearbyIndex
+from synthetic import FESTIVAL_START, make_catalog
+from travel import walking_minutes
+
+# Compares finding what's starting soon near random points through the day,
+# by checking every venue and performance, with NearbyIndex, both one request
+# at a time and with many at once.
+
+DATE = FESTIVAL_START + datetime.timedelta(days=7)
+
+
+def scan(source, grid, lat, long, now, limit=20):
+    # What NearbyIndex.find returns, measuring distances as grid does, but
+    # without using it to find venues.
+    found = []
+    for performance in source.performances:
+        if performance.sold_out or not (
+            now <= performance.datetime_utc < now + DEFAULT_WITHIN
+        ):
+            continue
+        show = source.shows[performance.show_id]
+        venue = source.venues[show.venue_id]
+        distance = grid.distance_metres(lat, long, venue.lat, venue.long)
+        minutes = walking_minutes(distance)
+        if distance <= DEFAULT_RADIUS_METRES and (
+            now + datetime.timedelta(minutes=minutes) <= performance.datetime_utc
+        ):
+            found.append((performance.datetime_utc, distance, performance.id))
+    return [performance_id for _, _, performance_id in sorted(found)[:limit]]
+
+
+def make_queries(count, seed=0):
+    rng = random.Random(seed)
+    start, _ = day_bounds(DATE)
+    return [
+        (
+            55.94 + rng.uniform(-0.02, 0.02),
+            -3.19 + rng.uniform(-0.03, 0.03),
+            (
+                start + datetime.timedelta(minutes=rng.randrange(4 * 60, 20 * 60))
+            ).astimezone(pytz.utc),
+        )
+        for _ in range(count)
+    ]
+
+
+def timed(f, query):
+    start = time.perf_counter()
+    f(*query)
+    return time.perf_counter() - start
+
+
+def report(name, timings, elapsed):
+    timings = sorted(timings)
+    print(
+        "{:<28} p50 {:7.3f}ms p99 {:7.3f}ms   {:8.0f} queries/s".format(
+            name,
+            1000 * statistics.median(timings),
+            1000 * timings[int(len(timings) * 0.99) - 1],
+            len(timings) / elapsed,
+        )
+    )
+
+
+def run(name, f, queries, threads=1):
+    start = time.perf_counter()
+    if threads == 1:
+        timings = [timed(f, query) for query in queries]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            timings = list(executor.map(lambda query: timed(f, query), queries))
+    report(name, timings, time.perf_counter() - start)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    full = make_catalog(venues=330)
+    # Just the one day, as that's all a query looks at.
+    day_start, day_end = day_bounds(DATE)
+    source = full.__class__(
+        version=full.version,
+        venues=full.venues,
+        shows=full.shows,
+        performances=full.performances_starting_between(day_start, day_end),
+    )
+    start = time.perf_counter()
+    index = NearbyIndex(source)
+    print(
+        "{} venues, {} performances; index built in {:.1f}ms; {} queries".format(
+            len(source.venues),
+            len(source.performances),
+            1000 * (time.perf_counter() - start),
+            iterations,
+        )
+    )
+
+    queries = make_queries(iterations)
+    for lat, long, now in queries[:100]:
+        want = scan(source, index.venues, lat, long, now)
+        got = [result.performance.id for result in index.find(lat, long, now)]
+        assert want == got, (lat, long, now)
+
+    run(
+        "scan",
+        lambda *query: scan(source, index.venues, *query),
+        queries[: iterations // 10],
+    )
+    run("index", index.find, queries)
+    run("index, {} threads".format(threads), index.find, queries, threads=threads)
+
+
+if __name__ == "__main__":
+    main()
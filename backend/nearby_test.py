@@ -0,0 +1,151 @@
+import datetime
+import random
+import unittest
+
+import pytz
+
+from catalog import Catalog, CatalogPerformance, CatalogShow, CatalogVenue
+from nearby import NearbyIndex, VenueGrid
+from synthetic import FESTIVAL_START, make_catalog
+from travel import distance_metres, walking_minutes
+
+NOW = pytz.utc.localize(
+    datetime.datetime.combine(
+        FESTIVAL_START + datetime.timedelta(days=7), datetime.time(14)
+    )
+)
+
+
+def venue(venue_id, lat, long):
+    return CatalogVenue(venue_id, "Venue {}".format(venue_id), "", lat, long)
+
+
+def show(show_id, venue_id):
+    return CatalogShow(
+        show_id,
+        "Show {}".format(show_id),
+        "Comedy",
+        venue_id,
+        datetime.timedelta(hours=1),
+        "/whats-on/{}".format(show_id),
+    )
+
+
+class TestVenueGrid(unittest.TestCase):
+    def test_matches_brute_force(self):
+        venues = list(make_catalog(shows=0).venues.values())
+        grid = VenueGrid(venues)
+        rng = random.Random(0)
+        for _ in range(50):
+            lat = 55.94 + rng.uniform(-0.03, 0.03)
+            long = -3.19 + rng.uniform(-0.04, 0.04)
+            radius = rng.choice((100, 500, 1500, 5000))
+            with self.subTest(lat=lat, long=long, radius=radius):
+                distances = {
+                    each.id: distance_metres(lat, long, each.lat, each.long)
+                    for each in venues
+                }
+                found = grid.within(lat, long, radius)
+                found_ids = {each.id for _, each in found}
+                # Projected distances are out by less than a metre in every
+                # kilometre.
+                for distance, each in found:
+                    self.assertAlmostEqual(
+                        distances[each.id], distance, delta=1 + radius / 1000
+                    )
+                self.assertEqual(
+                    sorted(distance for distance, _ in found),
+                    [distance for distance, _ in found],
+                )
+                for venue_id, distance in distances.items():
+                    if distance < radius - 1 - radius / 1000:
+                        self.assertIn(venue_id, found_ids)
+                    elif distance > radius + 1 + radius / 1000:
+                        self.assertNotIn(venue_id, found_ids)
+
+    def test_venues_without_locations(self):
+        grid = VenueGrid([venue(1, None, None), venue(2, 55.95, -3.19)])
+        self.assertEqual([2], [v.id for _, v in grid.within(55.95, -3.19, 10)])
+        self.assertEqual([], VenueGrid([]).within(55.95, -3.19, 1000))
+
+
+class TestNearbyIndex(unittest.TestCase):
+    def setUp(self):
+        # Venue 1 is where the user is, venue 2 about 10 minutes' walk away,
+        # and venue 3 too far to walk to.
+        self.venues = {
+            1: venue(1, 55.95, -3.19),
+            2: venue(2, 55.955, -3.19),
+            3: venue(3, 56.0, -3.19),
+        }
+        self.shows = {show_id: show(show_id, show_id) for show_id in self.venues}
+
+    def index(self, *performances):
+        return NearbyIndex(
+            Catalog(
+                version=0,
+                venues=self.venues,
+                shows=self.shows,
+                performances=sorted(
+                    (
+                        CatalogPerformance(
+                            i,
+                            show_id,
+                            NOW + datetime.timedelta(minutes=minutes),
+                            sold_out,
+                        )
+                        for i, (show_id, minutes, sold_out) in enumerate(performances)
+                    ),
+                    key=lambda performance: performance.datetime_utc,
+                ),
+            )
+        )
+
+    def find(self, index, **kwargs):
+        return [
+            (result.show.id, result.performance.id)
+            for result in index.find(55.95, -3.19, NOW, **kwargs)
+        ]
+
+    def test_soonest_reachable_first(self):
+        walk = walking_minutes(distance_metres(55.95, -3.19, 55.955, -3.19))
+        self.assertEqual(10, walk)
+        index = self.index(
+            (2, 30, False),
+            (1, 30, False),
+            (1, 5, False),
+            # Starts before the user could walk there.
+            (2, walk - 1, False),
+            (2, walk, False),
+            (1, 10, True),
+            (3, 20, False),
+            (1, 61, False),
+            (1, -5, False),
+        )
+        self.assertEqual([(1, 2), (2, 4), (1, 1), (2, 0)], self.find(index))
+        self.assertEqual([(1, 2), (2, 4)], self.find(index, limit=2))
+        self.assertEqual([(1, 2), (2, 4), (1, 1)], self.find(index, limit=3))
+        self.assertEqual([(1, 2), (1, 1)], self.find(index, radius_metres=100))
+        self.assertEqual(
+            [(1, 2), (2, 4), (1, 1), (2, 0), (1, 7)],
+            self.find(index, within=datetime.timedelta(hours=2)),
+        )
+
+    def test_full_catalog(self):
+        source = make_catalog()
+        index = NearbyIndex(source)
+        results = index.find(55.94, -3.19, NOW)
+        self.assertTrue(results)
+        starts = [result.performance.datetime_utc for result in results]
+        self.assertEqual(sorted(starts), starts)
+        for result in results:
+            self.assertFalse(result.performance.sold_out)
+            self.assertLessEqual(result.distance_metres, 1500)
+            self.assertGreaterEqual(
+                result.performance.datetime_utc,
+                NOW + datetime.timedelta(minutes=result.walking_minutes),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
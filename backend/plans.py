@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from singleflight import SingleFlight
+
+
+class _Load:
+    # A load of a day in progress, and the changes made since it started
+    # which may affect the day, to check it against once it's loaded.
+    def __init__(self):
+        self.stale = False
+        self.changes = []
+
+
+class DayPlanCache:
+    # Days are cached by (user_id, date, hydrate_shares). Concurrent requests
+    # for a day which isn't cached share one load of it, rather than each
+    # loading it themselves.
+
+    def __init__(self, max_age_seconds=300, maxsize=1000):
+        self.max_age_seconds = max_age_seconds
+        self.maxsize = maxsize
+        self._days = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = SingleFlight()
+        # By key, so that a day loaded from before a change to it isn't cached
+        # after it.
+        self._loading = defaultdict(list)
+
+    def peek(self, key):
+        with self._lock:
+            entry = self._days.get(key)
+            if entry is None:
+                return None
+            loaded_at, day = entry
+            if time.monotonic() - loaded_at > self.max_age_seconds:
+                del self._days[key]
+                return None
+            return day
+
+    def get(self, key, load):
+        day = self.peek(key)
+        if day is None:
+            day = self.loads.do(key, lambda: self._load(key, load))
+        return day
+
+    def _load(self, key, load):
+        loading = _Load()
+        with self._lock:
+            self._loading[key].append(loading)
+        try:
+            day = load()
+        except BaseException:
+            with self._lock:
+                self._stop_loading(key, loading)
+            raise
+        with self._lock:
+            self._stop_loading(key, loading)
+            if not loading.stale and not any(
+                affects_day(day) for affects_day in loading.changes
+            ):
+                self._days[key] = (time.monotonic(), day)
+                self._days.move_to_end(key)
+                if len(self._days) > self.maxsize:
+                    self._days.popitem(last=False)
+        return day
+
+    def _stop_loading(self, key, loading):
+        # Called with the lock held.
+        self._loading[key].remove(loading)
+        if not self._loading[key]:
+            del self._loading[key]
+
+    def _changed(self, affects_key, affects_day):
+        # Called with the lock held. Loads of the keys a change affects are
+        # stale, and later requests for those keys don't share them. Whether
+        # a change to some events affects a day can only be told once it's
+        # loaded, so those loads are still shared until they finish.
+        stale_keys = []
+        for key, loads in self._loading.items():
+            if affects_key(key):
+                stale_keys.append(key)
+                for loading in loads:
+                    loading.stale = True
+            elif affects_day is not None:
+                for loading in loads:
+                    loading.changes.append(affects_day)
+        if stale_keys:
+            self.loads.forget(stale_keys)
+
+    def update(self, user_id, change):
+        # Applies change to each of the user's cached days in place, dropping
+        # any it can't be applied to. Other users' share-hydrated days may
+        # include this user's interests, so they're dropped too.
+        with self._lock:
+            self._changed(lambda key: key[0] == user_id or key[2], None)
+            for key, (loaded_at, day) in list(self._days.items()):
+                key_user_id, _, hydrate_shares = key
+                if key_user_id == user_id:
+                    changed = change(day)
+                    if changed is None:
+                        del self._days[key]
+                    else:
+                        self._days[key] = (loaded_at, changed)
+                elif hydrate_shares:
+                    del self._days[key]
+
+    def invalidate_user(self, user_id):
+        # Share-hydrated days of other users may include this user's
+        # interests, so they go too.
+        self._invalidate(lambda key: key[0] == user_id or key[2])
+
+    def invalidate_hydrated(self):
+        self._invalidate(lambda key: key[2])
+
+    def invalidate_performances(self, performance_ids):
+        performance_ids = set(performance_ids)
+        self._invalidate(
+            affects_day=lambda day: any(
+                event.performance_id in performance_ids for event in day.events
+            )
+        )
+
+    def invalidate_shows(self, show_ids):
+        show_ids = set(show_ids)
+        self._invalidate(
+            affects_day=lambda day: any(
+                event.show_id in show_ids for event in day.events
+            )
+        )
+
+    def _invalidate(self, affects_key=lambda key: False, affects_day=None):
+        with self._lock:
+            self._changed(affects_key, affects_day)
+            for key, (_, day) in list(self._days.items()):
+                if affects_key(key) or (affects_day is not None and affects_day(day)):
+                    del self._days[key]
+
+    def clear(self):
+        with self._lock:
+            self._changed(lambda key: True, None)
+            self._days.clear()
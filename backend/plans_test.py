@@ -0,0 +1,113 @@
+import datetime
+import threading
+import unittest
+
+from plans import DayPlanCache
+
+KEY = (1, datetime.date(2019, 8, 10), False)
+
+
+class Event:
+    def __init__(self, performance_id, show_id):
+        self.performance_id = performance_id
+        self.show_id = show_id
+
+
+class Day:
+    def __init__(self, *events):
+        self.events = list(events)
+
+
+class TestDayPlanCache(unittest.TestCase):
+    def test_concurrent_misses_load_once(self):
+        cache = DayPlanCache()
+        release = threading.Event()
+        loads = []
+
+        def load():
+            loads.append(1)
+            release.wait()
+            return "day"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get(KEY, load)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for _ in range(1000):
+            if cache.loads.coalesced == 3:
+                break
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(["day"] * 4, results)
+        self.assertEqual(1, len(loads))
+        self.assertEqual(3, cache.loads.coalesced)
+        self.assertEqual("day", cache.peek(KEY))
+
+    def test_load_from_before_a_change_is_not_cached(self):
+        cache = DayPlanCache()
+
+        def load():
+            cache.invalidate_user(1)
+            return "stale day"
+
+        self.assertEqual("stale day", cache.get(KEY, load))
+        self.assertIsNone(cache.peek(KEY))
+        self.assertEqual("day", cache.get(KEY, lambda: "day"))
+        self.assertEqual("day", cache.peek(KEY))
+
+    def test_load_from_before_an_unrelated_change_is_cached(self):
+        cache = DayPlanCache()
+        release = threading.Event()
+        loading = threading.Event()
+        loads = []
+
+        def load():
+            loads.append(1)
+            loading.set()
+            release.wait()
+            return "day"
+
+        first = threading.Thread(target=lambda: cache.get(KEY, load))
+        first.start()
+        loading.wait()
+        cache.invalidate_user(2)
+        second = threading.Thread(target=lambda: cache.get(KEY, load))
+        second.start()
+        for _ in range(1000):
+            if cache.loads.coalesced == 1:
+                break
+            threading.Event().wait(0.001)
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertEqual(1, len(loads))
+        self.assertEqual("day", cache.peek(KEY))
+
+    def test_load_from_before_a_performance_change(self):
+        cache = DayPlanCache()
+        other_key = (2, KEY[1], False)
+
+        def load(day):
+            def load():
+                cache.invalidate_performances([10])
+                return day
+
+            return load
+
+        changed = Day(Event(10, 1))
+        self.assertIs(changed, cache.get(KEY, load(changed)))
+        self.assertIsNone(cache.peek(KEY))
+        unchanged = Day(Event(20, 2))
+        self.assertIs(unchanged, cache.get(other_key, load(unchanged)))
+        self.assertIs(unchanged, cache.peek(other_key))
+
+
+if __name__ == "__main__":
+    unittest.main()
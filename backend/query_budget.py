@@ -0,0 +1,131 @@
+import contextvars
+import functools
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import psycopg2.extensions
+
+import db
+
+# Request handlers and importer entry points declare how many statements (and
+# optionally rows) they may run. Budgets are only checked by tests, inside
+# enforce_budgets(); otherwise the decorator just calls through.
+#
+# A route's budget covers its handler, so not Flask-Login loading the user
+# beforehand or anything a streamed response does after the handler returns.
+
+_enforcing = False
+
+# The budgeted calls in progress. A context variable rather than a
+# thread-local, so that queries which AsyncDayLoader runs on its event loop's
+# thread count towards the call which asked for them.
+_scopes = contextvars.ContextVar("query_budget_scopes", default=())
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    statements: int
+    rows: Optional[int] = None
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@dataclass
+class _Scope:
+    name: str
+    budget: QueryBudget
+    statements: List[Tuple[str, int]] = field(default_factory=list)
+
+    def check(self):
+        rows = sum(count for _, count in self.statements)
+        over_statements = len(self.statements) > self.budget.statements
+        over_rows = self.budget.rows is not None and rows > self.budget.rows
+        if not over_statements and not over_rows:
+            return
+        raise QueryBudgetExceeded(
+            "{} ran {} statements returning or changing {} rows, over its budget of {}{}:\n{}".format(
+                self.name,
+                len(self.statements),
+                rows,
+                self.budget.statements,
+                (
+                    ""
+                    if self.budget.rows is None
+                    else " and {} rows".format(self.budget.rows)
+                ),
+                "\n".join(
+                    "  [{} rows] {}".format(count, statement)
+                    for statement, count in self.statements
+                ),
+            )
+        )
+
+
+def query_budget(statements, rows=None):
+    budget = QueryBudget(statements, rows)
+
+    def decorate(f):
+        name = "{}.{}".format(f.__module__, f.__qualname__)
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enforcing:
+                return f(*args, **kwargs)
+            scope = _Scope(name, budget)
+            token = _scopes.set(_scopes.get() + (scope,))
+            try:
+                result = f(*args, **kwargs)
+            finally:
+                _scopes.reset(token)
+            scope.check()
+            return result
+
+        wrapper.query_budget = budget
+        return wrapper
+
+    return decorate
+
+
+def record(statement, rows):
+    # Counts a statement towards every budgeted call in progress.
+    for scope in _scopes.get():
+        scope.statements.append((statement, rows))
+
+
+@contextmanager
+def unbudgeted():
+    # For work which is slow for reasons other than its queries, such as
+    # looking shows up on edfringe.
+    token = _scopes.set(())
+    try:
+        yield
+    finally:
+        _scopes.reset(token)
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        result = super().execute(query, vars)
+        record(self.query.decode("utf-8"), max(self.rowcount, 0))
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        result = super().copy_expert(sql, file, size)
+        record(sql, max(self.rowcount, 0))
+        return result
+
+
+@contextmanager
+def enforce_budgets():
+    global _enforcing
+    previous_factory = db.cursor_factory
+    db.cursor_factory = CountingCursor
+    _enforcing = True
+    try:
+        yield
+    finally:
+        _enforcing = False
+        db.cursor_factory = previous_factory
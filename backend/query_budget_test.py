@@ -0,0 +1,261 @@
+import dataclasses
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from argon2 import PasswordHasher
+
+import catalog
+import importer
+import sharing
+import travel
+from async_events import AsyncDayLoader
+from db import cursor
+from plans import DayPlanCache
+from query_budget import (
+    QueryBudgetExceeded,
+    enforce_budgets,
+    query_budget,
+    unbudgeted,
+)
+from search import ShowSearch
+from synthetic import FESTIVAL_START, seed_database
+from testdb import config_for_tests, reset_database
+
+DATE = FESTIVAL_START + datetime.timedelta(days=7)
+
+
+class TestQueryBudget(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.config = config_for_tests()
+
+    def run_queries(self, count):
+        with cursor(self.config) as cur:
+            for i in range(count):
+                cur.execute("SELECT generate_series(1, %s)", (i + 1,))
+
+    def test_within_budget(self):
+        @query_budget(statements=2, rows=3)
+        def two_queries():
+            self.run_queries(2)
+            return "done"
+
+        with enforce_budgets():
+            self.assertEqual("done", two_queries())
+
+    def test_too_many_statements_lists_them(self):
+        @query_budget(statements=2)
+        def three_queries():
+            self.run_queries(3)
+
+        with enforce_budgets():
+            with self.assertRaises(QueryBudgetExceeded) as raised:
+                three_queries()
+        message = str(raised.exception)
+        self.assertIn("three_queries ran 3 statements", message)
+        for i in range(1, 4):
+            self.assertIn(
+                "[{} rows] SELECT generate_series(1, {})".format(i, i), message
+            )
+
+    def test_too_many_rows(self):
+        @query_budget(statements=2, rows=2)
+        def two_queries():
+            self.run_queries(2)
+
+        with enforce_budgets():
+            with self.assertRaises(QueryBudgetExceeded):
+                two_queries()
+
+    def test_only_enforced_in_tests(self):
+        @query_budget(statements=0)
+        def one_query():
+            self.run_queries(1)
+
+        one_query()
+
+    def test_nested_calls_count_towards_both(self):
+        @query_budget(statements=1)
+        def inner():
+            self.run_queries(1)
+
+        @query_budget(statements=1)
+        def outer():
+            inner()
+            inner()
+
+        with enforce_budgets():
+            inner()
+            with self.assertRaises(QueryBudgetExceeded) as raised:
+                outer()
+        self.assertIn("outer ran 2 statements", str(raised.exception))
+
+    def test_unbudgeted(self):
+        @query_budget(statements=0)
+        def slow_lookup():
+            with unbudgeted():
+                self.run_queries(1)
+
+        with enforce_budgets():
+            slow_lookup()
+
+
+class TestBudgets(unittest.TestCase):
+    # Runs the budgeted routes and importer entry points against a seeded
+    # database with nothing cached, which is when they run the most queries.
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dir = tempfile.TemporaryDirectory()
+        cls.config = dataclasses.replace(
+            config_for_tests(), cache_dir=cls.cache_dir.name
+        )
+        reset_database(cls.config)
+        with cursor(cls.config) as cur:
+            cls.user_ids = seed_database(
+                cur,
+                venues=30,
+                shows=300,
+                users=30,
+                shares_per_user=10,
+                password_hash=PasswordHasher().hash("password"),
+            )
+            cur.execute(
+                "SELECT performances.id, performances.show_id FROM performances "
+                + "INNER JOIN interests ON interests.show_id = performances.show_id "
+                + "WHERE interests.user_id = %s AND interests.interest != 'Booked' LIMIT 1",
+                (cls.user_ids[0],),
+            )
+            cls.performance_id, cls.show_id = cur.fetchone()
+
+        # The app reads its config from the environment when it's imported.
+        for name, value in (
+            ("EDFRINGEPLANNER_DB_NAME", cls.config.database_name),
+            ("EDFRINGEPLANNER_SESSION_KEY", cls.config.session_key),
+            ("EDFRINGEPLANNER_MAILGUN_DOMAIN", cls.config.mailgun_domain),
+            ("EDFRINGEPLANNER_MAILGUN_KEY", cls.config.mailgun_key),
+            ("EDFRINGEPLANNER_DOMAIN_PREFIX", cls.config.domain_prefix),
+        ):
+            os.environ.setdefault(name, value)
+        import edfringeplanner
+
+        cls.app = edfringeplanner
+        cls.day_loader = AsyncDayLoader(cls.config)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.day_loader.close()
+        cls.cache_dir.cleanup()
+
+    def setUp(self):
+        for name, value in (
+            ("config", self.config),
+            ("day_loader", self.day_loader),
+            ("show_search", ShowSearch(self.config)),
+            ("day_plans", DayPlanCache()),
+        ):
+            patcher = mock.patch.object(self.app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.app.app.testing = True
+        for cache in (catalog, travel, sharing):
+            cache.invalidate()
+            self.addCleanup(cache.invalidate)
+
+    def client(self, user_id):
+        client = self.app.app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = session["user_id"] = str(user_id)
+            session["_fresh"] = True
+        return client
+
+    def test_every_route_has_a_budget(self):
+        for endpoint, view in self.app.app.view_functions.items():
+            if endpoint != "static":
+                self.assertTrue(hasattr(view, "query_budget"), endpoint)
+
+    def test_routes(self):
+        user_id = self.user_ids[0]
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT shared_by FROM shares INNER JOIN users ON users.email = shares.shared_with_email "
+                + "WHERE users.id = %s",
+                (user_id,),
+            )
+            sharer_ids = [row[0] for row in cur.fetchall()]
+        self.assertGreater(len(sharer_ids), 3)
+        date = str(DATE)
+        day = "/day/{}".format(date)
+        partial = {"X-Partial-Update": "columns"}
+        requests = (
+            ("GET", "/", {}),
+            ("GET", day, {}),
+            ("GET", day + "?boost=lot&walking=allow&hidden=like", {}),
+            (
+                "GET",
+                "/group/{}?with={}".format(date, sharer_ids[0]),
+                {},
+            ),
+            ("GET", "/free/{}".format(date), {}),
+            ("GET", "/free/{}?category=Comedy".format(date), {}),
+            ("GET", "/nearby", {}),
+            ("GET", "/nearby?lat=55.94&long=-3.19", {}),
+            ("GET", "/search?q=synthetic", {}),
+            ("GET", "/like/{}/{}".format(self.show_id, self.performance_id), {}),
+            (
+                "GET",
+                "/love/{}/{}?day={}".format(self.show_id, self.performance_id, date),
+                partial,
+            ),
+            ("GET", "/love/performance/{}".format(self.performance_id), {}),
+            ("GET", "/booked/{}?day={}".format(self.performance_id, date), partial),
+            ("GET", "/unlike/{}".format(self.show_id), {}),
+            ("GET", "/sharing", {}),
+            ("POST", "/sharing", {"share_with_email": "friend@example.com"}),
+            ("GET", "/unshare/friend@example.com", {}),
+            ("GET", "/import", {}),
+            ("GET", "/calendar", {}),
+            ("GET", "/calendar/synthetic-calendar-0.ics", {}),
+            ("GET", "/login", {}),
+            ("POST", "/login", {"email": "user0@example.com", "password": "password"}),
+            ("GET", "/signup", {}),
+            ("GET", "/verify/user0@example.com/wrong", {}),
+            ("GET", "/logout", {}),
+        )
+        client = self.client(user_id)
+        with enforce_budgets():
+            for method, path, extra in requests:
+                with self.subTest(method=method, path=path):
+                    if method == "POST":
+                        response = client.post(path, data=extra)
+                    else:
+                        response = client.get(path, headers=extra)
+                    response.close()
+                    self.assertLess(response.status_code, 400)
+
+    def test_importer(self):
+        header = (
+            "Title\tCategory\tVenue\tDuration\tTimes\tDates\tBook Tickets\tGroup Name"
+        )
+        rows = [header] + [
+            "Budget show {}\tComedy\tVenue 1\t1 hour\t12:00\t10 Aug, 11 Aug\t/whats-on/budget-{}\t".format(
+                i, i
+            )
+            for i in range(150)
+        ]
+        user_id = self.user_ids[1]
+        with mock.patch.object(importer, "check_soldout_for_single_time"):
+            with enforce_budgets():
+                with cursor(self.config) as cur:
+                    importer.import_from_iter(cur, user_id, rows)
+                with cursor(self.config) as cur:
+                    importer.import_from_iter(cur, user_id, rows[:100])
+                with cursor(self.config) as cur:
+                    importer.import_from_iter(cur, user_id, rows[:100])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,221 @@
+import datetime
+import json
+import re
+import unittest
+
+import catalog
+import events
+import groups
+import ical
+import sharing
+from db import cursor
+from editions import Edition, add_edition
+from importer import import_from_iter
+from synthetic import seed_database
+from testdb import (
+    RecordingCursor,
+    recording_statements,
+    reset_database,
+    config_for_tests,
+)
+
+DATE = datetime.date(2019, 8, 12)
+
+
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+# Tables which only ever hold one row, so reading them in full is fine.
+SINGLE_ROW_TABLES = ("catalog_version",)
+
+
+def full_scans(plan, leading_columns):
+    # Yields the tables a plan reads in full: sequential scans, index scans
+    # with no condition, and index scans which don't constrain the first
+    # column of the index and so have to walk all of it.
+    node_type = plan["Node Type"]
+    if plan.get("Relation Name") in SINGLE_ROW_TABLES:
+        pass
+    elif node_type == "Seq Scan":
+        yield plan["Relation Name"]
+    elif node_type in INDEX_SCANS:
+        condition = plan.get("Index Cond", "")
+        leading_column = leading_columns[plan["Index Name"]]
+        if not re.search(
+            r"\((\()?{}(\)::[a-z ]+)? ".format(re.escape(leading_column)), condition
+        ):
+            yield plan["Index Name"]
+    for child in plan.get("Plans", []):
+        yield from full_scans(child, leading_columns)
+
+
+def scanned_relations(plan):
+    if "Relation Name" in plan:
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from scanned_relations(child)
+
+
+class TestQueryPlans(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.config = config_for_tests()
+        reset_database(cls.config)
+        with cursor(cls.config) as cur:
+            cls.user_ids = seed_database(cur, venues=50, shows=500, users=50)
+            cur.execute("ANALYZE")
+            cur.execute(
+                "SELECT performances.id, performances.show_id FROM performances "
+                + "INNER JOIN interests ON interests.show_id = performances.show_id "
+                + "WHERE interests.user_id = %s AND interests.interest != 'Booked' LIMIT 1",
+                (cls.user_ids[0],),
+            )
+            cls.performance_id, cls.show_id = cur.fetchone()
+
+    def assertNoSeqScans(self, statements):
+        self.assertTrue(statements)
+        failures = []
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT index_class.relname, pg_attribute.attname FROM pg_index "
+                + "INNER JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid "
+                + "INNER JOIN pg_attribute ON pg_attribute.attrelid = pg_index.indrelid "
+                + "AND pg_attribute.attnum = pg_index.indkey[0]"
+            )
+            leading_columns = dict(cur.fetchall())
+            # The synthetic dataset is small enough that scanning whole tables
+            # and hashing them is often cheapest, so force the planner to look
+            # every row up through an index if there is any index it could use.
+            cur.execute("SET LOCAL enable_seqscan = off")
+            cur.execute("SET LOCAL enable_hashjoin = off")
+            cur.execute("SET LOCAL enable_mergejoin = off")
+            for statement in statements:
+                cur.execute("EXPLAIN (FORMAT JSON) {}".format(statement))
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                tables = sorted(set(full_scans(plan[0]["Plan"], leading_columns)))
+                if tables:
+                    failures.append(
+                        "Full scan of {} in:\n  {}".format(", ".join(tables), statement)
+                    )
+            cur.connection.rollback()
+        if failures:
+            self.fail("\n".join(failures))
+
+    def explain(self, statements):
+        with cursor(self.config) as cur:
+            for statement in statements:
+                if not statement.startswith("SELECT"):
+                    continue
+                cur.execute("EXPLAIN (FORMAT JSON) {}".format(statement))
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                yield statement, plan[0]["Plan"]
+
+    def test_only_current_edition_read(self):
+        with cursor(self.config) as cur:
+            add_edition(
+                cur,
+                Edition(2018, datetime.date(2018, 8, 3), datetime.date(2018, 8, 27)),
+                make_current=False,
+            )
+            cur.execute(
+                "INSERT INTO performances (show_id, datetime_utc, edition) "
+                + "SELECT show_id, datetime_utc - interval '1 year', 2018 FROM performances"
+            )
+            cur.execute(
+                "INSERT INTO sold_out (performance_id, edition) "
+                + "SELECT id, edition FROM performances WHERE edition = 2018"
+            )
+            cur.execute("ANALYZE")
+        sharing.get_share_graph(self.config)
+        with recording_statements() as statements:
+            events.load_day(self.config, self.user_ids[0], DATE, True)
+            catalog.load_catalog(self.config)
+        reading_performances = 0
+        for statement, plan in self.explain(statements):
+            relations = set(scanned_relations(plan))
+            self.assertNotIn("performances_2018", relations, statement)
+            self.assertNotIn("sold_out_2018", relations, statement)
+            if re.search(r"\b(FROM|JOIN) performances\b", statement):
+                self.assertIn("performances_2019", relations, statement)
+                reading_performances += 1
+        # The sharers' day, the user's day and the catalog.
+        self.assertEqual(3, reading_performances)
+
+    def test_load_day(self):
+        # Shares are read in full once, and then looked up in memory.
+        sharing.get_share_graph(self.config)
+        with recording_statements() as statements:
+            events.load_day(self.config, self.user_ids[0], DATE, True)
+        self.assertNoSeqScans(statements)
+
+    def test_calendar_feed_version(self):
+        with recording_statements() as statements:
+            ical.load_feed_version(self.config, "synthetic-calendar-0")
+        self.assertEqual(1, len(statements))
+        self.assertNoSeqScans(statements)
+
+    def test_share_emails(self):
+        sharing.get_share_graph(self.config)
+        with recording_statements() as statements:
+            sharing.get_share_emails(self.config, self.user_ids[0])
+        self.assertEqual([], statements)
+
+    def test_interest_changes(self):
+        user_id = self.user_ids[1]
+        with recording_statements() as statements:
+            events.set_interest(self.config, user_id, self.show_id, "Must")
+            events.set_performance_interest(
+                self.config, user_id, self.performance_id, "Must"
+            )
+            events.unset_performance_interest(
+                self.config, user_id, performance_id=self.performance_id
+            )
+            events.mark_booked(self.config, user_id, self.performance_id)
+            events.unset_performance_interest(
+                self.config, user_id, show_id=self.show_id
+            )
+            events.remove_interest(self.config, user_id, self.show_id)
+        self.assertNoSeqScans(statements)
+
+    def test_group_performances(self):
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT shares.shared_by, users.id FROM shares "
+                + "INNER JOIN users ON users.email = shares.shared_with_email LIMIT 1"
+            )
+            group = cur.fetchone()
+        with recording_statements() as statements:
+            groups.find_group_performances(self.config, group)
+        self.assertNoSeqScans(statements)
+
+    def test_import(self):
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT shows.title, shows.category, venues.name, shows.edfringe_url FROM shows "
+                + "INNER JOIN venues ON venues.id = shows.venue_id ORDER BY shows.id LIMIT 20"
+            )
+            shows = cur.fetchall()
+        rows = [
+            "Title\tCategory\tVenue\tDuration\tTimes\tDates\tBook Tickets\tGroup Name"
+        ] + ["{}\t{}\t{}\t1 hour\t12:00\t10 Aug\t{}\t".format(*show) for show in shows]
+        with cursor(self.config) as cur:
+            RecordingCursor.statements = []
+            recording_cur = cur.connection.cursor(cursor_factory=RecordingCursor)
+            import_from_iter(recording_cur, self.user_ids[2], rows)
+            statements = RecordingCursor.statements
+        self.assertNoSeqScans(statements)
+
+        with cursor(self.config) as cur:
+            RecordingCursor.statements = []
+            recording_cur = cur.connection.cursor(cursor_factory=RecordingCursor)
+            import_from_iter(recording_cur, self.user_ids[2], rows)
+            statements = RecordingCursor.statements
+        self.assertEqual(1, len(statements))
+        self.assertNoSeqScans(statements)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import datetime
+import statistics
+import sys
+import time
+
+from edfringeplanner import (
+    HOUR_HEIGHT_PX,
+    app,
+    day_url,
+    render_column,
+    render_day_page,
+    render_template,
+)
+from events import Filter, bin_pack_events
+from fragments import EventCardCache
+from synthetic import make_events
+
+DATE = datetime.date(2019, 8, 10)
+
+
+def page_arguments(first_hour, number_of_hours):
+    return dict(
+        date=DATE,
+        date_yyyymmdd=DATE.strftime("%Y-%m-%d"),
+        first_hour=first_hour,
+        number_of_hours=number_of_hours,
+        hour_height_px=HOUR_HEIGHT_PX,
+        url_hiding=lambda s: day_url(hiding=s),
+        url_showing=lambda s: day_url(showing=s),
+        display_filter=Filter.show_all(),
+        shared_boost="none",
+        walking="none",
+        start_at=None,
+        end_at=None,
+    )
+
+
+def time_buffered_render(event_columns, first_hour, number_of_hours):
+    # The page as it was rendered before cards were cached and columns were
+    # streamed: one render_template of the whole page, rendering every card,
+    # so that nothing can be sent until all of it has been.
+    uncached = EventCardCache(app.jinja_env, maxsize=0)
+    arguments = page_arguments(first_hour, number_of_hours)
+    with app.test_request_context("/day/{}".format(DATE)):
+        start = time.perf_counter()
+        render_template(
+            "one_day.html",
+            event_columns=event_columns,
+            render_column=lambda column: render_column(
+                column, HOUR_HEIGHT_PX, arguments["url_hiding"], uncached
+            ),
+            flush=lambda: "",
+            **arguments,
+        )
+        total = time.perf_counter() - start
+    return total, total
+
+
+def time_render(event_columns, first_hour, number_of_hours, cards):
+    with app.test_request_context("/day/{}".format(DATE)):
+        start = time.perf_counter()
+        response = render_day_page(
+            DATE,
+            event_columns,
+            first_hour,
+            number_of_hours,
+            display_filter=Filter.show_all(),
+            shared_boost="none",
+            walking="none",
+            start_at=None,
+            end_at=None,
+            cards=cards,
+        )
+        chunks = iter(response.response)
+        next(chunks)
+        first_byte = time.perf_counter() - start
+        for _ in chunks:
+            pass
+        total = time.perf_counter() - start
+    return first_byte, total
+
+
+def report(name, timings):
+    first_bytes = sorted(first_byte for first_byte, _ in timings)
+    totals = sorted(total for _, total in timings)
+    print(
+        "{:<32} first byte p50 {:7.2f}ms   total p50 {:7.2f}ms p99 {:7.2f}ms".format(
+            name,
+            1000 * statistics.median(first_bytes),
+            1000 * statistics.median(totals),
+            1000 * totals[int(len(totals) * 0.99) - 1],
+        )
+    )
+
+
+def main():
+    number_of_events = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    events = make_events(datetime.date(2019, 8, 10), number_of_events)
+    event_columns, first_hour, number_of_hours = bin_pack_events(events, "none")
+    print(
+        "{} events in {} columns, {} iterations".format(
+            len(events), len(event_columns), iterations
+        )
+    )
+
+    time_buffered_render(event_columns, first_hour, number_of_hours)
+    buffered_timings = [
+        time_buffered_render(event_columns, first_hour, number_of_hours)
+        for _ in range(iterations)
+    ]
+    report("uncached, buffered", buffered_timings)
+
+    cached = EventCardCache(app.jinja_env)
+    time_render(event_columns, first_hour, number_of_hours, cached)
+    cached_timings = [
+        time_render(event_columns, first_hour, number_of_hours, cached)
+        for _ in range(iterations)
+    ]
+    report("cached cards, streamed", cached_timings)
+
+
+if __name__ == "__main__":
+    main()
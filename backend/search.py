@@ -0,0 +1,333 @@
+import datetime
+import heapq
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sortedcontainers import SortedKeyList, SortedSet
+
+import catalog
+from catalog import CatalogPerformance, CatalogShow, CatalogVenue
+from db import cursor
+
+# How much a match in each field counts towards a show's score.
+FIELD_WEIGHTS = (("title", 3.0), ("venue", 2.0), ("category", 1.0))
+
+PREFIX_MATCH = 0.8
+FUZZY_MATCH = 0.6
+# Tokens sharing fewer trigrams than this (as a fraction of their combined
+# trigrams) with a query token aren't considered a fuzzy match for it.
+MIN_SIMILARITY = 0.4
+MAX_PREFIX_MATCHES = 50
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    # Lowercases and strips accents, so "Ceòl" is found by "ceol".
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    return _TOKEN.findall(
+        "".join(c for c in normalized if not unicodedata.combining(c))
+    )
+
+
+def trigrams(token: str) -> frozenset:
+    padded = "  {} ".format(token)
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+@dataclass(frozen=True)
+class SearchResult:
+    show: CatalogShow
+    venue: Optional[CatalogVenue]
+    score: float
+    next_performances: Tuple[CatalogPerformance, ...]
+
+
+class SearchIndex:
+    # An inverted index from tokens in each show's title, category and venue
+    # name to the shows, plus a trigram index over the tokens for misspelt
+    # queries. Shows and performances can be added, replaced and removed one
+    # at a time.
+
+    def __init__(self):
+        self.shows: Dict[int, CatalogShow] = {}
+        self.venues: Dict[int, CatalogVenue] = {}
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._vocabulary = SortedSet()
+        self._trigrams: Dict[str, set] = defaultdict(set)
+        self._show_tokens: Dict[int, Dict[str, float]] = {}
+        self._shows_by_venue: Dict[int, set] = defaultdict(set)
+        self._performances: Dict[int, SortedKeyList] = {}
+        self._performance_show_ids: Dict[int, int] = {}
+
+    @staticmethod
+    def from_catalog(source: catalog.Catalog):
+        # Copies every row, even from a mapped snapshot, as the index is then
+        # changed in place; each process has its own.
+        index = SearchIndex()
+        index.venues = dict(source.venues)
+        for show in source.shows.values():
+            index.put_show(show)
+        for performance in source.performances:
+            index.put_performance(performance)
+        return index
+
+    def put_venue(self, venue: CatalogVenue):
+        self.venues[venue.id] = venue
+        for show_id in list(self._shows_by_venue[venue.id]):
+            self.put_show(self.shows[show_id])
+
+    def put_show(self, show: CatalogShow):
+        self.remove_show(show.id, keep_performances=True)
+        venue = self.venues.get(show.venue_id)
+        fields = {
+            "title": show.title or "",
+            "category": show.category or "",
+            "venue": venue.name if venue is not None and venue.name else "",
+        }
+        weights = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS:
+            for token in set(tokenize(fields[field])):
+                weights[token] = max(weights[token], weight)
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                self._vocabulary.add(token)
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].add(token)
+            postings[show.id] = weight
+        self.shows[show.id] = show
+        self._show_tokens[show.id] = weights
+        self._shows_by_venue[show.venue_id].add(show.id)
+
+    def remove_show(self, show_id, keep_performances=False):
+        show = self.shows.pop(show_id, None)
+        if show is None:
+            return
+        self._shows_by_venue[show.venue_id].discard(show_id)
+        for token in self._show_tokens.pop(show_id):
+            postings = self._postings[token]
+            del postings[show_id]
+            if not postings:
+                del self._postings[token]
+                self._vocabulary.discard(token)
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].discard(token)
+        if not keep_performances:
+            for performance in self._performances.pop(show_id, ()):
+                del self._performance_show_ids[performance.id]
+
+    def put_performance(self, performance: CatalogPerformance):
+        self.remove_performance(performance.id)
+        performances = self._performances.get(performance.show_id)
+        if performances is None:
+            performances = self._performances[performance.show_id] = SortedKeyList(
+                key=lambda performance: (performance.datetime_utc, performance.id)
+            )
+        performances.add(performance)
+        self._performance_show_ids[performance.id] = performance.show_id
+
+    def remove_performance(self, performance_id):
+        show_id = self._performance_show_ids.pop(performance_id, None)
+        if show_id is None:
+            return
+        performances = self._performances[show_id]
+        for performance in performances:
+            if performance.id == performance_id:
+                performances.remove(performance)
+                break
+
+    def next_performances(self, show_id, now, limit) -> Tuple[CatalogPerformance]:
+        performances = self._performances.get(show_id)
+        if performances is None:
+            return ()
+        upcoming = performances.irange_key(min_key=(now, 0))
+        return tuple(performance for _, performance in zip(range(limit), upcoming))
+
+    def search(
+        self, query: str, now: datetime.datetime, limit=20, performances=3
+    ) -> List[SearchResult]:
+        # Every word in the query has to match (exactly, as a prefix, or
+        # fuzzily) some word in the show's title, category or venue.
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return []
+        scores = None
+        for query_token in query_tokens:
+            token_scores = defaultdict(float)
+            for token, match in self._matching_tokens(query_token):
+                for show_id, weight in self._postings[token].items():
+                    score = match * weight
+                    if score > token_scores[show_id]:
+                        token_scores[show_id] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    show_id: score + token_scores[show_id]
+                    for show_id, score in scores.items()
+                    if show_id in token_scores
+                }
+            if not scores:
+                return []
+
+        ranked = heapq.nsmallest(
+            limit,
+            scores.items(),
+            key=lambda item: (-item[1], self.shows[item[0]].title or "", item[0]),
+        )
+        return [
+            SearchResult(
+                show=self.shows[show_id],
+                venue=self.venues.get(self.shows[show_id].venue_id),
+                score=score,
+                next_performances=self.next_performances(show_id, now, performances),
+            )
+            for show_id, score in ranked
+        ]
+
+    def _matching_tokens(self, query_token) -> Iterable[Tuple[str, float]]:
+        if query_token in self._postings:
+            yield query_token, 1.0
+        prefix_matches = 0
+        for token in self._vocabulary.irange(minimum=query_token):
+            if not token.startswith(query_token):
+                break
+            if token != query_token:
+                yield token, PREFIX_MATCH
+                prefix_matches += 1
+                if prefix_matches >= MAX_PREFIX_MATCHES:
+                    break
+        if query_token in self._postings or prefix_matches or len(query_token) < 3:
+            return
+        query_trigrams = trigrams(query_token)
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for token in self._trigrams.get(trigram, ()):
+                shared[token] += 1
+        for token, count in shared.items():
+            similarity = count / (len(query_trigrams) + len(trigrams(token)) - count)
+            if similarity >= MIN_SIMILARITY:
+                yield token, FUZZY_MATCH * similarity
+
+
+class ShowSearch:
+    # Keeps a SearchIndex of the catalog up to date with change notifications,
+    # re-reading just the rows which changed.
+
+    def __init__(self, config):
+        self.config = config
+        self._index = None
+        # The catalog version the index was built at, or None once it's been
+        # updated since.
+        self._version = None
+        self._lock = threading.Lock()
+
+    def index(self) -> SearchIndex:
+        with self._lock:
+            if self._index is None:
+                source = catalog.get_catalog(self.config)
+                self._index = SearchIndex.from_catalog(source)
+                self._version = source.version
+            return self._index
+
+    def search(self, query, now, limit=20, performances=3) -> List[SearchResult]:
+        index = self.index()
+        with self._lock:
+            return index.search(query, now, limit=limit, performances=performances)
+
+    def on_venues(self, rows):
+        self._refresh(rows, self._refresh_venues, "id")
+
+    def on_shows(self, rows):
+        self._refresh(rows, self._refresh_shows, "id")
+
+    def on_performances(self, rows):
+        self._refresh(rows, self._refresh_performances, "id")
+
+    def on_sold_out(self, rows):
+        self._refresh(rows, self._refresh_performances, "performance_id")
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._version = None
+
+    def invalidate_if_stale(self):
+        version = self._version
+        if version is not None and version == catalog.load_catalog_version(self.config):
+            return
+        self.invalidate()
+
+    def _refresh(self, rows, refresh, id_column):
+        if rows is None:
+            self.invalidate_if_stale()
+            return
+        if self._index is None:
+            return
+        ids = sorted({row[id_column] for row in rows})
+        with cursor(self.config) as cur:
+            apply = refresh(cur, ids)
+        with self._lock:
+            if self._index is not None:
+                apply(self._index)
+                self._version = None
+
+    @staticmethod
+    def _refresh_venues(cur, venue_ids):
+        cur.execute(
+            "SELECT id, name, address, latlong[0], latlong[1] FROM venues WHERE id = ANY(%s)",
+            (venue_ids,),
+        )
+        venues = [CatalogVenue(*row) for row in cur.fetchall()]
+
+        def apply(index):
+            for venue in venues:
+                index.put_venue(venue)
+
+        return apply
+
+    @staticmethod
+    def _refresh_shows(cur, show_ids):
+        cur.execute(
+            "SELECT shows.id, shows.title, shows.category, shows.venue_id, shows.duration, shows.edfringe_url, "
+            + "venues.id, venues.name, venues.address, venues.latlong[0], venues.latlong[1] "
+            + "FROM shows LEFT JOIN venues ON venues.id = shows.venue_id WHERE shows.id = ANY(%s)",
+            (show_ids,),
+        )
+        rows = cur.fetchall()
+
+        def apply(index):
+            for row in rows:
+                if row[6] is not None and row[6] not in index.venues:
+                    index.venues[row[6]] = CatalogVenue(*row[6:])
+                index.put_show(CatalogShow(*row[:6]))
+            for show_id in set(show_ids) - {row[0] for row in rows}:
+                index.remove_show(show_id)
+
+        return apply
+
+    @staticmethod
+    def _refresh_performances(cur, performance_ids):
+        cur.execute(
+            "SELECT performances.id, performances.show_id, performances.datetime_utc, sold_out.id IS NOT NULL "
+            + "FROM performances LEFT JOIN sold_out ON sold_out.performance_id = performances.id AND sold_out.edition = performances.edition "
+            + "WHERE performances.id = ANY(%s) AND performances.edition = current_edition()",
+            (performance_ids,),
+        )
+        performances = [CatalogPerformance(*row) for row in cur.fetchall()]
+
+        def apply(index):
+            for performance in performances:
+                index.put_performance(performance)
+            for performance_id in set(performance_ids) - {
+                performance.id for performance in performances
+            }:
+                index.remove_performance(performance_id)
+
+        return apply
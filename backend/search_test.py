@@ -0,0 +1,228 @@
+import datetime
+import random
+import statistics
+import time
+import unittest
+from unittest import mock
+
+import pytz
+
+import catalog
+import importer
+from catalog import CatalogPerformance, CatalogShow, CatalogVenue
+from changes import ChangeListener
+from db import cursor
+from search import SearchIndex, ShowSearch, tokenize
+from synthetic import CATEGORIES, FESTIVAL_START, seed_database
+from testdb import config_for_tests, reset_database
+
+NOW = pytz.utc.localize(datetime.datetime(2019, 8, 10, 12))
+
+WORDS = (
+    "love lost found night dream ghost king queen river city stand up comedy "
+    + "hamlet macbeth cabaret songs stories tales murder mystery magic circus "
+    + "dance jazz folk opera late hour improv sketch family kids puppet dark "
+    + "light house garden secret letter journey wild blue golden silver iron"
+).split()
+
+
+def make_catalog(shows, seed=0):
+    rng = random.Random(seed)
+    venues = {
+        i: CatalogVenue(
+            i, "{} Venue {}".format(rng.choice(WORDS).title(), i), "", None, None
+        )
+        for i in range(1, 301)
+    }
+    catalog_shows = {}
+    performances = []
+    for show_id in range(1, shows + 1):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randrange(2, 6))).title()
+        catalog_shows[show_id] = CatalogShow(
+            show_id,
+            title,
+            rng.choice(CATEGORIES),
+            rng.choice(list(venues)),
+            datetime.timedelta(hours=1),
+            "/whats-on/{}".format(show_id),
+        )
+        start = pytz.utc.localize(datetime.datetime(2019, 8, 2, rng.randrange(9, 22)))
+        for day in range(20):
+            performances.append(
+                CatalogPerformance(
+                    show_id * 100 + day,
+                    show_id,
+                    start + datetime.timedelta(days=day),
+                    rng.random() < 0.05,
+                )
+            )
+    performances.sort(key=lambda performance: performance.datetime_utc)
+    return catalog.Catalog(
+        version=0, venues=venues, shows=catalog_shows, performances=performances
+    )
+
+
+def show(show_id, title, category="Comedy", venue_id=1):
+    return CatalogShow(
+        show_id, title, category, venue_id, datetime.timedelta(hours=1), "/whats-on/x"
+    )
+
+
+class TestTokenize(unittest.TestCase):
+    def test_tokenize(self):
+        self.assertEqual(
+            ["ceol", "agus", "orain", "2019"], tokenize("Ceòl agus Òrain: 2019!")
+        )
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.venues = {
+            1: CatalogVenue(1, "Pleasance Courtyard", "", None, None),
+            2: CatalogVenue(2, "Hamlet Hall", "", None, None),
+        }
+        self.index.put_show(show(1, "Hamlet", "Theatre", 1))
+        self.index.put_show(show(2, "Stand-up Hour", "Comedy", 2))
+        self.index.put_show(show(3, "Hamster Wheel", "Comedy", 1))
+
+    def search_ids(self, query):
+        return [result.show.id for result in self.index.search(query, NOW)]
+
+    def test_title_outranks_venue(self):
+        self.assertEqual([1, 2], self.search_ids("hamlet"))
+
+    def test_prefix(self):
+        self.assertEqual([3], self.search_ids("hamst"))
+
+    def test_fuzzy(self):
+        self.assertEqual(1, self.search_ids("hamlett")[0])
+
+    def test_every_word_must_match(self):
+        self.assertEqual([2], self.search_ids("comedy hour"))
+        self.assertEqual([], self.search_ids("hamlet jazz"))
+
+    def test_category_and_venue(self):
+        self.assertEqual([1, 3], self.search_ids("pleasance"))
+        self.assertEqual([3, 2], self.search_ids("comedy"))
+
+    def test_remove_show(self):
+        self.index.remove_show(3)
+        self.assertEqual([], self.search_ids("hamster"))
+        self.assertNotIn("hamster", self.index._vocabulary)
+
+    def test_replace_show(self):
+        self.index.put_show(show(3, "Gerbil Wheel", "Comedy", 1))
+        self.assertEqual([], self.search_ids("hamster"))
+        self.assertEqual([3], self.search_ids("gerbil"))
+
+    def test_rename_venue(self):
+        self.index.put_venue(CatalogVenue(2, "Assembly Rooms", "", None, None))
+        self.assertEqual([1], self.search_ids("hamlet"))
+        self.assertEqual([2], self.search_ids("assembly"))
+
+    def test_next_performances(self):
+        for day in range(5):
+            self.index.put_performance(
+                CatalogPerformance(
+                    10 + day, 1, NOW + datetime.timedelta(days=day - 2), False
+                )
+            )
+        self.index.put_performance(
+            CatalogPerformance(13, 1, NOW + datetime.timedelta(days=10), True)
+        )
+        self.index.remove_performance(11)
+        result = self.index.search("hamlet", NOW, performances=2)[0]
+        self.assertEqual([12, 14], [p.id for p in result.next_performances])
+        result = self.index.search("hamlet", NOW, performances=5)[0]
+        self.assertEqual([12, 14, 13], [p.id for p in result.next_performances])
+
+    def test_fast_at_five_thousand_shows(self):
+        index = SearchIndex.from_catalog(make_catalog(5000))
+        queries = ["hamlet", "ham", "ghost king", "comedy night", "mistery", "q"]
+        timings = []
+        for _ in range(20):
+            for query in queries:
+                start = time.perf_counter()
+                index.search(query, NOW)
+                timings.append(time.perf_counter() - start)
+        self.assertLess(statistics.median(timings), 0.01)
+
+
+class TestShowSearch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.config = config_for_tests()
+        reset_database(cls.config)
+        with cursor(cls.config) as cur:
+            cls.user_ids = seed_database(cur, venues=5, shows=50, users=1)
+            cur.execute("SELECT name FROM venues ORDER BY id LIMIT 1")
+            cls.venue_name = cur.fetchone()[0]
+
+    def setUp(self):
+        catalog.invalidate()
+        self.search = ShowSearch(self.config)
+        self.listener = ChangeListener(self.config)
+        self.listener.on("venues", self.search.on_venues)
+        self.listener.on("shows", self.search.on_shows)
+        self.listener.on("performances", self.search.on_performances)
+        self.listener.on("sold_out", self.search.on_sold_out)
+        self.search.index()
+        self.listener.start()
+        self.assertTrue(self.listener.wait_until_listening(5))
+
+    def tearDown(self):
+        self.listener.stop()
+        catalog.invalidate()
+
+    def wait_for(self, query, predicate):
+        deadline = time.monotonic() + 5
+        while True:
+            results = self.search.search(query, NOW)
+            if predicate(results) or time.monotonic() > deadline:
+                return results
+            time.sleep(0.01)
+
+    def test_index_is_kept_when_nothing_has_changed(self):
+        index = self.search.index()
+        self.search.on_shows(None)
+        self.assertIs(index, self.search.index())
+
+    def test_imported_shows_are_indexed_incrementally(self):
+        index = self.search.index()
+        rows = [
+            "Title\tCategory\tVenue\tDuration\tTimes\tDates\tBook Tickets\tGroup Name",
+            "Quixotic Quartet\tMusic\t{}\t1 hour\t21:00\t11 Aug, 12 Aug\t/whats-on/quixotic\t".format(
+                self.venue_name
+            ),
+        ]
+        with mock.patch.object(importer, "check_soldout_for_single_time"):
+            with cursor(self.config) as cur:
+                importer.import_from_iter(cur, self.user_ids[0], rows)
+
+        results = self.wait_for(
+            "quixotic",
+            lambda results: results and len(results[0].next_performances) == 2,
+        )
+        self.assertEqual(
+            ["Quixotic Quartet"], [result.show.title for result in results]
+        )
+        self.assertEqual(
+            [datetime.date(2019, 8, 11), datetime.date(2019, 8, 12)],
+            [p.datetime_utc.date() for p in results[0].next_performances],
+        )
+        self.assertIs(index, self.search.index())
+
+        with cursor(self.config) as cur:
+            cur.execute(
+                "INSERT INTO sold_out (performance_id) VALUES (%s)",
+                (results[0].next_performances[0].id,),
+            )
+        results = self.wait_for(
+            "quixotic", lambda results: results[0].next_performances[0].sold_out
+        )
+        self.assertTrue(results[0].next_performances[0].sold_out)
+
+
+if __name__ == "__main__":
+    unittest.main()
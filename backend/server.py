@@ -0,0 +1,98 @@
+import gc
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from gunicorn.app.base import BaseApplication
+
+import catalog
+import db
+import travel
+from edfringeplanner import app, change_listener, config, mail_sender, show_search
+
+logger = logging.getLogger("gunicorn.error")
+
+_started_at = time.perf_counter()
+
+
+@contextmanager
+def timed(timings, name):
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+
+def preload(config):
+    # Loads everything workers can share, once, in the parent. Workers are
+    # forked with it already in memory, and share those pages with the parent
+    # until they write to them.
+    timings = {}
+    with timed(timings, "catalog"):
+        catalog.get_catalog(config)
+    with timed(timings, "travel times"):
+        travel.get_travel_times(config)
+    with timed(timings, "search index"):
+        show_search.index()
+    with timed(timings, "templates"):
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+    # Connections can't be shared with workers, which open their own.
+    db.close_pool()
+    # Everything alive now lives as long as the process. Freezing it stops the
+    # garbage collector in each worker writing to (and so copying) every page
+    # it's on.
+    with timed(timings, "gc"):
+        gc.collect()
+        gc.freeze()
+    return timings
+
+
+def post_fork(server, worker):
+    db.open_pool(config, maxconn=config.threads)
+    # Only changes made since the catalog was loaded cause it to be reloaded.
+    change_listener.start()
+    mail_sender.start()
+    logger.info(
+        "Worker %s ready %.0fms after startup",
+        os.getpid(),
+        1000 * (time.perf_counter() - _started_at),
+    )
+
+
+def when_ready(server):
+    logger.info(
+        "Ready to serve %s with %s workers of %s threads, %.0fms after startup",
+        config.bind,
+        config.workers,
+        config.threads,
+        1000 * (time.perf_counter() - _started_at),
+    )
+
+
+class Server(BaseApplication):
+    def __init__(self, config):
+        self.config = config
+        super().__init__()
+
+    def load_config(self):
+        self.cfg.set("bind", self.config.bind)
+        self.cfg.set("workers", self.config.workers)
+        self.cfg.set("threads", self.config.threads)
+        self.cfg.set("preload_app", True)
+        self.cfg.set("post_fork", post_fork)
+        self.cfg.set("when_ready", when_ready)
+
+    def load(self):
+        timings = preload(self.config)
+        for name, seconds in timings.items():
+            logger.info("Preloaded %s in %.0fms", name, 1000 * seconds)
+        return app
+
+
+def main():
+    Server(config).run()
+
+
+if __name__ == "__main__":
+    main()
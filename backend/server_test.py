@@ -0,0 +1,147 @@
+import dataclasses
+import datetime
+import gc
+import json
+import os
+import tempfile
+import unittest
+
+import catalog
+import db
+import travel
+from synthetic import FESTIVAL_START, seed_database
+from testdb import config_for_tests, reset_database
+
+
+def memory_kb():
+    memory = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == "kB":
+                memory[fields[0].rstrip(":")] = int(fields[1])
+    return memory
+
+
+class TestPreforkServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        if not os.path.exists("/proc/self/smaps_rollup"):
+            raise unittest.SkipTest("Needs /proc/self/smaps_rollup")
+        cls.cache_dir = tempfile.TemporaryDirectory()
+        cls.config = dataclasses.replace(
+            config_for_tests(), cache_dir=cls.cache_dir.name
+        )
+        reset_database(cls.config)
+        with db.cursor(cls.config) as cur:
+            cls.user_ids = seed_database(cur, users=5)
+
+        # The app reads its config from the environment when it's imported.
+        for name, value in (
+            ("EDFRINGEPLANNER_DB_NAME", cls.config.database_name),
+            ("EDFRINGEPLANNER_SESSION_KEY", cls.config.session_key),
+            ("EDFRINGEPLANNER_MAILGUN_DOMAIN", cls.config.mailgun_domain),
+            ("EDFRINGEPLANNER_MAILGUN_KEY", cls.config.mailgun_key),
+            ("EDFRINGEPLANNER_DOMAIN_PREFIX", cls.config.domain_prefix),
+        ):
+            os.environ.setdefault(name, value)
+        import server
+
+        cls.server = server
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cache_dir.cleanup()
+
+    def tearDown(self):
+        gc.unfreeze()
+        catalog.invalidate()
+        travel.invalidate()
+
+    def run_in_worker(self, work):
+        # Forks, as the server does, and returns what work returned in the
+        # child.
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                result = {"result": work()}
+            except BaseException as e:
+                result = {"error": repr(e)}
+            with os.fdopen(write_fd, "w") as f:
+                json.dump(result, f)
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            result = json.load(f)
+        os.waitpid(pid, 0)
+        self.assertNotIn("error", result)
+        return result["result"]
+
+    def test_preloaded_state_stays_shared(self):
+        self.server.preload(self.config)
+
+        def collect_garbage():
+            before = memory_kb()
+            gc.collect()
+            after = memory_kb()
+            return {
+                "shared": before["Shared_Clean"] + before["Shared_Dirty"],
+                "copied": after["Private_Dirty"] - before["Private_Dirty"],
+            }
+
+        memory = self.run_in_worker(collect_garbage)
+        # Without gc.freeze the collector writes to every object it tracks,
+        # copying around 40% of the parent's memory into the worker.
+        self.assertLess(memory["copied"], memory["shared"] * 0.1, memory)
+
+    def test_first_request_is_warm(self):
+        self.server.preload(self.config)
+        config = self.config
+        user_id = self.user_ids[0]
+
+        def first_request():
+            import edfringeplanner
+
+            edfringeplanner.config = config
+            edfringeplanner.change_listener.config = config
+            edfringeplanner.day_loader.config = config
+            db.open_pool(config, maxconn=2)
+
+            loads = []
+            compile_template = edfringeplanner.app.jinja_env.compile
+
+            def compile_counting(*args, **kwargs):
+                loads.append("template")
+                return compile_template(*args, **kwargs)
+
+            edfringeplanner.app.jinja_env.compile = compile_counting
+            load_travel_times = travel.load_travel_times
+
+            def load_travel_times_counting(config):
+                loads.append("travel times")
+                return load_travel_times(config)
+
+            travel.load_travel_times = load_travel_times_counting
+
+            client = edfringeplanner.app.test_client()
+            with client.session_transaction() as session:
+                session["_user_id"] = session["user_id"] = str(user_id)
+                session["_fresh"] = True
+            date = FESTIVAL_START + datetime.timedelta(days=7)
+            response = client.get("/day/{}?walking=allow".format(date))
+            return {
+                "status": response.status_code,
+                "body": len(response.get_data()),
+                "loads": loads,
+            }
+
+        response = self.run_in_worker(first_request)
+        self.assertEqual(200, response["status"])
+        self.assertGreater(response["body"], 0)
+        self.assertEqual([], response["loads"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,7 @@
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
 from db import cursor
 
 
@@ -7,6 +11,7 @@ def share(config, *, shared_by, shared_with_email):
             "INSERT INTO shares (shared_by, shared_with_email) VALUES (%s, %s) ON CONFLICT DO NOTHING",
             (shared_by, shared_with_email),
         )
+    invalidate()
 
 
 def unshare(config, *, shared_by, shared_with_email):
@@ -15,35 +20,118 @@ def unshare(config, *, shared_by, shared_with_email):
             "DELETE FROM shares WHERE shared_by = %s AND shared_with_email = %s",
             (shared_by, shared_with_email),
         )
+    invalidate()
 
 
-def get_shared_by_user_ids_and_emails(config, user_id):
-    with cursor(config) as cur:
-        cur.execute("SELECT email FROM users WHERE id = %s", (user_id,))
-        row = cur.fetchone()
-        if row is None:
-            raise ValueError("Couldn't find email address for user {}".format(user_id))
-        user_email = row[0]
+@dataclass(frozen=True)
+class ShareGraph:
+    # Both directions of every share, so that either is a dictionary lookup.
+    # Shares with emails which don't have an account yet only appear in
+    # shared_with, until someone signs up with them; see
+    # schema/migrations/0007_share_recipient_ids.sql.
 
-        cur.execute(
-            "SELECT users.id, users.email FROM users INNER JOIN shares ON users.id = shares.shared_by WHERE shares.shared_with_email = %s ORDER BY users.email ASC",
-            (user_email,),
-        )
+    # Recipient user ID to the (user ID, email) of each user sharing with
+    # them, sorted by email.
+    shared_by: Dict[int, Tuple[Tuple[int, str], ...]]
+    # Sharer user ID to the (email, user ID or None) of each recipient, sorted
+    # by email.
+    shared_with: Dict[int, Tuple[Tuple[str, Optional[int]], ...]]
 
-        return [(row[0], row[1]) for row in cur.fetchall()]
 
+# Every share, with the sharer's email.
+SHARES_QUERY = (
+    "SELECT shares.shared_by, users.email, shares.shared_with_email, shares.shared_with_user_id "
+    + "FROM shares INNER JOIN users ON users.id = shares.shared_by"
+)
 
-def get_share_emails(config, user_id):
-    with cursor(config) as cur:
-        cur.execute(
-            "SELECT shared_with_email FROM shares WHERE shared_by = %s ORDER BY shared_with_email ASC",
-            (user_id,),
+
+def share_graph_from_rows(rows) -> ShareGraph:
+    shared_by = {}
+    shared_with = {}
+    for (
+        shared_by_user_id,
+        shared_by_email,
+        shared_with_email,
+        shared_with_user_id,
+    ) in rows:
+        if shared_with_user_id is not None:
+            shared_by.setdefault(shared_with_user_id, []).append(
+                (shared_by_user_id, shared_by_email)
+            )
+        shared_with.setdefault(shared_by_user_id, []).append(
+            (shared_with_email, shared_with_user_id)
         )
+    return ShareGraph(
+        shared_by={
+            user_id: tuple(sorted(sharers, key=lambda sharer: sharer[1]))
+            for user_id, sharers in shared_by.items()
+        },
+        shared_with={
+            user_id: tuple(sorted(recipients))
+            for user_id, recipients in shared_with.items()
+        },
+    )
+
+
+def load_share_graph(config) -> ShareGraph:
+    with cursor(config) as cur:
+        cur.execute(SHARES_QUERY)
+        return share_graph_from_rows(cur.fetchall())
+
 
-        shared_with_user = [row[0] for row in cur.fetchall()]
+_share_graph = None
+# Bumped by every invalidation, so that a graph loaded from before a change
+# isn't cached after it.
+_generation = 0
+_share_graph_lock = threading.Lock()
+# Called by every invalidation, for caches built from the share graph.
+_on_invalidate: List[Callable[[], None]] = []
 
-        shared_by_ids_and_emails = get_shared_by_user_ids_and_emails(config, user_id)
 
-        shared_by_user = [email for id, email in shared_by_ids_and_emails]
+def get_share_graph(config) -> ShareGraph:
+    # The lock isn't held while loading, so concurrent misses may each load
+    # the graph, but only one from after the latest change is kept.
+    graph, generation = cached_share_graph()
+    if graph is None:
+        graph = load_share_graph(config)
+        store_share_graph(graph, generation)
+    return graph
 
-        return shared_by_user, shared_with_user
+
+def cached_share_graph() -> Tuple[Optional[ShareGraph], int]:
+    # For loaders which can't use get_share_graph's connection: the cached
+    # graph if there is one, and the generation to pass to store_share_graph
+    # with a newly loaded one.
+    with _share_graph_lock:
+        return _share_graph, _generation
+
+
+def store_share_graph(graph: ShareGraph, generation: int):
+    global _share_graph
+    with _share_graph_lock:
+        if generation == _generation:
+            _share_graph = graph
+
+
+def on_invalidate(callback: Callable[[], None]):
+    _on_invalidate.append(callback)
+
+
+def invalidate():
+    global _share_graph, _generation
+    with _share_graph_lock:
+        _generation += 1
+        _share_graph = None
+    for callback in _on_invalidate:
+        callback()
+
+
+def get_shared_by_user_ids_and_emails(config, user_id) -> List[Tuple[int, str]]:
+    return list(get_share_graph(config).shared_by.get(user_id, ()))
+
+
+def get_share_emails(config, user_id):
+    graph = get_share_graph(config)
+    shared_by_user = [email for _, email in graph.shared_by.get(user_id, ())]
+    shared_with_user = [email for email, _ in graph.shared_with.get(user_id, ())]
+    return shared_by_user, shared_with_user
@@ -0,0 +1,131 @@
+import time
+import unittest
+from unittest import mock
+
+import sharing
+from changes import ChangeListener
+from db import cursor
+from synthetic import seed_database
+from testdb import config_for_tests, recording_statements, reset_database
+
+
+class TestSharing(unittest.TestCase):
+    def setUp(self):
+        self.config = config_for_tests()
+        reset_database(self.config)
+        with cursor(self.config) as cur:
+            self.user_ids = seed_database(
+                cur, venues=1, shows=1, users=3, interests_per_user=0, shares_per_user=0
+            )
+        self.addCleanup(sharing.invalidate)
+
+    def test_share_and_unshare(self):
+        first, second, third = self.user_ids
+        sharing.share(
+            self.config, shared_by=first, shared_with_email="user1@example.com"
+        )
+        sharing.share(
+            self.config, shared_by=third, shared_with_email="user1@example.com"
+        )
+        sharing.share(self.config, shared_by=first, shared_with_email="new@example.com")
+
+        self.assertEqual(
+            [(first, "user0@example.com"), (third, "user2@example.com")],
+            sharing.get_shared_by_user_ids_and_emails(self.config, second),
+        )
+        self.assertEqual(
+            ([], ["new@example.com", "user1@example.com"]),
+            sharing.get_share_emails(self.config, first),
+        )
+        self.assertEqual(
+            (["user0@example.com", "user2@example.com"], []),
+            sharing.get_share_emails(self.config, second),
+        )
+
+        sharing.unshare(
+            self.config, shared_by=first, shared_with_email="user1@example.com"
+        )
+        self.assertEqual(
+            [(third, "user2@example.com")],
+            sharing.get_shared_by_user_ids_and_emails(self.config, second),
+        )
+
+    def test_lookups_are_cached(self):
+        sharing.share(
+            self.config,
+            shared_by=self.user_ids[0],
+            shared_with_email="user1@example.com",
+        )
+        sharing.get_share_graph(self.config)
+        with recording_statements() as statements:
+            for user_id in self.user_ids:
+                sharing.get_shared_by_user_ids_and_emails(self.config, user_id)
+                sharing.get_share_emails(self.config, user_id)
+        self.assertEqual([], statements)
+
+    def test_recipient_signs_up_later(self):
+        sharing.share(
+            self.config, shared_by=self.user_ids[0], shared_with_email="new@example.com"
+        )
+        # As the app does: the trigger which fills in the recipient's ID is
+        # this process's write, and its notification has to be applied here.
+        listener = ChangeListener(self.config)
+        listener.on("shares", lambda rows: sharing.invalidate())
+        listener.start()
+        self.addCleanup(listener.stop)
+        self.assertTrue(listener.wait_until_listening(5))
+        sharing.get_share_graph(self.config)
+
+        with cursor(self.config) as cur:
+            cur.execute(
+                "INSERT INTO users (email, password_hash, start_datetime_utc, end_datetime_utc) "
+                + "SELECT 'new@example.com', '', start_datetime_utc, end_datetime_utc FROM users "
+                + "WHERE id = %s RETURNING id",
+                (self.user_ids[0],),
+            )
+            (new_user_id,) = cur.fetchone()
+            cur.execute("SELECT shared_with_user_id FROM shares")
+            self.assertEqual([(new_user_id,)], cur.fetchall())
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and not sharing.get_share_graph(
+            self.config
+        ).shared_by.get(new_user_id):
+            time.sleep(0.01)
+        self.assertEqual(
+            [(self.user_ids[0], "user0@example.com")],
+            sharing.get_shared_by_user_ids_and_emails(self.config, new_user_id),
+        )
+
+    def test_graph_from_before_a_change_is_not_cached(self):
+        load = sharing.load_share_graph
+
+        def load_then_change(config):
+            graph = load(config)
+            sharing.share(
+                config,
+                shared_by=self.user_ids[0],
+                shared_with_email="user1@example.com",
+            )
+            return graph
+
+        with mock.patch.object(sharing, "load_share_graph", load_then_change):
+            self.assertEqual(
+                [],
+                sharing.get_shared_by_user_ids_and_emails(
+                    self.config, self.user_ids[1]
+                ),
+            )
+        self.assertIsNone(sharing.cached_share_graph()[0])
+        self.assertEqual(
+            [(self.user_ids[0], "user0@example.com")],
+            sharing.get_shared_by_user_ids_and_emails(self.config, self.user_ids[1]),
+        )
+
+    def test_unknown_user(self):
+        self.assertEqual(
+            [], sharing.get_shared_by_user_ids_and_emails(self.config, 1000)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
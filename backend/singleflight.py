@@ -0,0 +1,65 @@
+import threading
+from typing import Callable, Dict, Hashable, Iterable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Runs at most one call at a time for each key. Anyone asking for a key
+    # while a call for it is in flight waits for that call instead, and gets
+    # its result, or its exception.
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        # Calls made, and callers who shared someone else's instead.
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, f: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leading = True
+            else:
+                self.coalesced += 1
+                leading = False
+
+        if not leading:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = f()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def forget(self, keys: Optional[Iterable[Hashable]] = None):
+        # Calls already in flight for keys (or for every key, by default) may
+        # not see changes made since they started, so anyone asking after this
+        # gets a call of their own. Those already waiting still share the call
+        # they were waiting for.
+        with self._lock:
+            if keys is None:
+                self._calls.clear()
+            else:
+                for key in keys:
+                    self._calls.pop(key, None)
@@ -0,0 +1,106 @@
+import threading
+import unittest
+
+from singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def start_waiting(self, flight, key, f, count):
+        # Starts count threads calling flight.do(key, f), returning their
+        # threads and a list which their results are added to.
+        results = []
+
+        def call():
+            try:
+                results.append(flight.do(key, f))
+            except ValueError as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def wait_for_coalesced(self, flight, count):
+        for _ in range(1000):
+            if flight.coalesced >= count:
+                return
+            threading.Event().wait(0.001)
+        self.fail("Only {} callers coalesced".format(flight.coalesced))
+
+    def test_concurrent_calls_share_one(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            release.wait()
+            return "day"
+
+        threads, results = self.start_waiting(flight, "key", load, 5)
+        self.wait_for_coalesced(flight, 4)
+        # Other keys aren't held up.
+        self.assertEqual("other", flight.do("other key", lambda: "other"))
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(["day"] * 5, results)
+        self.assertEqual(1, len(calls))
+        self.assertEqual((2, 4), (flight.calls, flight.coalesced))
+        # Once it's finished, the next call is a new one.
+        self.assertEqual("again", flight.do("key", lambda: "again"))
+
+    def test_errors_are_shared(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fail():
+            release.wait()
+            raise ValueError("Couldn't load")
+
+        threads, results = self.start_waiting(flight, "key", fail, 3)
+        self.wait_for_coalesced(flight, 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(3, len(results))
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+        self.assertEqual("loaded", flight.do("key", lambda: "loaded"))
+
+    def test_forget(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        threads, results = self.start_waiting(
+            flight, "key", lambda: release.wait() and "stale", 2
+        )
+        self.wait_for_coalesced(flight, 1)
+        flight.forget()
+        self.assertEqual("fresh", flight.do("key", lambda: "fresh"))
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["stale", "stale"], results)
+
+    def test_forget_keys(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        threads, results = self.start_waiting(
+            flight, "key", lambda: release.wait() and "loaded", 2
+        )
+        self.wait_for_coalesced(flight, 1)
+        flight.forget(["other key"])
+        more_threads, more_results = self.start_waiting(
+            flight, "key", lambda: "not called", 1
+        )
+        self.wait_for_coalesced(flight, 2)
+        release.set()
+        for thread in threads + more_threads:
+            thread.join()
+        self.assertEqual(["loaded"] * 3, results + more_results)
+
+
+if __name__ == "__main__":
+    unittest.main()
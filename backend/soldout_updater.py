@@ -4,6 +4,7 @@ import pytz
 
 from config import Config
 from db import cursor
+from editions import current_edition
 from fetcher import check_soldout_for_single_time, fetch_multitime
 
 
@@ -14,7 +15,11 @@ def main():
 
     config = Config.from_env()
     with cursor(config) as cur:
-        cur.execute("SELECT show_id, datetime_utc FROM performances")
+        edition = current_edition(cur)
+        cur.execute(
+            "SELECT show_id, datetime_utc FROM performances WHERE edition = %s",
+            (edition.year,),
+        )
         rows = cur.fetchall()
         for show_id, datetime_utc in rows:
             shows[show_id].add(
@@ -26,9 +31,9 @@ def main():
             else:
                 multitime_shows.add(show)
         for show_id in singletime_shows:
-            check_soldout_for_single_time(cur, show_id)
+            check_soldout_for_single_time(cur, show_id, edition)
         for show_id in multitime_shows:
-            fetch_multitime(cur, show_id, "01-08-2019")
+            fetch_multitime(cur, show_id, edition, edition.starts_on)
 
 
 if __name__ == "__main__":
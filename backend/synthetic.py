@@ -0,0 +1,274 @@
+import datetime
+import random
+
+import pytz
+from psycopg2.extras import execute_values
+
+from catalog import Catalog, CatalogPerformance, CatalogShow, CatalogVenue
+from events import Event, Venue
+
+CATEGORIES = (
+    "Cabaret and Variety",
+    "Children's Shows",
+    "Comedy",
+    "Dance Physical Theatre and Circus",
+    "Events",
+    "Exhibitions",
+    "Music",
+    "Musicals and Opera",
+    "Spoken Word",
+    "Theatre",
+)
+
+
+def make_events(date, count, seed=0):
+    rng = random.Random(seed)
+    london = pytz.timezone("Europe/London")
+    venues = [
+        Venue(
+            id=i,
+            name="Venue {}".format(i),
+            google_maps_url="https://www.google.co.uk/maps/search/(55.94,-3.19)",
+        )
+        for i in range(1, 41)
+    ]
+    first_start = london.localize(datetime.datetime.combine(date, datetime.time(10)))
+
+    events = []
+    for i in range(count):
+        start = first_start + datetime.timedelta(minutes=5 * rng.randrange(0, 12 * 13))
+        performance_interest = rng.choice((None, None, None, "Must", "Booked"))
+        events.append(
+            Event(
+                show_id=i,
+                title="Synthetic show number {} with a fairly long title".format(i),
+                category=rng.choice(CATEGORIES),
+                venue=rng.choice(venues),
+                duration=datetime.timedelta(minutes=rng.choice((45, 60, 60, 75, 90))),
+                start_edinburgh=start,
+                edfringe_url="/whats-on/synthetic-{}".format(i),
+                show_interest=rng.choice(("Like", "Like", "Must")),
+                performance_id=i,
+                performance_interest=performance_interest,
+                user_id=1,
+                user_email=None,
+                shared_interests=frozenset(),
+                last_chance=rng.random() < 0.1,
+            )
+        )
+    events.sort(key=lambda event: (event.start_edinburgh, event.title))
+    return events
+
+
+FESTIVAL_START = datetime.date(2019, 8, 2)
+FESTIVAL_DAYS = 25
+
+
+def make_catalog(*, venues=330, shows=3000, seed=0) -> Catalog:
+    # The same sort of festival as seed_database, without a database.
+    rng = random.Random(seed)
+    london = pytz.timezone("Europe/London")
+    catalog_venues = {
+        i: CatalogVenue(
+            i,
+            "Venue {}".format(i),
+            "{} Synthetic Street, EH1 1AA".format(i),
+            55.94 + rng.uniform(-0.02, 0.02),
+            -3.19 + rng.uniform(-0.03, 0.03),
+        )
+        for i in range(1, venues + 1)
+    }
+    catalog_shows = {
+        i: CatalogShow(
+            i,
+            "Synthetic show {}".format(i),
+            rng.choice(CATEGORIES),
+            rng.randrange(1, venues + 1),
+            datetime.timedelta(minutes=rng.choice((45, 60, 60, 75, 90))),
+            "/whats-on/synthetic-{}".format(i),
+        )
+        for i in range(1, shows + 1)
+    }
+    performances = []
+    for show_id in catalog_shows:
+        start_time = datetime.time(rng.randrange(10, 23), rng.choice((0, 15, 30, 45)))
+        for day in range(rng.randrange(0, 5), FESTIVAL_DAYS - rng.randrange(0, 5)):
+            if rng.random() < 0.1:
+                continue
+            date = FESTIVAL_START + datetime.timedelta(days=day)
+            start = london.localize(datetime.datetime.combine(date, start_time))
+            performances.append(
+                CatalogPerformance(
+                    len(performances) + 1,
+                    show_id,
+                    start.astimezone(pytz.utc),
+                    rng.random() < 0.05,
+                )
+            )
+    performances.sort(
+        key=lambda performance: (performance.datetime_utc, performance.id)
+    )
+    return Catalog(
+        version=0,
+        venues=catalog_venues,
+        shows=catalog_shows,
+        performances=performances,
+    )
+
+
+def seed_database(
+    cur,
+    *,
+    venues=330,
+    shows=3000,
+    users=200,
+    interests_per_user=100,
+    shares_per_user=3,
+    password_hash="",
+    seed=0,
+):
+    # Fills an empty database with a festival's worth of plausible data.
+    # Users are called user<n>@example.com, and their calendar tokens are
+    # synthetic-calendar-<n>.
+    rng = random.Random(seed)
+    london = pytz.timezone("Europe/London")
+
+    venue_ids = _insert(
+        cur,
+        "venues (edfringe_number, name, address, latlong)",
+        "(%s, %s, %s, POINT(%s, %s))",
+        [
+            (
+                i,
+                "Venue {}".format(i),
+                "{} Synthetic Street, EH1 1AA".format(i),
+                55.94 + rng.uniform(-0.02, 0.02),
+                -3.19 + rng.uniform(-0.03, 0.03),
+            )
+            for i in range(venues)
+        ],
+    )
+
+    show_rows = []
+    for i in range(shows):
+        show_rows.append(
+            (
+                "/whats-on/synthetic-{}".format(i),
+                "Synthetic show {}".format(i),
+                rng.choice(CATEGORIES),
+                rng.choice(venue_ids),
+                datetime.timedelta(minutes=rng.choice((45, 60, 60, 75, 90))),
+            )
+        )
+    show_ids = _insert(
+        cur,
+        "shows (edfringe_url, title, category, venue_id, duration)",
+        "(%s, %s, %s, %s, %s)",
+        show_rows,
+    )
+
+    performance_rows = []
+    for show_id in show_ids:
+        start_time = datetime.time(rng.randrange(10, 23), rng.choice((0, 15, 30, 45)))
+        first_day = rng.randrange(0, 5)
+        last_day = FESTIVAL_DAYS - rng.randrange(0, 5)
+        for day in range(first_day, last_day):
+            if rng.random() < 0.1:
+                continue
+            date = FESTIVAL_START + datetime.timedelta(days=day)
+            start = london.localize(datetime.datetime.combine(date, start_time))
+            performance_rows.append((show_id, start.astimezone(pytz.utc)))
+    performance_ids = _insert(
+        cur, "performances (show_id, datetime_utc)", "(%s, %s)", performance_rows
+    )
+    performances_by_show = {}
+    for (show_id, _), performance_id in zip(performance_rows, performance_ids):
+        performances_by_show.setdefault(show_id, []).append(performance_id)
+
+    _insert(
+        cur,
+        "sold_out (performance_id)",
+        "(%s)",
+        [
+            (performance_id,)
+            for performance_id in performance_ids
+            if rng.random() < 0.05
+        ],
+    )
+
+    user_rows = []
+    for i in range(users):
+        start = FESTIVAL_START + datetime.timedelta(days=rng.randrange(0, 15))
+        end = start + datetime.timedelta(days=rng.randrange(2, 10))
+        user_rows.append(
+            (
+                "user{}@example.com".format(i),
+                password_hash,
+                london.localize(datetime.datetime.combine(start, datetime.time(5))),
+                london.localize(datetime.datetime.combine(end, datetime.time(5))),
+                "synthetic-import-{}".format(i),
+                "synthetic-calendar-{}".format(i),
+            )
+        )
+    user_ids = _insert(
+        cur,
+        "users (email, password_hash, start_datetime_utc, end_datetime_utc, import_token, calendar_token)",
+        "(%s, %s, %s, %s, %s, %s)",
+        user_rows,
+    )
+
+    interest_rows = []
+    performance_interest_rows = []
+    for user_id in user_ids:
+        for show_id in rng.sample(show_ids, min(interests_per_user, len(show_ids))):
+            roll = rng.random()
+            if roll < 0.1 and performances_by_show.get(show_id):
+                interest_rows.append((show_id, user_id, "Booked"))
+                performance_interest_rows.append(
+                    (
+                        show_id,
+                        rng.choice(performances_by_show[show_id]),
+                        user_id,
+                        "Booked",
+                    )
+                )
+            elif roll < 0.3:
+                interest_rows.append((show_id, user_id, "Must"))
+            else:
+                interest_rows.append((show_id, user_id, "Like"))
+    _insert(
+        cur, "interests (show_id, user_id, interest)", "(%s, %s, %s)", interest_rows
+    )
+    _insert(
+        cur,
+        "performance_interests (show_id, performance_id, user_id, interest)",
+        "(%s, %s, %s, %s)",
+        performance_interest_rows,
+    )
+
+    share_rows = set()
+    for i, user_id in enumerate(user_ids):
+        for j in rng.sample(range(users), min(shares_per_user, users)):
+            if i != j:
+                share_rows.add((user_id, "user{}@example.com".format(j)))
+    _insert(
+        cur, "shares (shared_by, shared_with_email)", "(%s, %s)", sorted(share_rows)
+    )
+
+    return user_ids
+
+
+def _insert(cur, table_and_columns, template, rows):
+    if not rows:
+        return []
+    return [
+        row[0]
+        for row in execute_values(
+            cur,
+            "INSERT INTO {} VALUES %s RETURNING id".format(table_and_columns),
+            rows,
+            template=template,
+            page_size=1000,
+            fetch=True,
+        )
+    ]
@@ -0,0 +1,57 @@
+import os
+import unittest
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+import db
+import sharing
+from config import Config
+from migrate import migrate
+
+# Tests which need a real database run against the database named in this
+# environment variable, which they wipe. They're skipped if it isn't set.
+TEST_DB_ENV = "EDFRINGEPLANNER_TEST_DB_NAME"
+
+
+def config_for_tests() -> Config:
+    database_name = os.environ.get(TEST_DB_ENV)
+    if not database_name:
+        raise unittest.SkipTest("{} not set".format(TEST_DB_ENV))
+    return Config(
+        database_name=database_name,
+        session_key="test",
+        mailgun_domain="example.com",
+        mailgun_key="test",
+        domain_prefix="http://localhost:5000",
+    )
+
+
+def reset_database(config: Config):
+    with db.cursor(config) as cur:
+        cur.execute("DROP SCHEMA public CASCADE")
+        cur.execute("CREATE SCHEMA public")
+        migrate(cur)
+    # Shares are cached in memory by every process, and there's no listener
+    # running in tests to drop them when the database is wiped.
+    sharing.invalidate()
+
+
+class RecordingCursor(psycopg2.extensions.cursor):
+    statements = []
+
+    def execute(self, query, vars=None):
+        RecordingCursor.statements.append(self.mogrify(query, vars).decode("utf-8"))
+        return super().execute(query, vars)
+
+
+@contextmanager
+def recording_statements():
+    previous_factory = db.cursor_factory
+    db.cursor_factory = RecordingCursor
+    RecordingCursor.statements = []
+    try:
+        yield RecordingCursor.statements
+    finally:
+        db.cursor_factory = previous_factory
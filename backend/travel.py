@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import math
+import os
+import struct
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from db import cursor
+
+EARTH_RADIUS_METRES = 6371000
+WALKING_METRES_PER_MINUTE = 80
+# Streets aren't straight lines between two points.
+ROUTE_FACTOR = 1.3
+MAX_MINUTES = 0xFFFF
+
+CACHE_FILENAME = "travel_times.bin"
+_MAGIC = b"EFTT1"
+_HEADER = struct.Struct("<5s32sI")
+
+
+@dataclass
+class TravelTimes:
+    venue_ids: array
+    # Row-major square matrix of walking minutes, indexed like venue_ids.
+    minutes: array
+    fingerprint: bytes
+    _indexes: Dict[int, int] = field(init=False, repr=False)
+    _deltas: List[datetime.timedelta] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._indexes = {venue_id: i for i, venue_id in enumerate(self.venue_ids)}
+        longest = max(self.minutes) if self.minutes else 0
+        self._deltas = [datetime.timedelta(minutes=m) for m in range(longest + 1)]
+
+    def between(self, venue_id_a, venue_id_b) -> datetime.timedelta:
+        a = self._indexes.get(venue_id_a)
+        b = self._indexes.get(venue_id_b)
+        if a is None or b is None:
+            return self._deltas[0]
+        return self._deltas[self.minutes[a * len(self.venue_ids) + b]]
+
+
+def distance_metres(lat_a, long_a, lat_b, long_b) -> float:
+    # As the crow flies, by the haversine formula.
+    lat_a, long_a, lat_b, long_b = map(math.radians, (lat_a, long_a, lat_b, long_b))
+    return (
+        2
+        * EARTH_RADIUS_METRES
+        * math.asin(
+            math.sqrt(
+                math.sin((lat_b - lat_a) / 2) ** 2
+                + math.cos(lat_a)
+                * math.cos(lat_b)
+                * math.sin((long_b - long_a) / 2) ** 2
+            )
+        )
+    )
+
+
+def walking_minutes(metres) -> int:
+    return math.ceil(metres * ROUTE_FACTOR / WALKING_METRES_PER_MINUTE)
+
+
+def fingerprint_venues(rows: Iterable[Tuple[int, float, float]]) -> bytes:
+    digest = hashlib.sha256()
+    for venue_id, lat, long in rows:
+        digest.update("{}:{!r}:{!r};".format(venue_id, lat, long).encode("utf-8"))
+    return digest.digest()
+
+
+def build_travel_times(rows: List[Tuple[int, float, float]]) -> TravelTimes:
+    n = len(rows)
+    lats = [math.radians(lat) for _, lat, _ in rows]
+    longs = [math.radians(long) for _, _, long in rows]
+    cos_lats = [math.cos(lat) for lat in lats]
+    scale = 2 * EARTH_RADIUS_METRES * ROUTE_FACTOR / WALKING_METRES_PER_MINUTE
+
+    minutes = array("H", bytes(2 * n * n))
+    for i in range(n):
+        lat_i, long_i, cos_lat_i = lats[i], longs[i], cos_lats[i]
+        # Venue i's times to every later venue, which are mirrored below the
+        # diagonal as well as written above it.
+        row = [
+            min(
+                MAX_MINUTES,
+                math.ceil(
+                    scale
+                    * math.asin(
+                        math.sqrt(
+                            math.sin((lat_j - lat_i) / 2) ** 2
+                            + cos_lat_i
+                            * cos_lat_j
+                            * math.sin((long_j - long_i) / 2) ** 2
+                        )
+                    )
+                ),
+            )
+            for lat_j, long_j, cos_lat_j in zip(
+                lats[i + 1 :], longs[i + 1 :], cos_lats[i + 1 :]
+            )
+        ]
+        minutes[i * n + i + 1 : (i + 1) * n] = array("H", row)
+        for offset, value in enumerate(row):
+            minutes[(i + 1 + offset) * n + i] = value
+
+    return TravelTimes(
+        venue_ids=array("i", (venue_id for venue_id, _, _ in rows)),
+        minutes=minutes,
+        fingerprint=fingerprint_venues(rows),
+    )
+
+
+def write_travel_times(path, travel_times: TravelTimes):
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(
+            _HEADER.pack(_MAGIC, travel_times.fingerprint, len(travel_times.venue_ids))
+        )
+        travel_times.venue_ids.tofile(f)
+        travel_times.minutes.tofile(f)
+    os.replace(tmp_path, path)
+
+
+def read_travel_times(path) -> Optional[TravelTimes]:
+    try:
+        with open(path, "rb") as f:
+            magic, fingerprint, n = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                return None
+            venue_ids = array("i")
+            venue_ids.fromfile(f, n)
+            minutes = array("H")
+            minutes.fromfile(f, n * n)
+    except (FileNotFoundError, EOFError, struct.error):
+        return None
+    return TravelTimes(venue_ids=venue_ids, minutes=minutes, fingerprint=fingerprint)
+
+
+def load_venue_locations(config) -> List[Tuple[int, float, float]]:
+    with cursor(config) as cur:
+        cur.execute(
+            "SELECT id, latlong[0], latlong[1] FROM venues WHERE latlong IS NOT NULL ORDER BY id ASC"
+        )
+        return [(row[0], row[1], row[2]) for row in cur.fetchall()]
+
+
+def load_travel_times(config) -> TravelTimes:
+    # Only rebuild the on-disk matrix if venues have been added or moved.
+    rows = load_venue_locations(config)
+    path = os.path.join(config.cache_dir, CACHE_FILENAME)
+    travel_times = read_travel_times(path)
+    if travel_times is None or travel_times.fingerprint != fingerprint_venues(rows):
+        travel_times = build_travel_times(rows)
+        os.makedirs(config.cache_dir, exist_ok=True)
+        write_travel_times(path, travel_times)
+    return travel_times
+
+
+_travel_times = None
+
+
+def get_travel_times(config) -> TravelTimes:
+    global _travel_times
+    if _travel_times is None:
+        _travel_times = load_travel_times(config)
+    return _travel_times
+
+
+def invalidate_if_stale(config):
+    global _travel_times
+    current = _travel_times
+    if current is not None and current.fingerprint != fingerprint_venues(
+        load_venue_locations(config)
+    ):
+        _travel_times = None
+
+
+def invalidate():
+    global _travel_times
+    _travel_times = None
@@ -0,0 +1,49 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from travel import build_travel_times, read_travel_times, write_travel_times
+
+VENUES = [
+    (2, 55.944458, -3.187266),  # Fringe Central
+    (3, 55.943905, -3.188397),  # Assembly George Square Gardens
+    (5, 55.955872, -3.192146),  # The Stand Comedy Club
+]
+
+
+class TestTravelTimes(unittest.TestCase):
+    def test_same_venue(self):
+        travel_times = build_travel_times(VENUES)
+        self.assertEqual(datetime.timedelta(), travel_times.between(3, 3))
+
+    def test_symmetric(self):
+        travel_times = build_travel_times(VENUES)
+        self.assertEqual(travel_times.between(2, 5), travel_times.between(5, 2))
+
+    def test_neighbours_are_close(self):
+        travel_times = build_travel_times(VENUES)
+        self.assertEqual(datetime.timedelta(minutes=2), travel_times.between(2, 3))
+        self.assertEqual(datetime.timedelta(minutes=22), travel_times.between(3, 5))
+
+    def test_unknown_venue(self):
+        travel_times = build_travel_times(VENUES)
+        self.assertEqual(datetime.timedelta(), travel_times.between(2, 1000))
+
+    def test_round_trip(self):
+        travel_times = build_travel_times(VENUES)
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, "travel_times.bin")
+            write_travel_times(path, travel_times)
+            read = read_travel_times(path)
+        self.assertEqual(travel_times.fingerprint, read.fingerprint)
+        self.assertEqual(travel_times.minutes, read.minutes)
+        self.assertEqual(travel_times.between(2, 5), read.between(2, 5))
+
+    def test_missing_file(self):
+        with tempfile.TemporaryDirectory() as dir:
+            self.assertIsNone(read_travel_times(os.path.join(dir, "missing.bin")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,302 @@
+import argparse
+import io
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from selenium import webdriver
+
+import catalog
+from config import Config
+from db import cursor
+
+LISTING_URL = "https://tickets.edfringe.com/venues"
+
+
+class ScrapedVenue(NamedTuple):
+    edfringe_number: int
+    name: str
+    address: str
+    lat: Optional[float]
+    long: Optional[float]
+
+
+@dataclass
+class SyncCounts:
+    inserted: int
+    updated: int
+    unchanged: int
+    # In the database but not the listing. These are left alone, as shows
+    # may still refer to them.
+    missing: int
+
+
+def scrape_venues() -> Iterator[ScrapedVenue]:
+    driver = webdriver.Chrome()
+    try:
+        driver.get(LISTING_URL)
+
+        while True:
+            venues_container = driver.find_element_by_class_name("venues")
+            for venue in venues_container.find_elements_by_class_name("venue-details"):
+                name = venue.find_element_by_tag_name("h3").text
+                lis = venue.find_elements_by_tag_name("li")
+                yield make_venue(
+                    name,
+                    lis[0].text,
+                    lis[1].text,
+                    lis[3].get_attribute("data-lat"),
+                    lis[3].get_attribute("data-lng"),
+                )
+            next_links = driver.find_elements_by_link_text("Next »")
+            if not next_links:
+                break
+            next_links[0].click()
+    finally:
+        driver.quit()
+
+
+def make_venue(name, address, number_text, lat, long) -> ScrapedVenue:
+    return ScrapedVenue(
+        edfringe_number=int(number_text.split()[-1]),
+        name=name.strip(),
+        address=address.strip(),
+        lat=float(lat) if lat else None,
+        long=float(long) if long else None,
+    )
+
+
+_VOID_ELEMENTS = {
+    "area",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "wbr",
+}
+
+
+class _ListingParser(HTMLParser):
+    # Picks the same details out of a saved page of the venue listing as
+    # scrape_venues does from the live one.
+
+    def __init__(self):
+        super().__init__()
+        self.venues: List[ScrapedVenue] = []
+        self._depth = 0
+        self._venue_depth = None
+        self._name = None
+        self._items = None
+        self._text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_ELEMENTS:
+            return
+        self._depth += 1
+        attrs = dict(attrs)
+        if "venue-details" in (attrs.get("class") or "").split():
+            self._venue_depth = self._depth
+            self._name = ""
+            self._items = []
+        elif self._venue_depth is None:
+            return
+        elif tag == "h3":
+            self._text = []
+        elif tag == "li":
+            self._text = []
+            self._items.append(["", attrs.get("data-lat"), attrs.get("data-lng")])
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_ELEMENTS:
+            return
+        if self._venue_depth is not None:
+            if tag == "h3" and self._text is not None:
+                self._name = "".join(self._text)
+                self._text = None
+            elif tag == "li" and self._text is not None:
+                self._items[-1][0] = "".join(self._text)
+                self._text = None
+            elif self._depth == self._venue_depth:
+                items = self._items
+                location = items[3] if len(items) > 3 else ("", None, None)
+                self.venues.append(
+                    make_venue(
+                        self._name, items[0][0], items[1][0], location[1], location[2]
+                    )
+                )
+                self._venue_depth = None
+        self._depth -= 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+
+def parse_listing(html: str) -> List[ScrapedVenue]:
+    parser = _ListingParser()
+    parser.feed(html)
+    parser.close()
+    return parser.venues
+
+
+class _CopyStream(io.TextIOBase):
+    # Presents rows as the text COPY reads, producing it as COPY asks for it
+    # so that venues can be copied as they're scraped.
+
+    def __init__(self, rows: Iterable[tuple]):
+        self._lines = (
+            "\t".join(_copy_value(value) for value in row) + "\n" for row in rows
+        )
+        self._buffer = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def sync_venues(cur, venues: Iterable[ScrapedVenue]) -> SyncCounts:
+    # Venues are matched on their name, which is unique; edfringe numbers
+    # aren't, as venues at the same site share one. A venue whose name isn't
+    # known is taken to be renamed if its number is the only way to tell, that
+    # is, if it's the only new name with that number and only one unlisted
+    # venue has it. Otherwise it's added. Call within a transaction, which
+    # cursor() provides, so that the whole sync applies or none of it does.
+    cur.execute(
+        "CREATE TEMPORARY TABLE venue_staging "
+        + "(position SERIAL, edfringe_number INTEGER, name VARCHAR, address VARCHAR, lat DOUBLE PRECISION, long DOUBLE PRECISION) "
+        + "ON COMMIT DROP"
+    )
+    cur.copy_expert(
+        "COPY venue_staging (edfringe_number, name, address, lat, long) FROM STDIN",
+        _CopyStream(venues),
+    )
+    # Later pages win if the listing repeats a venue.
+    cur.execute(
+        "CREATE TEMPORARY TABLE venue_changes ON COMMIT DROP AS "
+        + "SELECT DISTINCT ON (name) edfringe_number, name, address, lat, long, NULL::INTEGER AS venue_id FROM venue_staging "
+        + "ORDER BY name, position DESC"
+    )
+    cur.execute(
+        "UPDATE venue_changes SET venue_id = venues.id FROM venues WHERE venues.name = venue_changes.name"
+    )
+    cur.execute(
+        "UPDATE venue_changes SET venue_id = renamed.id FROM ("
+        + "SELECT edfringe_number, min(id) AS id FROM venues "
+        + "WHERE NOT EXISTS (SELECT 1 FROM venue_changes WHERE venue_changes.venue_id = venues.id) "
+        + "GROUP BY edfringe_number HAVING count(*) = 1"
+        + ") renamed "
+        + "WHERE venue_changes.venue_id IS NULL AND venue_changes.edfringe_number = renamed.edfringe_number "
+        + "AND NOT EXISTS (SELECT 1 FROM venue_changes others WHERE others.venue_id IS NULL "
+        + "AND others.edfringe_number = venue_changes.edfringe_number AND others.name != venue_changes.name)"
+    )
+
+    cur.execute(
+        "UPDATE venues SET edfringe_number = venue_changes.edfringe_number, name = venue_changes.name, "
+        + "address = venue_changes.address, latlong = POINT(venue_changes.lat, venue_changes.long) "
+        + "FROM venue_changes WHERE venues.id = venue_changes.venue_id "
+        + "AND (venues.edfringe_number IS DISTINCT FROM venue_changes.edfringe_number "
+        + "OR venues.name IS DISTINCT FROM venue_changes.name "
+        + "OR venues.address IS DISTINCT FROM venue_changes.address "
+        + "OR venues.latlong[0] IS DISTINCT FROM venue_changes.lat "
+        + "OR venues.latlong[1] IS DISTINCT FROM venue_changes.long)"
+    )
+    updated = cur.rowcount
+
+    cur.execute(
+        "INSERT INTO venues (edfringe_number, name, address, latlong) "
+        + "SELECT edfringe_number, name, address, POINT(lat, long) FROM venue_changes "
+        + "WHERE venue_id IS NULL"
+    )
+    inserted = cur.rowcount
+
+    cur.execute("SELECT count(*) FROM venue_changes")
+    listed = cur.fetchone()[0]
+    cur.execute(
+        "SELECT count(*) FROM venues WHERE NOT EXISTS "
+        + "(SELECT 1 FROM venue_changes WHERE venue_changes.venue_id = venues.id OR venue_changes.name = venues.name)"
+    )
+    missing = cur.fetchone()[0]
+
+    return SyncCounts(
+        inserted=inserted,
+        updated=updated,
+        unchanged=listed - inserted - updated,
+        missing=missing,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Brings the venues table up to date with the edfringe venue listing."
+    )
+    parser.add_argument(
+        "listings",
+        nargs="*",
+        help="Saved pages of the venue listing to read, instead of scraping it",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Report changes without making them"
+    )
+    args = parser.parse_args()
+
+    if args.listings:
+
+        def venues():
+            for path in args.listings:
+                with open(path, encoding="utf-8") as f:
+                    yield from parse_listing(f.read())
+
+    else:
+        venues = scrape_venues
+
+    config = Config.from_env()
+    with cursor(config) as cur:
+        counts = sync_venues(cur, venues())
+        if args.dry_run:
+            cur.connection.rollback()
+    if not args.dry_run:
+        catalog.refresh_snapshot(config)
+    print(
+        "{}{} inserted, {} updated, {} unchanged, {} in the database but not listed".format(
+            "Dry run: " if args.dry_run else "",
+            counts.inserted,
+            counts.updated,
+            counts.unchanged,
+            counts.missing,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
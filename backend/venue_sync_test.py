@@ -0,0 +1,193 @@
+import os
+import unittest
+
+from db import cursor
+from migrate import SCHEMA_DIR
+from testdb import config_for_tests, reset_database
+from venue_sync import ScrapedVenue, parse_listing, sync_venues
+
+LISTING = """
+<html><body>
+<div class="venues">
+  <div class="venue-details">
+    <h3>Fringe Central</h3>
+    <ul>
+      <li>Appleton Tower,<br>EH8 9LE</li>
+      <li>Venue number 2</li>
+      <li><img src="accessible.png"> Accessible</li>
+      <li class="map" data-lat="55.944458" data-lng="-3.187266">Map</li>
+    </ul>
+  </div>
+  <div class="venue-details">
+    <h3>The Stand Comedy Club</h3>
+    <ul>
+      <li>5 York Place, EH1 3EB</li>
+      <li>Venue number 5</li>
+    </ul>
+  </div>
+</div>
+<a href="?page=2">Next &raquo;</a>
+</body></html>
+"""
+
+
+class TestParseListing(unittest.TestCase):
+    def test_parse_listing(self):
+        self.assertEqual(
+            [
+                ScrapedVenue(
+                    2, "Fringe Central", "Appleton Tower,EH8 9LE", 55.944458, -3.187266
+                ),
+                ScrapedVenue(
+                    5, "The Stand Comedy Club", "5 York Place, EH1 3EB", None, None
+                ),
+            ],
+            parse_listing(LISTING),
+        )
+
+
+class TestSyncVenues(unittest.TestCase):
+    def setUp(self):
+        self.config = config_for_tests()
+        reset_database(self.config)
+        with cursor(self.config) as cur:
+            cur.execute(
+                "INSERT INTO venues (edfringe_number, name, address, latlong) VALUES "
+                + "(1, 'Unchanged', '1 Street', POINT(55.9, -3.1)), "
+                + "(2, 'Renamed', '2 Street', POINT(55.9, -3.1)), "
+                + "(3, 'Readdressed', '3 Street', POINT(55.9, -3.1)), "
+                + "(4, 'Moved', '4 Street', POINT(55.9, -3.1)), "
+                + "(5, 'Unlisted', '5 Street', POINT(55.9, -3.1)), "
+                + "(6, 'Located', '6 Street', NULL)"
+            )
+
+    def venues(self):
+        with cursor(self.config) as cur:
+            cur.execute(
+                "SELECT edfringe_number, name, address, latlong[0], latlong[1] FROM venues ORDER BY edfringe_number, name"
+            )
+            return [ScrapedVenue(*row) for row in cur.fetchall()]
+
+    def test_sync(self):
+        listing = [
+            ScrapedVenue(1, "Unchanged", "1 Street", 55.9, -3.1),
+            ScrapedVenue(2, "Renamed again", "2 Old Street", 55.9, -3.1),
+            ScrapedVenue(3, "Readdressed", "3 Road", 55.9, -3.1),
+            ScrapedVenue(4, "Moved", "4 Street", 55.95, -3.1),
+            ScrapedVenue(6, "Located", "6 Street", 55.9, -3.2),
+            ScrapedVenue(7, "New\tvenue", "7 Street\\Lane", 55.9, -3.1),
+            # Listings can repeat venues, in which case the later entry wins.
+            # With its number its own, a venue whose name isn't known has
+            # been renamed.
+            ScrapedVenue(2, "Renamed again", "2 Street", 55.9, -3.1),
+        ]
+        with cursor(self.config) as cur:
+            counts = sync_venues(cur, iter(listing))
+        self.assertEqual(
+            (1, 4, 1, 1),
+            (counts.inserted, counts.updated, counts.unchanged, counts.missing),
+        )
+        self.assertEqual(
+            [
+                ScrapedVenue(1, "Unchanged", "1 Street", 55.9, -3.1),
+                ScrapedVenue(2, "Renamed again", "2 Street", 55.9, -3.1),
+                ScrapedVenue(3, "Readdressed", "3 Road", 55.9, -3.1),
+                ScrapedVenue(4, "Moved", "4 Street", 55.95, -3.1),
+                ScrapedVenue(5, "Unlisted", "5 Street", 55.9, -3.1),
+                ScrapedVenue(6, "Located", "6 Street", 55.9, -3.2),
+                ScrapedVenue(7, "New\tvenue", "7 Street\\Lane", 55.9, -3.1),
+            ],
+            self.venues(),
+        )
+
+        with cursor(self.config) as cur:
+            counts = sync_venues(cur, iter(listing))
+        self.assertEqual(
+            (0, 0, 6, 1),
+            (counts.inserted, counts.updated, counts.unchanged, counts.missing),
+        )
+
+    def test_shared_numbers(self):
+        # Venues at the same site share a number.
+        listing = [
+            ScrapedVenue(1, "Unchanged", "1 Street", 55.9, -3.1),
+            ScrapedVenue(8, "Main house", "8 Street", 55.9, -3.1),
+            ScrapedVenue(8, "Studio", "8 Street", 55.9, -3.1),
+        ]
+        with cursor(self.config) as cur:
+            counts = sync_venues(cur, iter(listing))
+        self.assertEqual(
+            (2, 0, 1, 5),
+            (counts.inserted, counts.updated, counts.unchanged, counts.missing),
+        )
+        with cursor(self.config) as cur:
+            counts = sync_venues(cur, iter(listing))
+        self.assertEqual(
+            (0, 0, 3, 5),
+            (counts.inserted, counts.updated, counts.unchanged, counts.missing),
+        )
+        shared = [venue for venue in self.venues() if venue.edfringe_number == 8]
+        self.assertEqual(
+            ["Main house", "Studio"], sorted(venue.name for venue in shared)
+        )
+
+        # With two new names for two unlisted venues with a number, there's
+        # no telling which is which, so both are added.
+        listing[1:] = [
+            ScrapedVenue(8, "Main House", "8 Street", 55.9, -3.1),
+            ScrapedVenue(8, "The Studio", "8 Street", 55.9, -3.1),
+        ]
+        with cursor(self.config) as cur:
+            counts = sync_venues(cur, iter(listing))
+        self.assertEqual(
+            (2, 0, 1, 7),
+            (counts.inserted, counts.updated, counts.unchanged, counts.missing),
+        )
+
+    def test_resync_real_venues(self):
+        # The real listing, which shares numbers between venues and repeats
+        # some.
+        with open(os.path.join(SCHEMA_DIR, "venues.sql"), encoding="utf-8") as f:
+            statements = f.read().replace("INSERT INTO venues ", "INSERT INTO listed ")
+        with cursor(self.config) as cur:
+            cur.execute(
+                "CREATE TEMPORARY TABLE listed "
+                + "(edfringe_number INTEGER, name VARCHAR, address VARCHAR, latlong POINT)"
+            )
+            cur.execute(statements)
+            cur.execute(
+                "SELECT edfringe_number, name, address, latlong[0], latlong[1] FROM listed"
+            )
+            listing = [ScrapedVenue(*row) for row in cur.fetchall()]
+            cur.execute("DELETE FROM venues")
+
+        with cursor(self.config) as cur:
+            counts = sync_venues(cur, iter(listing))
+        self.assertEqual(0, counts.updated)
+        synced = self.venues()
+        self.assertEqual(len({venue.name for venue in listing}), len(synced))
+
+        with cursor(self.config) as cur:
+            counts = sync_venues(cur, iter(listing))
+        self.assertEqual(
+            (0, 0, len(synced), 0),
+            (counts.inserted, counts.updated, counts.unchanged, counts.missing),
+        )
+        self.assertEqual(synced, self.venues())
+
+    def test_failed_sync_changes_nothing(self):
+        before = self.venues()
+
+        def listing():
+            yield ScrapedVenue(8, "Brand new", "8 Street", None, None)
+            yield ScrapedVenue(2, "Renamed again", "2 Street", 55.9, -3.1)
+            raise ConnectionError("Lost the listing")
+
+        with self.assertRaises(Exception):
+            with cursor(self.config) as cur:
+                sync_venues(cur, listing())
+        self.assertEqual(before, self.venues())
+
+
+if __name__ == "__main__":
+    unittest.main()
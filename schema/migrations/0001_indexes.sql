@@ -0,0 +1,14 @@
+-- Indexes for the lookups made on every day view, share lookup and import.
+-- The UNIQUE constraints in initial.sql already cover lookups by
+-- performances(show_id), performance_interests(performance_id, user_id),
+-- sold_out(performance_id) and shares(shared_by).
+
+CREATE INDEX IF NOT EXISTS performances_datetime_utc_idx ON performances (datetime_utc);
+
+CREATE INDEX IF NOT EXISTS interests_user_id_idx ON interests (user_id);
+
+CREATE INDEX IF NOT EXISTS performance_interests_user_id_show_id_idx ON performance_interests (user_id, show_id);
+
+CREATE INDEX IF NOT EXISTS shares_shared_with_email_idx ON shares (shared_with_email);
+
+CREATE INDEX IF NOT EXISTS shows_venue_id_idx ON shows (venue_id);
@@ -0,0 +1,41 @@
+-- Tell every app process when rows they may have cached change, whichever
+-- process (or script) changed them. Each statement sends one notification on
+-- the edfringeplanner_changes channel listing the rows it changed. If that
+-- list is too long for a notification, rows is null, meaning "anything in
+-- this table may have changed".
+
+CREATE OR REPLACE FUNCTION notify_changes() RETURNS trigger AS $$
+DECLARE
+  payload TEXT;
+BEGIN
+  SELECT json_build_object(
+    'table', TG_TABLE_NAME,
+    'origin', current_setting('application_name'),
+    'rows', json_agg(row_to_json(changed_rows))
+  )::text INTO payload FROM changed_rows HAVING count(*) > 0;
+  IF payload IS NULL THEN
+    RETURN NULL;
+  END IF;
+  IF octet_length(payload) > 7000 THEN
+    payload := json_build_object(
+      'table', TG_TABLE_NAME,
+      'origin', current_setting('application_name'),
+      'rows', NULL
+    )::text;
+  END IF;
+  PERFORM pg_notify('edfringeplanner_changes', payload);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  table_name TEXT;
+BEGIN
+  FOREACH table_name IN ARRAY ARRAY['interests', 'performance_interests', 'sold_out', 'shares', 'performances', 'shows', 'venues'] LOOP
+    EXECUTE format('CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE notify_changes()', table_name || '_notify_insert', table_name);
+    EXECUTE format('CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE notify_changes()', table_name || '_notify_update', table_name);
+    EXECUTE format('CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE notify_changes()', table_name || '_notify_delete', table_name);
+  END LOOP;
+END;
+$$;
@@ -0,0 +1,39 @@
+-- Counts committed changes to the tables the in-memory catalog is built from,
+-- so that a process which may have missed notifications (for example a worker
+-- forked from a parent which loaded the catalog) can cheaply tell whether its
+-- copy is still current. The counter is updated in the changing transaction,
+-- so it can't be seen to move before the change itself is visible.
+
+CREATE TABLE catalog_version (
+  id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  version BIGINT NOT NULL
+);
+
+INSERT INTO catalog_version (version) VALUES (0);
+
+CREATE OR REPLACE FUNCTION notify_changes() RETURNS trigger AS $$
+DECLARE
+  payload TEXT;
+BEGIN
+  SELECT json_build_object(
+    'table', TG_TABLE_NAME,
+    'origin', current_setting('application_name'),
+    'rows', json_agg(row_to_json(changed_rows))
+  )::text INTO payload FROM changed_rows HAVING count(*) > 0;
+  IF payload IS NULL THEN
+    RETURN NULL;
+  END IF;
+  IF TG_TABLE_NAME IN ('shows', 'performances', 'sold_out', 'venues') THEN
+    UPDATE catalog_version SET version = version + 1;
+  END IF;
+  IF octet_length(payload) > 7000 THEN
+    payload := json_build_object(
+      'table', TG_TABLE_NAME,
+      'origin', current_setting('application_name'),
+      'rows', NULL
+    )::text;
+  END IF;
+  PERFORM pg_notify('edfringeplanner_changes', payload);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
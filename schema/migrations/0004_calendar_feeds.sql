@@ -0,0 +1,57 @@
+-- Calendar feeds are fetched with a per-user token rather than a session, and
+-- revalidated using when the user's interests (or the catalog, which decides
+-- e.g. which performances are sold out) last changed.
+
+ALTER TABLE users ADD COLUMN calendar_token VARCHAR UNIQUE;
+ALTER TABLE users ADD COLUMN interests_changed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+-- Tokens are secrets, and made like those new users get (uuid.uuid4().hex).
+UPDATE users SET calendar_token = replace(gen_random_uuid()::text, '-', '');
+
+ALTER TABLE catalog_version ADD COLUMN changed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION notify_changes() RETURNS trigger AS $$
+DECLARE
+  payload TEXT;
+BEGIN
+  SELECT json_build_object(
+    'table', TG_TABLE_NAME,
+    'origin', current_setting('application_name'),
+    'rows', json_agg(row_to_json(changed_rows))
+  )::text INTO payload FROM changed_rows HAVING count(*) > 0;
+  IF payload IS NULL THEN
+    RETURN NULL;
+  END IF;
+  IF TG_TABLE_NAME IN ('shows', 'performances', 'sold_out', 'venues') THEN
+    UPDATE catalog_version SET version = version + 1, changed_at = clock_timestamp();
+  END IF;
+  IF octet_length(payload) > 7000 THEN
+    payload := json_build_object(
+      'table', TG_TABLE_NAME,
+      'origin', current_setting('application_name'),
+      'rows', NULL
+    )::text;
+  END IF;
+  PERFORM pg_notify('edfringeplanner_changes', payload);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION touch_interests_changed_at() RETURNS trigger AS $$
+BEGIN
+  UPDATE users SET interests_changed_at = clock_timestamp()
+  WHERE id IN (SELECT DISTINCT user_id FROM changed_rows);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  table_name TEXT;
+BEGIN
+  FOREACH table_name IN ARRAY ARRAY['interests', 'performance_interests'] LOOP
+    EXECUTE format('CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE touch_interests_changed_at()', table_name || '_touch_insert', table_name);
+    EXECUTE format('CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE touch_interests_changed_at()', table_name || '_touch_update', table_name);
+    EXECUTE format('CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE touch_interests_changed_at()', table_name || '_touch_delete', table_name);
+  END LOOP;
+END;
+$$;
@@ -0,0 +1,10 @@
+-- What each user's last import listed, one row per show, so that a re-import
+-- only needs to touch the rows which were added, changed or removed since.
+
+CREATE TABLE IF NOT EXISTS import_fingerprints (
+  user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+  edfringe_url VARCHAR,
+  show_id INTEGER REFERENCES shows(id),
+  fingerprint VARCHAR,
+  PRIMARY KEY (user_id, edfringe_url)
+);
@@ -0,0 +1,70 @@
+-- Each show's last performance which isn't sold out, so that whether a day is
+-- a show's last chance is a lookup rather than a read of all its later
+-- performances. Kept up to date by triggers on performances and sold_out, so
+-- catalog refreshes and sold-out checks maintain it without knowing about it.
+-- Shows with no bookable performances have no row.
+
+CREATE TABLE IF NOT EXISTS show_last_bookable (
+  show_id INTEGER PRIMARY KEY REFERENCES shows(id) ON DELETE CASCADE,
+  datetime_utc TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION refresh_show_last_bookable(changed_show_ids INTEGER[]) RETURNS void AS $$
+BEGIN
+  -- Concurrent refreshes of a show queue up here, and each of the following
+  -- statements sees what the ones before it committed.
+  PERFORM 1 FROM shows WHERE id = ANY(changed_show_ids) ORDER BY id FOR NO KEY UPDATE;
+  -- Only rows which actually change are written, as writes are notified.
+  DELETE FROM show_last_bookable WHERE show_id = ANY(changed_show_ids) AND NOT EXISTS (
+    SELECT 1 FROM performances LEFT JOIN sold_out ON sold_out.performance_id = performances.id
+    WHERE performances.show_id = show_last_bookable.show_id AND sold_out.id IS NULL
+  );
+  INSERT INTO show_last_bookable (show_id, datetime_utc)
+  SELECT performances.show_id, max(performances.datetime_utc)
+  FROM performances LEFT JOIN sold_out ON sold_out.performance_id = performances.id
+  WHERE performances.show_id = ANY(changed_show_ids) AND sold_out.id IS NULL
+  GROUP BY performances.show_id
+  ON CONFLICT (show_id) DO UPDATE SET datetime_utc = EXCLUDED.datetime_utc
+  WHERE show_last_bookable.datetime_utc IS DISTINCT FROM EXCLUDED.datetime_utc;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION performances_refresh_last_bookable() RETURNS trigger AS $$
+BEGIN
+  PERFORM refresh_show_last_bookable(array_agg(DISTINCT show_id)) FROM changed_rows;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sold_out_refresh_last_bookable() RETURNS trigger AS $$
+BEGIN
+  PERFORM refresh_show_last_bookable(array_agg(DISTINCT performances.show_id))
+  FROM changed_rows INNER JOIN performances ON performances.id = changed_rows.performance_id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  table_name TEXT;
+BEGIN
+  FOREACH table_name IN ARRAY ARRAY['performances', 'sold_out'] LOOP
+    EXECUTE format('CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE %I()', table_name || '_last_bookable_insert', table_name, table_name || '_refresh_last_bookable');
+    EXECUTE format('CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE %I()', table_name || '_last_bookable_update_old', table_name, table_name || '_refresh_last_bookable');
+    EXECUTE format('CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE %I()', table_name || '_last_bookable_update_new', table_name, table_name || '_refresh_last_bookable');
+    EXECUTE format('CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE %I()', table_name || '_last_bookable_delete', table_name, table_name || '_refresh_last_bookable');
+  END LOOP;
+  -- Day plans cached before a show's later performances sold out need
+  -- dropping, so changes to the index are notified like the catalog's.
+  EXECUTE 'CREATE TRIGGER show_last_bookable_notify_insert AFTER INSERT ON show_last_bookable REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE notify_changes()';
+  EXECUTE 'CREATE TRIGGER show_last_bookable_notify_update AFTER UPDATE ON show_last_bookable REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE notify_changes()';
+  EXECUTE 'CREATE TRIGGER show_last_bookable_notify_delete AFTER DELETE ON show_last_bookable REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE notify_changes()';
+END;
+$$;
+
+INSERT INTO show_last_bookable (show_id, datetime_utc)
+SELECT performances.show_id, max(performances.datetime_utc)
+FROM performances LEFT JOIN sold_out ON sold_out.performance_id = performances.id
+WHERE sold_out.id IS NULL
+GROUP BY performances.show_id
+ON CONFLICT (show_id) DO NOTHING;
@@ -0,0 +1,34 @@
+-- Resolves each share's recipient email to their user ID once they have an
+-- account, so that shares are looked up by ID rather than joined on emails.
+-- Kept up to date by triggers, both when a share is made with an email which
+-- already has an account and when someone signs up with an email which has
+-- already been shared with.
+
+ALTER TABLE shares ADD COLUMN shared_with_user_id INTEGER REFERENCES users(id) ON DELETE SET NULL;
+
+UPDATE shares SET shared_with_user_id = users.id FROM users WHERE users.email = shares.shared_with_email;
+
+CREATE INDEX IF NOT EXISTS shares_shared_with_user_id_idx ON shares (shared_with_user_id);
+
+CREATE OR REPLACE FUNCTION resolve_share_recipient() RETURNS trigger AS $$
+BEGIN
+  NEW.shared_with_user_id := (SELECT id FROM users WHERE email = NEW.shared_with_email);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER shares_resolve_recipient BEFORE INSERT OR UPDATE OF shared_with_email ON shares
+FOR EACH ROW EXECUTE PROCEDURE resolve_share_recipient();
+
+CREATE OR REPLACE FUNCTION resolve_shares_with_user() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' THEN
+    UPDATE shares SET shared_with_user_id = NULL WHERE shared_with_user_id = NEW.id AND shared_with_email != NEW.email;
+  END IF;
+  UPDATE shares SET shared_with_user_id = NEW.id WHERE shared_with_email = NEW.email AND shared_with_user_id IS DISTINCT FROM NEW.id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_resolve_shares AFTER INSERT OR UPDATE OF email ON users
+FOR EACH ROW EXECUTE PROCEDURE resolve_shares_with_user();
@@ -0,0 +1,23 @@
+-- Email waiting to be sent, or which has been, by mailer.MailSender. Emails
+-- are queued in the transaction which needs them sent, so they're only sent
+-- if it commits, and a request never waits on the mail API.
+
+CREATE TABLE IF NOT EXISTS outbound_emails (
+  id SERIAL PRIMARY KEY,
+  sender VARCHAR NOT NULL,
+  recipient VARCHAR NOT NULL,
+  subject VARCHAR NOT NULL,
+  body TEXT NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  -- When the email may next be claimed: after a failed attempt's backoff, or
+  -- once a sender which claimed it has had long enough to send it.
+  next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  attempts INTEGER NOT NULL DEFAULT 0,
+  last_error VARCHAR,
+  sent_at TIMESTAMP WITH TIME ZONE,
+  -- Set when the API rejected the email outright, or it ran out of attempts.
+  abandoned_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS outbound_emails_pending_idx ON outbound_emails (next_attempt_at)
+WHERE sent_at IS NULL AND abandoned_at IS NULL;
@@ -0,0 +1,203 @@
+-- Each year's festival is an edition. Performances and sold-out marks belong to
+-- one, and are partitioned by it, so queries scoped to the current edition
+-- (WHERE edition = current_edition()) only read its partitions however many
+-- years have built up. Adding an edition creates its partitions; marking it
+-- current moves the whole site on to it.
+
+CREATE TABLE editions (
+  year INTEGER PRIMARY KEY,
+  starts_on DATE NOT NULL,
+  ends_on DATE NOT NULL,
+  current BOOLEAN NOT NULL DEFAULT FALSE,
+  CHECK (starts_on <= ends_on)
+);
+
+CREATE UNIQUE INDEX editions_current_idx ON editions (current) WHERE current;
+
+CREATE OR REPLACE FUNCTION current_edition() RETURNS INTEGER AS $$
+  SELECT year FROM editions WHERE current;
+$$ LANGUAGE sql STABLE;
+
+-- The old tables keep their data until it's copied across, but give up their
+-- names, and the names of their constraints and indexes, which code refers to.
+ALTER TABLE performances RENAME TO performances_unpartitioned;
+ALTER TABLE performances_unpartitioned RENAME CONSTRAINT performances_pkey TO performances_unpartitioned_pkey;
+ALTER TABLE performances_unpartitioned RENAME CONSTRAINT performances_show_id_datetime_utc_key TO performances_unpartitioned_show_id_datetime_utc_key;
+ALTER TABLE performances_unpartitioned RENAME CONSTRAINT performances_show_id_fkey TO performances_unpartitioned_show_id_fkey;
+ALTER INDEX performances_datetime_utc_idx RENAME TO performances_unpartitioned_datetime_utc_idx;
+ALTER TABLE sold_out RENAME TO sold_out_unpartitioned;
+ALTER TABLE sold_out_unpartitioned RENAME CONSTRAINT sold_out_pkey TO sold_out_unpartitioned_pkey;
+ALTER TABLE sold_out_unpartitioned RENAME CONSTRAINT sold_out_performance_id_key TO sold_out_unpartitioned_performance_id_key;
+ALTER TABLE sold_out_unpartitioned RENAME CONSTRAINT sold_out_performance_id_fkey TO sold_out_unpartitioned_performance_id_fkey;
+-- Ids carry on from the same sequences, so stay unique across editions.
+ALTER SEQUENCE performances_id_seq OWNED BY NONE;
+ALTER SEQUENCE sold_out_id_seq OWNED BY NONE;
+
+-- Keys on partitioned tables have to include the edition. Ids are still
+-- unique on their own, and looked up through an index in each partition.
+CREATE TABLE performances (
+  id INTEGER NOT NULL DEFAULT nextval('performances_id_seq'),
+  show_id INTEGER CONSTRAINT performances_show_id_fkey REFERENCES shows(id),
+  datetime_utc TIMESTAMP WITH TIME ZONE,
+  edition INTEGER NOT NULL DEFAULT current_edition() REFERENCES editions(year),
+  CONSTRAINT performances_pkey PRIMARY KEY (edition, id),
+  CONSTRAINT performances_show_id_datetime_utc_key UNIQUE (show_id, datetime_utc, edition)
+) PARTITION BY LIST (edition);
+
+CREATE INDEX performances_id_idx ON performances (id);
+CREATE INDEX performances_datetime_utc_idx ON performances (datetime_utc);
+ALTER SEQUENCE performances_id_seq OWNED BY performances.id;
+
+CREATE TABLE sold_out (
+  id INTEGER NOT NULL DEFAULT nextval('sold_out_id_seq'),
+  performance_id INTEGER,
+  edition INTEGER NOT NULL DEFAULT current_edition() REFERENCES editions(year),
+  CONSTRAINT sold_out_pkey PRIMARY KEY (edition, id),
+  CONSTRAINT sold_out_performance_id_key UNIQUE (performance_id, edition),
+  CONSTRAINT sold_out_performance_id_fkey FOREIGN KEY (edition, performance_id) REFERENCES performances(edition, id)
+) PARTITION BY LIST (edition);
+
+ALTER SEQUENCE sold_out_id_seq OWNED BY sold_out.id;
+
+CREATE OR REPLACE FUNCTION create_edition_partitions() RETURNS trigger AS $$
+BEGIN
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF performances FOR VALUES IN (%s)', 'performances_' || NEW.year, NEW.year);
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF sold_out FOR VALUES IN (%s)', 'sold_out_' || NEW.year, NEW.year);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER editions_create_partitions AFTER INSERT ON editions
+FOR EACH ROW EXECUTE PROCEDURE create_edition_partitions();
+
+-- An edition for each year there are performances in, the latest of them
+-- current. With none, the one the code used to assume.
+INSERT INTO editions (year, starts_on, ends_on)
+SELECT extract(year FROM local_date)::INTEGER, min(local_date), max(local_date)
+FROM (
+  SELECT (datetime_utc AT TIME ZONE 'Europe/London')::DATE AS local_date
+  FROM performances_unpartitioned WHERE datetime_utc IS NOT NULL
+) performance_dates
+GROUP BY 1;
+
+INSERT INTO editions (year, starts_on, ends_on)
+SELECT 2019, DATE '2019-08-02', DATE '2019-08-26'
+WHERE NOT EXISTS (SELECT 1 FROM editions);
+
+UPDATE editions SET current = TRUE WHERE year = (SELECT max(year) FROM editions);
+
+INSERT INTO performances (id, show_id, datetime_utc, edition)
+SELECT id, show_id, datetime_utc,
+  coalesce(extract(year FROM datetime_utc AT TIME ZONE 'Europe/London')::INTEGER, current_edition())
+FROM performances_unpartitioned;
+
+INSERT INTO sold_out (id, performance_id, edition)
+SELECT sold_out_unpartitioned.id, sold_out_unpartitioned.performance_id, performances.edition
+FROM sold_out_unpartitioned
+INNER JOIN performances ON performances.id = sold_out_unpartitioned.performance_id;
+
+-- Performance interests aren't partitioned, but need the edition to refer to
+-- their performance. They take it from the performance, so code inserting
+-- them doesn't need to know about editions. A performance which doesn't
+-- exist gets the current edition, and fails the foreign key as it used to.
+ALTER TABLE performance_interests ADD COLUMN edition INTEGER;
+
+UPDATE performance_interests SET edition = performances.edition
+FROM performances WHERE performances.id = performance_interests.performance_id;
+
+CREATE OR REPLACE FUNCTION set_performance_interest_edition() RETURNS trigger AS $$
+BEGIN
+  SELECT edition INTO NEW.edition FROM performances WHERE id = NEW.performance_id;
+  IF NEW.edition IS NULL AND NEW.performance_id IS NOT NULL THEN
+    NEW.edition := current_edition();
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER performance_interests_set_edition
+BEFORE INSERT OR UPDATE OF performance_id ON performance_interests
+FOR EACH ROW EXECUTE PROCEDURE set_performance_interest_edition();
+
+DROP TABLE sold_out_unpartitioned;
+ALTER TABLE performance_interests DROP CONSTRAINT performance_interests_performance_id_fkey;
+DROP TABLE performances_unpartitioned;
+
+ALTER TABLE performance_interests ADD CONSTRAINT performance_interests_performance_id_fkey
+FOREIGN KEY (edition, performance_id) REFERENCES performances(edition, id);
+
+-- Sold-out marks are matched to their performance within its edition.
+CREATE OR REPLACE FUNCTION refresh_show_last_bookable(changed_show_ids INTEGER[]) RETURNS void AS $$
+BEGIN
+  -- Concurrent refreshes of a show queue up here, and each of the following
+  -- statements sees what the ones before it committed.
+  PERFORM 1 FROM shows WHERE id = ANY(changed_show_ids) ORDER BY id FOR NO KEY UPDATE;
+  -- Only rows which actually change are written, as writes are notified.
+  DELETE FROM show_last_bookable WHERE show_id = ANY(changed_show_ids) AND NOT EXISTS (
+    SELECT 1 FROM performances LEFT JOIN sold_out ON sold_out.performance_id = performances.id AND sold_out.edition = performances.edition
+    WHERE performances.show_id = show_last_bookable.show_id AND sold_out.id IS NULL
+  );
+  INSERT INTO show_last_bookable (show_id, datetime_utc)
+  SELECT performances.show_id, max(performances.datetime_utc)
+  FROM performances LEFT JOIN sold_out ON sold_out.performance_id = performances.id AND sold_out.edition = performances.edition
+  WHERE performances.show_id = ANY(changed_show_ids) AND sold_out.id IS NULL
+  GROUP BY performances.show_id
+  ON CONFLICT (show_id) DO UPDATE SET datetime_utc = EXCLUDED.datetime_utc
+  WHERE show_last_bookable.datetime_utc IS DISTINCT FROM EXCLUDED.datetime_utc;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sold_out_refresh_last_bookable() RETURNS trigger AS $$
+BEGIN
+  PERFORM refresh_show_last_bookable(array_agg(DISTINCT performances.show_id))
+  FROM changed_rows INNER JOIN performances
+  ON performances.id = changed_rows.performance_id AND performances.edition = changed_rows.edition;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Which edition is current decides what the catalog holds.
+CREATE OR REPLACE FUNCTION notify_changes() RETURNS trigger AS $$
+DECLARE
+  payload TEXT;
+BEGIN
+  SELECT json_build_object(
+    'table', TG_TABLE_NAME,
+    'origin', current_setting('application_name'),
+    'rows', json_agg(row_to_json(changed_rows))
+  )::text INTO payload FROM changed_rows HAVING count(*) > 0;
+  IF payload IS NULL THEN
+    RETURN NULL;
+  END IF;
+  IF TG_TABLE_NAME IN ('shows', 'performances', 'sold_out', 'venues', 'editions') THEN
+    UPDATE catalog_version SET version = version + 1, changed_at = clock_timestamp();
+  END IF;
+  IF octet_length(payload) > 7000 THEN
+    payload := json_build_object(
+      'table', TG_TABLE_NAME,
+      'origin', current_setting('application_name'),
+      'rows', NULL
+    )::text;
+  END IF;
+  PERFORM pg_notify('edfringeplanner_changes', payload);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  table_name TEXT;
+BEGIN
+  FOREACH table_name IN ARRAY ARRAY['performances', 'sold_out', 'editions'] LOOP
+    EXECUTE format('CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE notify_changes()', table_name || '_notify_insert', table_name);
+    EXECUTE format('CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE notify_changes()', table_name || '_notify_update', table_name);
+    EXECUTE format('CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE notify_changes()', table_name || '_notify_delete', table_name);
+  END LOOP;
+  FOREACH table_name IN ARRAY ARRAY['performances', 'sold_out'] LOOP
+    EXECUTE format('CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE %I()', table_name || '_last_bookable_insert', table_name, table_name || '_refresh_last_bookable');
+    EXECUTE format('CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE %I()', table_name || '_last_bookable_update_old', table_name, table_name || '_refresh_last_bookable');
+    EXECUTE format('CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE %I()', table_name || '_last_bookable_update_new', table_name, table_name || '_refresh_last_bookable');
+    EXECUTE format('CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE PROCEDURE %I()', table_name || '_last_bookable_delete', table_name, table_name || '_refresh_last_bookable');
+  END LOOP;
+END;
+$$;
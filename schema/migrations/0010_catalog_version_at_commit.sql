@@ -0,0 +1,54 @@
+-- Bumping catalog_version from notify_changes locked its one row from a
+-- catalog write until the writing transaction ended, so every catalog writer
+-- queued behind any other, including imports which look performances up on
+-- edfringe mid-transaction. The counter is now bumped by deferred triggers,
+-- which run as the transaction commits, so the row is only locked while the
+-- commit happens. It still moves in the changing transaction, so can't be seen
+-- to move before the change itself is visible.
+
+CREATE OR REPLACE FUNCTION notify_changes() RETURNS trigger AS $$
+DECLARE
+  payload TEXT;
+BEGIN
+  SELECT json_build_object(
+    'table', TG_TABLE_NAME,
+    'origin', current_setting('application_name'),
+    'rows', json_agg(row_to_json(changed_rows))
+  )::text INTO payload FROM changed_rows HAVING count(*) > 0;
+  IF payload IS NULL THEN
+    RETURN NULL;
+  END IF;
+  IF octet_length(payload) > 7000 THEN
+    payload := json_build_object(
+      'table', TG_TABLE_NAME,
+      'origin', current_setting('application_name'),
+      'rows', NULL
+    )::text;
+  END IF;
+  PERFORM pg_notify('edfringeplanner_changes', payload);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Deferred triggers have to be row-level, so this runs for every changed row,
+-- but only the first in each transaction updates the counter.
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+BEGIN
+  IF current_setting('edfringeplanner.catalog_version_bumped', true) = 'true' THEN
+    RETURN NULL;
+  END IF;
+  PERFORM set_config('edfringeplanner.catalog_version_bumped', 'true', true);
+  UPDATE catalog_version SET version = version + 1, changed_at = clock_timestamp();
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  table_name TEXT;
+BEGIN
+  FOREACH table_name IN ARRAY ARRAY['shows', 'performances', 'sold_out', 'venues', 'editions'] LOOP
+    EXECUTE format('CREATE CONSTRAINT TRIGGER %I AFTER INSERT OR UPDATE OR DELETE ON %I DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE bump_catalog_version()', table_name || '_bump_catalog_version', table_name);
+  END LOOP;
+END;
+$$;